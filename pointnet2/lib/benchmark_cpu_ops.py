@@ -0,0 +1,83 @@
+"""
+benchmark the cpu pointnet2 ops against the pure torch versions in pointnet2/util.py
+
+python pointnet2/lib/benchmark_cpu_ops.py -b 2 -n 8192 -s 1024 --nsample 32 --radius 0.1
+"""
+from time import time
+import torch
+from pointnet2.lib import pointnet2_cpu
+from pointnet2.util import farthest_point_sample, query_ball_point
+
+
+def _timing(fn, repeat=3):
+    elapsed_list = []
+    for _ in range(repeat):
+        start = time()
+        fn()
+        elapsed_list.append(time() - start)
+    return min(elapsed_list)
+
+
+def benchmark(B=2, N=8192, npoint=1024, nsample=32, radius=0.1, repeat=3, num_threads=None):
+    """
+    :param B: int, batch size
+    :param N: int, number of points
+    :param npoint: int, number of the sampled points (FPS) and of the ball query centers
+    :param nsample: int, max number of the points in a ball
+    :param radius: float, radius of the ball
+    :param repeat: int
+    :param num_threads: int, number of the torch intra-op threads, None to keep the default
+    :return: dict, {op_name: {implementation: time (s)}}
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    xyz = torch.rand(B, N, 3)
+    new_xyz = xyz[:, :npoint].contiguous()
+    features = torch.rand(B, 64, N)
+    idx = torch.randint(0, N, (B, npoint, nsample), dtype=torch.int32)
+    weight = torch.rand(B, N, 3)
+    knn_idx = torch.randint(0, npoint, (B, N, 3), dtype=torch.int32)
+    sparse_features = torch.rand(B, 64, npoint)
+    results = {
+        "furthest_point_sample": {
+            "cpu_op": _timing(lambda: pointnet2_cpu.furthest_point_sampling(xyz, npoint), repeat),
+            "util": _timing(lambda: farthest_point_sample(xyz, npoint), repeat),
+        },
+        "ball_query": {
+            "cpu_op": _timing(lambda: pointnet2_cpu.ball_query(radius, nsample, xyz, new_xyz), repeat),
+            "util": _timing(lambda: query_ball_point(radius, nsample, xyz, new_xyz), repeat),
+        },
+        "three_nn": {
+            "cpu_op": _timing(lambda: pointnet2_cpu.knn(3, xyz, new_xyz), repeat),
+        },
+        "three_interpolate": {
+            "cpu_op": _timing(
+                lambda: pointnet2_cpu.three_interpolate(sparse_features, knn_idx, weight), repeat
+            ),
+        },
+        "grouping_operation": {
+            "cpu_op": _timing(lambda: pointnet2_cpu.group_points(features, idx), repeat),
+        },
+        "gather_operation": {
+            "cpu_op": _timing(lambda: pointnet2_cpu.gather_points(features, idx[..., 0]), repeat),
+        },
+    }
+    print("B={}, N={}, npoint={}, nsample={}, threads={}".format(B, N, npoint, nsample, torch.get_num_threads()))
+    for op_name, timings in results.items():
+        print("{:<22s} {}".format(op_name, ", ".join("{}: {:.4f}s".format(k, v) for k, v in timings.items())))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="benchmark the cpu pointnet2 ops")
+    parser.add_argument("-b", "--batch", type=int, default=2)
+    parser.add_argument("-n", "--num_points", type=int, default=8192)
+    parser.add_argument("-s", "--npoint", type=int, default=1024)
+    parser.add_argument("--nsample", type=int, default=32)
+    parser.add_argument("--radius", type=float, default=0.1)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-t", "--num_threads", type=int, default=None)
+    args = parser.parse_args()
+    benchmark(args.batch, args.num_points, args.npoint, args.nsample, args.radius, args.repeat, args.num_threads)
@@ -0,0 +1,185 @@
+"""
+CPU implementations of the pointnet2 CUDA ops, they follow the semantics of the kernels in src/*.cu
+(FPS starts from the first point, the ball query keeps the first nsample points in index order
+and pads with the first one, ...), so the results match the CUDA ops on the same input.
+
+the ops are vectorized over the batch and the query points, the (query x point) distance
+matrices are computed in chunks of the query points to bound the peak memory,
+the work is spread over the threads of the torch intra-op pool (torch.set_num_threads)
+"""
+from typing import Tuple
+import torch
+
+MAX_CHUNK_BYTES = 256 * 1024 ** 2
+
+
+def _query_chunks(B: int, n_query: int, n_ref: int):
+    chunk_size = max(1, MAX_CHUNK_BYTES // (4 * B * max(n_ref, 1)))
+    for start in range(0, n_query, chunk_size):
+        yield start, min(start + chunk_size, n_query)
+
+
+def _square_distance(query: torch.Tensor, ref: torch.Tensor) -> torch.Tensor:
+    """
+    :param query: (B, S, 3)
+    :param ref: (B, N, 3)
+    :return: (B, S, N)
+    """
+    dist2 = -2 * torch.bmm(query, ref.transpose(1, 2))
+    dist2 += (query ** 2).sum(-1, keepdim=True)
+    dist2 += (ref ** 2).sum(-1).unsqueeze(1)
+    return dist2.clamp_(min=0)
+
+
+def furthest_point_sampling(xyz: torch.Tensor, npoint: int) -> torch.Tensor:
+    """
+    :param xyz: (B, N, 3)
+    :param npoint: int
+    :return: (B, npoint) int tensor
+    """
+    B, N, _ = xyz.size()
+    output = torch.zeros(B, npoint, dtype=torch.int32)
+    if npoint <= 0:
+        return output
+    temp = torch.full((B, N), 1e10, dtype=xyz.dtype)
+    batch_index = torch.arange(B)
+    old = torch.zeros(B, dtype=torch.long)
+    for j in range(1, npoint):
+        dist = ((xyz - xyz[batch_index, old].unsqueeze(1)) ** 2).sum(-1)
+        torch.min(temp, dist, out=temp)
+        old = temp.argmax(-1)
+        output[:, j] = old
+    return output
+
+
+def gather_points(features: torch.Tensor, idx: torch.Tensor) -> torch.Tensor:
+    """
+    :param features: (B, C, N)
+    :param idx: (B, npoint)
+    :return: (B, C, npoint)
+    """
+    B, C, _ = features.size()
+    idx = idx.long().unsqueeze(1).expand(B, C, idx.shape[1])
+    return torch.gather(features, 2, idx)
+
+
+def gather_points_grad(grad_out: torch.Tensor, idx: torch.Tensor, N: int) -> torch.Tensor:
+    """
+    :param grad_out: (B, C, npoint)
+    :param idx: (B, npoint)
+    :param N: int
+    :return: (B, C, N)
+    """
+    B, C, npoint = grad_out.size()
+    grad_features = grad_out.new_zeros(B, C, N)
+    idx = idx.long().unsqueeze(1).expand(B, C, npoint)
+    return grad_features.scatter_add_(2, idx, grad_out)
+
+
+def knn(k: int, unknown: torch.Tensor, known: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    :param k: int
+    :param unknown: (B, N, 3)
+    :param known: (B, M, 3)
+    :return:
+        dist2: (B, N, k) squared l2 distance to the k nearest neighbors
+        idx: (B, N, k) int tensor
+    """
+    B, N, _ = unknown.size()
+    M = known.size(1)
+    dist2 = unknown.new_empty(B, N, k)
+    idx = torch.empty(B, N, k, dtype=torch.int32)
+    for start, end in _query_chunks(B, N, M):
+        chunk_dist2 = _square_distance(unknown[:, start:end], known)
+        chunk_val, chunk_idx = chunk_dist2.topk(k, dim=-1, largest=False, sorted=True)
+        dist2[:, start:end] = chunk_val
+        idx[:, start:end] = chunk_idx
+    return dist2, idx
+
+
+def three_interpolate(features: torch.Tensor, idx: torch.Tensor, weight: torch.Tensor) -> torch.Tensor:
+    """
+    :param features: (B, C, M)
+    :param idx: (B, n, 3)
+    :param weight: (B, n, 3)
+    :return: (B, C, n)
+    """
+    B, C, _ = features.size()
+    n = idx.size(1)
+    idx = idx.long().view(B, 1, n * 3).expand(B, C, n * 3)
+    grouped = torch.gather(features, 2, idx).view(B, C, n, 3)
+    return (grouped * weight.unsqueeze(1)).sum(-1)
+
+
+def three_interpolate_grad(
+    grad_out: torch.Tensor, idx: torch.Tensor, weight: torch.Tensor, m: int
+) -> torch.Tensor:
+    """
+    :param grad_out: (B, C, n)
+    :param idx: (B, n, 3)
+    :param weight: (B, n, 3)
+    :param m: int
+    :return: (B, C, m)
+    """
+    B, C, n = grad_out.size()
+    weighted_grad = (grad_out.unsqueeze(-1) * weight.unsqueeze(1)).view(B, C, n * 3)
+    idx = idx.long().view(B, 1, n * 3).expand(B, C, n * 3)
+    return grad_out.new_zeros(B, C, m).scatter_add_(2, idx, weighted_grad)
+
+
+def group_points(features: torch.Tensor, idx: torch.Tensor) -> torch.Tensor:
+    """
+    :param features: (B, C, N)
+    :param idx: (B, npoint, nsample)
+    :return: (B, C, npoint, nsample)
+    """
+    B, C, _ = features.size()
+    _, npoint, nsample = idx.size()
+    idx = idx.long().view(B, 1, npoint * nsample).expand(B, C, npoint * nsample)
+    return torch.gather(features, 2, idx).view(B, C, npoint, nsample)
+
+
+def group_points_grad(grad_out: torch.Tensor, idx: torch.Tensor, N: int) -> torch.Tensor:
+    """
+    :param grad_out: (B, C, npoint, nsample)
+    :param idx: (B, npoint, nsample)
+    :param N: int
+    :return: (B, C, N)
+    """
+    B, C, npoint, nsample = grad_out.size()
+    idx = idx.long().view(B, 1, npoint * nsample).expand(B, C, npoint * nsample)
+    return grad_out.new_zeros(B, C, N).scatter_add_(
+        2, idx, grad_out.reshape(B, C, npoint * nsample)
+    )
+
+
+def ball_query(radius: float, nsample: int, xyz: torch.Tensor, new_xyz: torch.Tensor) -> torch.Tensor:
+    """
+    the first nsample points (in index order) within the ball are kept, the remaining slots
+    are filled with the first one, a ball without any point gets index 0
+
+    :param radius: float
+    :param nsample: int
+    :param xyz: (B, N, 3)
+    :param new_xyz: (B, npoint, 3)
+    :return: (B, npoint, nsample) int tensor
+    """
+    B, N, _ = xyz.size()
+    npoint = new_xyz.size(1)
+    idx = torch.zeros(B, npoint, nsample, dtype=torch.int32)
+    order = torch.arange(N)
+    k = min(nsample, N)
+    for start, end in _query_chunks(B, npoint, N):
+        in_ball = _square_distance(new_xyz[:, start:end], xyz) < radius ** 2
+        # the index of the points out of the ball is set to N, the k smallest are the first k in the ball
+        candidate = torch.where(in_ball, order, torch.full_like(order, N))
+        candidate = candidate.topk(k, dim=-1, largest=False, sorted=True)[0]
+        if k < nsample:
+            candidate = torch.cat(
+                [candidate, candidate.new_full((B, end - start, nsample - k), N)], -1
+            )
+        first = candidate[..., :1]
+        first = torch.where(first == N, torch.zeros_like(first), first)
+        candidate = torch.where(candidate == N, first.expand_as(candidate), candidate)
+        idx[:, start:end] = candidate.int()
+    return idx
@@ -3,11 +3,20 @@ from torch.autograd import Variable
 from torch.autograd import Function
 import torch.nn as nn
 from typing import Tuple
+from pointnet2.lib import pointnet2_cpu
 try:
     import pointnet2_cuda as pointnet2
-except:
-    print("pointnet2 load failed, please compile it first: python pointnet2/lib/setup.py install")
-    raise ImportError
+except ImportError:
+    # the ops fall back to the cpu implementations, cuda inputs are not supported
+    print("pointnet2 load failed, only the cpu ops are available, to use the cuda ops please compile it first: python pointnet2/lib/setup.py install")
+    pointnet2 = None
+
+
+def use_cuda_op(tensor: torch.Tensor) -> bool:
+    if not tensor.is_cuda:
+        return False
+    assert pointnet2 is not None, "the pointnet2 cuda ops are not compiled, python pointnet2/lib/setup.py install"
+    return True
 
 from shapmagn.utils.knn_utils import AnisoKNN
 class FurthestPointSampling(Function):
@@ -25,6 +34,8 @@ class FurthestPointSampling(Function):
         """
         assert xyz.is_contiguous()
 
+        if not use_cuda_op(xyz):
+            return pointnet2_cpu.furthest_point_sampling(xyz, npoint)
         B, N, _ = xyz.size()
         output = torch.cuda.IntTensor(B, npoint)
         temp = torch.cuda.FloatTensor(B, N).fill_(1e10)
@@ -56,17 +67,20 @@ class GatherOperation(Function):
 
         B, npoint = idx.size()
         _, C, N = features.size()
+        ctx.for_backwards = (idx, C, N)
+        if not use_cuda_op(features):
+            return pointnet2_cpu.gather_points(features, idx)
         output = torch.cuda.FloatTensor(B, C, npoint)
 
         pointnet2.gather_points_wrapper(B, C, N, npoint, features, idx, output)
-
-        ctx.for_backwards = (idx, C, N)
         return output
 
     @staticmethod
     def backward(ctx, grad_out):
         idx, C, N = ctx.for_backwards
         B, npoint = idx.size()
+        if not use_cuda_op(grad_out):
+            return pointnet2_cpu.gather_points_grad(grad_out, idx, N), None
 
         grad_features = Variable(torch.cuda.FloatTensor(B, C, N).zero_())
         grad_out_data = grad_out.data.contiguous()
@@ -92,6 +106,9 @@ class KNN(Function):
         assert unknown.is_contiguous()
         assert known.is_contiguous()
 
+        if not use_cuda_op(unknown):
+            dist2, idx = pointnet2_cpu.knn(k, unknown, known)
+            return torch.sqrt(dist2), idx
         B, N, _ = unknown.size()
         m = known.size(1)
         dist2 = torch.cuda.FloatTensor(B, N, k)
@@ -121,6 +138,9 @@ class ThreeNN(Function):
         assert unknown.is_contiguous()
         assert known.is_contiguous()
 
+        if not use_cuda_op(unknown):
+            dist2, idx = pointnet2_cpu.knn(3, unknown, known)
+            return torch.sqrt(dist2), idx
         B, N, _ = unknown.size()
         m = known.size(1)
         dist2 = torch.cuda.FloatTensor(B, N, 3)
@@ -157,6 +177,8 @@ class ThreeInterpolate(Function):
         B, c, m = features.size()
         n = idx.size(1)
         ctx.three_interpolate_for_backward = (idx, weight, m)
+        if not use_cuda_op(features):
+            return pointnet2_cpu.three_interpolate(features, idx, weight)
         output = torch.cuda.FloatTensor(B, c, n)
 
         pointnet2.three_interpolate_wrapper(B, c, m, n, features, idx, weight, output)
@@ -174,6 +196,8 @@ class ThreeInterpolate(Function):
         """
         idx, weight, m = ctx.three_interpolate_for_backward
         B, c, n = grad_out.size()
+        if not use_cuda_op(grad_out):
+            return pointnet2_cpu.three_interpolate_grad(grad_out, idx, weight, m), None, None
 
         grad_features = Variable(torch.cuda.FloatTensor(B, c, m).zero_())
         grad_out_data = grad_out.data.contiguous()
@@ -201,11 +225,12 @@ class GroupingOperation(Function):
         idx = idx.int()
         B, nfeatures, nsample = idx.size()
         _, C, N = features.size()
+        ctx.for_backwards = (idx, N)
+        if not use_cuda_op(features):
+            return pointnet2_cpu.group_points(features, idx)
         output = torch.cuda.FloatTensor(B, C, nfeatures, nsample)
 
         pointnet2.group_points_wrapper(B, C, N, nfeatures, nsample, features, idx, output)
-
-        ctx.for_backwards = (idx, N)
         return output
 
     @staticmethod
@@ -219,6 +244,8 @@ class GroupingOperation(Function):
         idx, N = ctx.for_backwards
 
         B, C, npoint, nsample = grad_out.size()
+        if not use_cuda_op(grad_out):
+            return pointnet2_cpu.group_points_grad(grad_out, idx, N), None
         grad_features = Variable(torch.cuda.FloatTensor(B, C, N).zero_())
 
         grad_out_data = grad_out.data.contiguous()
@@ -245,6 +272,8 @@ class BallQuery(Function):
         assert new_xyz.is_contiguous()
         assert xyz.is_contiguous()
 
+        if not use_cuda_op(xyz):
+            return pointnet2_cpu.ball_query(radius, nsample, xyz, new_xyz)
         B, N, _ = xyz.size()
         npoint = new_xyz.size(1)
         idx = torch.cuda.IntTensor(B, npoint, nsample).zero_()
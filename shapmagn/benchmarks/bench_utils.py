@@ -0,0 +1,117 @@
+"""
+timing/memory measurement and the json records of the benchmarks
+"""
+import os
+import json
+import time
+import socket
+import platform
+import torch
+
+
+def _synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def measure(fn, npoints, device="cpu", repeat=3, warmup=1):
+    """
+    :param fn: callable without argument, the operation to benchmark
+    :param npoints: int, number of points processed by one call, used for the throughput
+    :param device: str or torch.device
+    :param repeat: int, the best of the repeated runs is recorded
+    :param warmup: int, number of untimed runs, e.g. to exclude the KeOps compilation
+    :return: dict with wall_time (s), points_per_sec and, on gpu, peak_memory_mb (peak allocated cuda memory)
+        the memory is not recorded on cpu, the process peak RSS never decreases, so it can't be attributed to a case
+    """
+    device = torch.device(device)
+    for _ in range(warmup):
+        fn()
+    _synchronize(device)
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+    elapsed_list = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        _synchronize(device)
+        elapsed_list.append(time.perf_counter() - start)
+    wall_time = min(elapsed_list)
+    result = {
+        "wall_time": wall_time,
+        "points_per_sec": npoints / wall_time if wall_time > 0 else float("inf"),
+    }
+    if device.type == "cuda":
+        result["peak_memory_mb"] = torch.cuda.max_memory_allocated(device) / 1024 ** 2
+    return result
+
+
+def get_meta(device):
+    device = torch.device(device)
+    meta = {
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "device": str(device),
+        "num_threads": torch.get_num_threads(),
+    }
+    if device.type == "cuda":
+        meta["gpu"] = torch.cuda.get_device_name(device)
+    return meta
+
+
+def save_records(path, meta, records):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "records": records}, f, indent=2)
+
+
+def load_records(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _record_key(record):
+    return record["suite"], record["name"], record["npoints"]
+
+
+def compare_records(base_path, new_path, threshold=0.1):
+    """
+    compare two benchmark runs, a case is flagged as a regression if its wall time
+    grows by more than threshold (relative)
+
+    :param base_path: str, json of the reference run
+    :param new_path: str, json of the new run
+    :param threshold: float
+    :return: list of the regressed (suite, name, npoints)
+    """
+    base = {_record_key(r): r for r in load_records(base_path)["records"]}
+    new = {_record_key(r): r for r in load_records(new_path)["records"]}
+    regressions = []
+    print(
+        "{:<14s} {:<40s} {:>8s} {:>10s} {:>10s} {:>8s}".format(
+            "suite", "name", "npoints", "base(s)", "new(s)", "ratio"
+        )
+    )
+    for key in sorted(set(base) & set(new)):
+        base_time, new_time = base[key].get("wall_time"), new[key].get("wall_time")
+        if base_time is None or new_time is None:
+            continue
+        ratio = new_time / base_time if base_time > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(
+            "{:<14s} {:<40s} {:>8d} {:>10.4f} {:>10.4f} {:>8.2f}{}".format(
+                key[0], key[1], key[2], base_time, new_time, ratio, flag
+            )
+        )
+    for key in sorted(set(base) ^ set(new)):
+        print("{} is only recorded in {}".format(key, "base" if key in base else "new"))
+    print("{} regressions over {:.0%}".format(len(regressions), threshold))
+    return regressions
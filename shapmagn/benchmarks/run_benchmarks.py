@@ -0,0 +1,296 @@
+"""
+throughput benchmarks of the registration models, kernels, samplers and interpolators
+
+each case runs on the synthetic shapes of synthetic_shapes.py, the wall time, the peak memory (gpu only)
+and the points/sec are recorded into a json file, two json files can be compared to flag the regressions
+
+python -m shapmagn.benchmarks.run_benchmarks -o bench.json --suites kernels samplers -n 1000 10000 100000
+python -m shapmagn.benchmarks.run_benchmarks --compare base.json bench.json --threshold 0.1
+"""
+import sys
+import tempfile
+import traceback
+from functools import partial
+import torch
+from shapmagn.benchmarks.bench_utils import (
+    measure,
+    get_meta,
+    save_records,
+    compare_records,
+)
+from shapmagn.benchmarks.synthetic_shapes import make_shape_pair
+from shapmagn.utils.module_parameters import ParameterDict
+
+DEFAULT_SIZES = [1000, 10000, 100000, 500000]
+# the dense torch kernels allocate a NxN matrix, they are skipped above this size
+MAX_DENSE_POINTS = 20000
+# one optimization step of the models is slow, they are skipped above this size
+MAX_MODEL_POINTS = 100000
+
+GEOMLOSS_OBJ = "geomloss.SamplesLoss(loss='sinkhorn',blur=0.01, scaling=0.8,reach=1,debias=False,backend='online')"
+KEOPS_KERNEL_OBJ = "keops_kernels.LazyKeopsKernel(kernel_type='multi_gauss', sigma_list=[0.05,0.1,0.2],weight_list=[0.2,0.3,0.5])"
+
+
+def _kernel_inputs(kernel_type, points, target_points):
+    if kernel_type in ["gauss", "multi_gauss"]:
+        return points, target_points, torch.randn_like(target_points)
+    if kernel_type in ["gauss_grad", "multi_gauss_grad"]:
+        return (
+            torch.randn_like(points),
+            points,
+            torch.randn_like(target_points),
+            target_points,
+        )
+    if kernel_type == "gauss_lin":
+        return (
+            points,
+            target_points,
+            torch.randn_like(points),
+            torch.randn_like(target_points),
+            torch.randn_like(target_points[..., :1]),
+        )
+    raise ValueError("{} is not supported".format(kernel_type))
+
+
+def kernel_cases(npoints, device):
+    from shapmagn.kernels.torch_kernels import TorchKernel
+    from shapmagn.kernels.keops_kernels import LazyKeopsKernel
+
+    kernel_settings = {
+        "gauss": {"sigma": 0.1},
+        "multi_gauss": {"sigma_list": [0.05, 0.1, 0.2], "weight_list": [0.2, 0.3, 0.5]},
+        "gauss_grad": {"sigma": 0.1},
+        "gauss_lin": {"sigma": 0.1},
+    }
+    shape_pair = make_shape_pair("sphere", npoints, device=device)
+    points, target_points = shape_pair.source.points, shape_pair.target.points
+    for kernel_type, kernel_args in kernel_settings.items():
+        inputs = _kernel_inputs(kernel_type, points, target_points)
+        backends = [("keops", LazyKeopsKernel)]
+        if npoints <= MAX_DENSE_POINTS:
+            backends.append(("torch", TorchKernel))
+        for backend, kernel_class in backends:
+            name = "{}_{}".format(backend, kernel_type)
+            yield name, partial(_call_kernel, kernel_class, kernel_type, kernel_args, inputs)
+
+
+def _call_kernel(kernel_class, kernel_type, kernel_args, inputs):
+    return kernel_class(kernel_type, **kernel_args)(*inputs)
+
+
+def sampler_cases(npoints, device):
+    from shapmagn.shape import point_sampler
+
+    shape_pair = make_shape_pair("torus", npoints, device=device)
+    points, weights = shape_pair.source.points, shape_pair.source.weights
+    num_sample = max(npoints // 10, 1)
+    # the point_* samplers take a Shape, the batch_* samplers take the points and the weights
+    shape_samplers = {
+        "grid": point_sampler.point_grid_sampler(scale=0.05),
+        "uniform": point_sampler.point_uniform_sampler(num_sample),
+    }
+    if npoints <= MAX_MODEL_POINTS:
+        shape_samplers["fps"] = point_sampler.point_fps_sampler(num_sample)
+    for name, sampler in shape_samplers.items():
+        yield name, partial(sampler, shape_pair.source)
+    batch_samplers = {
+        "batch_grid": point_sampler.batch_grid_sampler(scale=0.05),
+        "batch_uniform": point_sampler.batch_uniform_sampler(num_sample),
+    }
+    for name, sampler in batch_samplers.items():
+        yield name, partial(sampler, points, weights)
+
+
+def interpolator_cases(npoints, device):
+    from shapmagn.shape import point_interpolator
+
+    shape_pair = make_shape_pair("ellipsoid", npoints, device=device)
+    points, weights = shape_pair.source.points, shape_pair.source.weights
+    control_points = points[:, ::10].contiguous()
+    control_weights = weights[:, ::10].contiguous()
+    control_value = torch.randn_like(control_points)
+    nadwat_interpolators = {
+        "nadwat": point_interpolator.nadwat_kernel_interpolator(scale=0.05, exp_order=2),
+        "nadwat_sparse": point_interpolator.nadwat_kernel_interpolator(
+            scale=0.05, exp_order=2, kernel_truncate_sigma=3.0
+        ),
+    }
+    for name, interp in nadwat_interpolators.items():
+        yield name, partial(interp, points, control_points, control_value, control_weights)
+    knn_interp = point_interpolator.KNNInterpolater(initial_radius=0.05)
+    yield "knn", partial(knn_interp, points, control_points, control_value)
+
+
+def get_model_opt(model_name):
+    """
+    the settings of the models follow the demos, with a single optimization step in mind
+    """
+    model_opt = ParameterDict()
+    model_opt["print_step"] = 1000000
+    if model_name == "prealign_opt":
+        model_opt["module_type"] = "gradflow_prealign"
+        model_opt[("gradflow_prealign", {}, "settings for gradflow_prealign")]
+        model_opt["gradflow_prealign"]["method_name"] = "affine"
+        model_opt["gradflow_prealign"]["gradflow_mode"] = "grad_forward"
+        model_opt["gradflow_prealign"]["niter"] = 1
+        model_opt["gradflow_prealign"]["search_init_transform"] = False
+        model_opt["gradflow_prealign"][("geomloss", {}, "settings for geomloss")]
+        model_opt["gradflow_prealign"]["geomloss"]["mode"] = "flow"
+        model_opt["gradflow_prealign"]["geomloss"]["geom_obj"] = GEOMLOSS_OBJ
+    elif model_name == "lddmm_opt":
+        model_opt["module"] = "hamiltonian"
+        model_opt[("hamiltonian", {}, "settings for hamiltonian")]
+        model_opt["hamiltonian"]["kernel"] = KEOPS_KERNEL_OBJ
+    elif model_name == "discrete_flow_opt":
+        model_opt[
+            "spline_kernel_obj"
+        ] = "point_interpolator.NadWatIsoSpline(kernel_scale=[0.05,0.08, 0.1],kernel_weight=[0.1,0.3,0.6], exp_order=2)"
+        model_opt[
+            "interp_kernel_obj"
+        ] = "point_interpolator.nadwat_kernel_interpolator(exp_order=2)"
+    elif model_name in ["gradient_flow_opt", "barycenter_opt"]:
+        model_opt[
+            "interpolator_obj"
+        ] = "point_interpolator.nadwat_kernel_interpolator(scale=0.1, exp_order=2)"
+    model_opt[("sim_loss", {}, "settings for sim_loss_opt")]
+    model_opt["sim_loss"]["loss_list"] = ["geomloss"]
+    model_opt["sim_loss"][("geomloss", {}, "settings for geomloss")]
+    model_opt["sim_loss"]["geomloss"]["attr"] = "points"
+    model_opt["sim_loss"]["geomloss"]["geom_obj"] = GEOMLOSS_OBJ
+    return model_opt
+
+
+MODEL_NAMES = [
+    "lddmm_opt",
+    "discrete_flow_opt",
+    "gradient_flow_opt",
+    "prealign_opt",
+    "barycenter_opt",
+]
+
+
+def _model_step(model, shape_pair):
+    energy = model(shape_pair)
+    if energy.requires_grad:
+        energy.sum().backward()
+    return energy
+
+
+def model_cases(npoints, device):
+    """
+    one step of each model, i.e. the forward and the backward of the energy
+    """
+    from shapmagn.global_variable import MODEL_POOL
+
+    if npoints > MAX_MODEL_POINTS:
+        return
+    record_path = tempfile.mkdtemp(prefix="shapmagn_bench_")
+    for model_name in MODEL_NAMES:
+        model = MODEL_POOL[model_name](get_model_opt(model_name)).to(device)
+        model.set_record_path(record_path)
+        shape_pair = make_shape_pair("sphere", npoints, device=device)
+        model.init_reg_param(shape_pair)
+        yield model_name, partial(_model_step, model, shape_pair)
+
+
+SUITES = {
+    "kernels": kernel_cases,
+    "samplers": sampler_cases,
+    "interpolators": interpolator_cases,
+    "models": model_cases,
+}
+
+
+def run_benchmarks(
+    suites=tuple(SUITES), sizes=DEFAULT_SIZES, device="cpu", repeat=3, warmup=1, output_path=None
+):
+    """
+    :param suites: list of the suite names, see SUITES
+    :param sizes: list of the number of points
+    :param device: str
+    :param repeat: int
+    :param warmup: int
+    :param output_path: str, the json file to save the records
+    :return: list of records, a failed case (e.g. out of memory) is recorded with its error,
+        the command line run exits with an error status if any case failed (unless --allow_errors)
+    """
+    records = []
+    for suite in suites:
+        for npoints in sizes:
+            cases = SUITES[suite](npoints, device)
+            while True:
+                record = {"suite": suite, "npoints": npoints}
+                try:
+                    name, fn = next(cases)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    # the setup of the suite failed, e.g. a missing optional package
+                    record.update(name="setup", error=repr(e))
+                    records.append(record)
+                    traceback.print_exc()
+                    break
+                record["name"] = name
+                try:
+                    record.update(measure(fn, npoints, device, repeat, warmup))
+                except Exception as e:
+                    record["error"] = repr(e)
+                    traceback.print_exc()
+                    if device.startswith("cuda"):
+                        torch.cuda.empty_cache()
+                records.append(record)
+                print(
+                    "{:<14s} {:<24s} {:>8d} {}".format(
+                        suite,
+                        name,
+                        npoints,
+                        record.get("error")
+                        or "{:.4f}s, {}{:.3g} points/s".format(
+                            record["wall_time"],
+                            "{:.1f}MB, ".format(record["peak_memory_mb"])
+                            if "peak_memory_mb" in record
+                            else "",
+                            record["points_per_sec"],
+                        ),
+                    )
+                )
+    if output_path is not None:
+        save_records(output_path, get_meta(device), records)
+    return records
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="shapmagn throughput benchmarks")
+    parser.add_argument("-o", "--output", type=str, default="./benchmark.json")
+    parser.add_argument("--suites", nargs="+", default=list(SUITES), choices=list(SUITES))
+    parser.add_argument("-n", "--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("-d", "--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    parser.add_argument("-w", "--warmup", type=int, default=1)
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BASE", "NEW"), default=None,
+        help="compare two json records instead of running the benchmarks",
+    )
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown flagged as regression")
+    parser.add_argument(
+        "--allow_errors", action="store_true",
+        help="exit normally even if some cases failed, e.g. out of memory on the largest sizes",
+    )
+    args = parser.parse_args()
+    if args.compare is not None:
+        regressions = compare_records(*args.compare, threshold=args.threshold)
+        sys.exit(1 if regressions else 0)
+    records = run_benchmarks(
+        args.suites, args.sizes, args.device, args.repeat, args.warmup, args.output
+    )
+    failed = [record for record in records if "error" in record]
+    if failed and not args.allow_errors:
+        for record in failed:
+            print(
+                "failed: {} {} {}: {}".format(
+                    record["suite"], record["name"], record["npoints"], record["error"]
+                )
+            )
+        sys.exit(1)
@@ -0,0 +1,83 @@
+"""
+reproducible synthetic point clouds for the benchmarks
+
+every shape is generated from its own numpy RandomState, so the same (shape, npoints, seed)
+always gives the same points, independently of the global random state
+"""
+import numpy as np
+import torch
+
+
+def make_sphere_points(npoints, radius=1.0, seed=0):
+    rng = np.random.RandomState(seed)
+    points = rng.randn(npoints, 3)
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    return (points * radius).astype(np.float32)
+
+
+def make_ellipsoid_points(npoints, radius=(1.0, 0.7, 0.5), seed=0):
+    return make_sphere_points(npoints, seed=seed) * np.array(radius, dtype=np.float32)
+
+
+def make_torus_points(npoints, major_radius=1.0, minor_radius=0.3, seed=0):
+    rng = np.random.RandomState(seed)
+    theta = rng.uniform(0, 2 * np.pi, npoints)
+    phi = rng.uniform(0, 2 * np.pi, npoints)
+    ring = major_radius + minor_radius * np.cos(phi)
+    points = np.stack(
+        [ring * np.cos(theta), ring * np.sin(theta), minor_radius * np.sin(phi)], 1
+    )
+    return points.astype(np.float32)
+
+
+SHAPE_GENERATORS = {
+    "sphere": make_sphere_points,
+    "ellipsoid": make_ellipsoid_points,
+    "torus": make_torus_points,
+}
+
+
+def deform_points(points, scale=0.1, seed=1):
+    """
+    a smooth synthetic deformation: a random affine transform plus a low frequency displacement
+
+    :param points: Nx3 array
+    :param scale: float, magnitude of the deformation
+    :param seed: int
+    :return: Nx3 array
+    """
+    rng = np.random.RandomState(seed)
+    affine = np.eye(3) + scale * rng.randn(3, 3)
+    translation = scale * rng.randn(3)
+    freq = rng.randn(3, 3)
+    phase = rng.uniform(0, 2 * np.pi, 3)
+    disp = scale * np.sin(points @ freq + phase)
+    return (points @ affine.T + translation + disp).astype(np.float32)
+
+
+def make_shape_pair(shape_name="sphere", npoints=1000, batch_size=1, device="cpu", seed=0):
+    """
+    :param shape_name: str, one of SHAPE_GENERATORS
+    :param npoints: int
+    :param batch_size: int, the batch is made of the same pair
+    :param device: str or torch.device
+    :param seed: int
+    :return: ShapePair, the target is a smooth deformation of the source sampled with another seed
+    """
+    from shapmagn.global_variable import Shape
+    from shapmagn.shape.shape_pair_utils import create_shape_pair
+
+    generate = SHAPE_GENERATORS[shape_name]
+    source_points = generate(npoints, seed=seed)
+    target_points = deform_points(generate(npoints, seed=seed + 1), seed=seed + 2)
+
+    def to_shape(points):
+        points = torch.from_numpy(points).to(device)[None].repeat(batch_size, 1, 1)
+        weights = torch.ones(batch_size, npoints, 1, device=device) / npoints
+        shape = Shape()
+        shape.set_data(points=points, weights=weights)
+        return shape
+
+    shape_pair = create_shape_pair(to_shape(source_points), to_shape(target_points))
+    shape_pair.pair_name = ["{}_{}".format(shape_name, npoints)] * batch_size
+    return shape_pair
@@ -1,7 +1,16 @@
 import torch
 import numpy as np
+from torch.utils.data.distributed import DistributedSampler
 from shapmagn.global_variable import DATASET_POOL
 from shapmagn.utils.obj_factory import partial_obj_factory
+from shapmagn.datasets.data_utils import ragged_shape_pair_collate
+from shapmagn.datasets.mixed_pair_generator import HybirdDataCollate
+from shapmagn.utils.distributed import is_distributed
+
+
+def _worker_init_fn(worker_id, base_seed=12):
+    # a module level function, the "spawn" dataloader workers need to pickle it
+    np.random.seed(base_seed + worker_id)
 
 # todo reformat the import style
 class DataManager(object):
@@ -32,17 +41,17 @@ class DataManager(object):
         """
         self.data_opt = data_opt
 
-    def init_dataset_loader(self, transformed_dataset, batch_size):
+    def init_dataset_loader(
+        self, transformed_dataset, batch_size, prepare_input_obj="", device=None
+    ):
         """
         initialize the data loaders: set work number, set work type( shuffle for trainning, order for others)
         :param transformed_dataset:
         :param batch_size: the batch size of each iteration
+        :param prepare_input_obj: str, if given, the input preparation (e.g. HybirdData synthesis) runs in the workers
+        :param device: torch.device, the task device, the default device of the input preparation
         :return: dict of dataloaders for train|val|test|debug
         """
-
-        def _init_fn(worker_id):
-            np.random.seed(12 + worker_id)
-
         num_workers_reg = {
             "train": 8,
             "val": 8,
@@ -50,6 +59,13 @@ class DataManager(object):
             "debug": 4,
         }  # {'train':0,'val':0,'test':0,'debug':0}#{'train':8,'val':4,'test':4,'debug':4}
         shuffle_list = {"train": True, "val": False, "test": False, "debug": False}
+        ragged_batch = self.data_opt[
+            (
+                "ragged_batch",
+                False,
+                "pack pairs of different sizes into one batch, points are zero padded with zero weights",
+            )
+        ]
         batch_size = (
             [batch_size] * 4 if not isinstance(batch_size, list) else batch_size
         )
@@ -59,46 +75,102 @@ class DataManager(object):
             "test": batch_size[2],
             "debug": batch_size[3],
         }
+        collate_fn = ragged_shape_pair_collate if ragged_batch else None
+        loader_kwargs = {x: {"collate_fn": collate_fn} for x in self.phases}
+        if prepare_input_obj:
+            prepare_input_device = self.data_opt[
+                (
+                    "prepare_input_device",
+                    "",
+                    "device of the input preparation in the DataLoader workers, '' to use the task device",
+                )
+            ]
+            if not prepare_input_device:
+                prepare_input_device = str(device) if device is not None else "cpu"
+            prefetch_factor = self.data_opt[
+                (
+                    "prefetch_factor",
+                    2,
+                    "number of prepared batches buffered by each DataLoader worker",
+                )
+            ]
+            prepare_input_seed = self.data_opt[
+                (
+                    "prepare_input_seed",
+                    0,
+                    "base seed of the input preparation, each batch is seeded from it, the phase, the epoch and the sample indices",
+                )
+            ]
+            for x in self.phases:
+                loader_kwargs[x]["collate_fn"] = HybirdDataCollate(
+                    prepare_input_obj,
+                    phase=x,
+                    device=prepare_input_device,
+                    base_seed=prepare_input_seed,
+                    collate_fn=collate_fn,
+                )
+                if (
+                    num_workers_reg[x] > 0
+                    and torch.device(prepare_input_device).type == "cuda"
+                ):
+                    # cuda (and keops on cuda) can't be initialized in forked workers
+                    loader_kwargs[x]["multiprocessing_context"] = "spawn"
+                    loader_kwargs[x]["prefetch_factor"] = prefetch_factor
+        if is_distributed() and "train" in self.phases:
+            # each process iterates its own shard of the training set, the val/debug/test phases run on the rank 0
+            loader_kwargs["train"]["sampler"] = DistributedSampler(
+                transformed_dataset["train"], shuffle=True
+            )
+            shuffle_list["train"] = False
         dataloaders = {
             x: torch.utils.data.DataLoader(
                 transformed_dataset[x],
                 batch_size=batch_size[x],
                 shuffle=shuffle_list[x],
                 num_workers=num_workers_reg[x],
-                worker_init_fn=_init_fn,
+                worker_init_fn=_worker_init_fn,
                 pin_memory=True,
+                **loader_kwargs[x]
             )
             for x in self.phases
         }
         return dataloaders
 
-    def build_data_loaders(self, batch_size=20, is_train=True):
+    def build_dataset(self, phase):
+        """
+        build the dataset of a given phase
+        :param phase: 'train'/'val'/'test'/'debug'
+        :return: dataset
+        """
+        name = self.data_opt["name"]
+        dataset_opt = self.data_opt[(name, {}, "settings for {} dataset".format(name))]
+        assert name in DATASET_POOL, "{} not in dataset pool {}".format(
+            name, DATASET_POOL
+        )
+        if name!="custom_dataset":
+            return DATASET_POOL[name](self.data_path, dataset_opt, phase=phase)
+        else:
+            return partial_obj_factory(dataset_opt["name"])(self.data_path, dataset_opt, phase=phase)
+
+    def build_data_loaders(
+        self, batch_size=20, is_train=True, prepare_input_obj="", device=None
+    ):
         """
         build the data_loaders for the train phase and the test phase
         :param batch_size: the batch size for each iteration
         :param is_train: in train mode or not
+        :param prepare_input_obj: str, if given, the input preparation runs in the DataLoader workers
+        :param device: torch.device, the task device
         :return: dict of dataloaders for train phase or the test phase
         """
         if is_train:
             self.phases = ["train", "val", "debug"]
         else:
             self.phases = ["test"]
-        name = self.data_opt["name"]
-        dataset_opt = self.data_opt[(name, {}, "settings for {} dataset".format(name))]
-        assert name in DATASET_POOL, "{} not in dataset pool {}".format(
-            name, DATASET_POOL
+        transformed_dataset = {phase: self.build_dataset(phase) for phase in self.phases}
+        dataloaders = self.init_dataset_loader(
+            transformed_dataset, batch_size, prepare_input_obj, device
         )
-        if name!="custom_dataset":
-            transformed_dataset = {
-                phase: DATASET_POOL[name](self.data_path, dataset_opt, phase=phase)
-                for phase in self.phases
-            }
-        else:
-            transformed_dataset = {
-                phase: partial_obj_factory(dataset_opt["name"])(self.data_path, dataset_opt, phase=phase)
-                for phase in self.phases
-            }
-        dataloaders = self.init_dataset_loader(transformed_dataset, batch_size)
         dataloaders["data_size"] = {
             phase: len(dataloaders[phase]) for phase in self.phases
         }
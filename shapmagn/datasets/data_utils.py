@@ -24,6 +24,38 @@ def split_dict(dict_to_split, split_num):
     return split_dict
 
 
+def ragged_shape_pair_collate(batch):
+    """
+    collate shape pairs of different sizes into one batch,
+    the point-indexed arrays of the source and the target are zero padded to the max number of points in the batch,
+    the padded points get zero weights, so they are inert in the measure based losses and samplers
+
+    :param batch: list of pair dict, {"source": source_dict, "target":target_dict, ...}
+    :return: collated pair dict
+    """
+    from torch.utils.data.dataloader import default_collate
+
+    def pad(item, npoints, max_len):
+        if isinstance(item, dict):
+            return {key: pad(_item, npoints, max_len) for key, _item in item.items()}
+        if (
+            isinstance(item, torch.Tensor)
+            and item.dim() > 0
+            and item.shape[0] == npoints
+            and npoints < max_len
+        ):
+            zeros = item.new_zeros((max_len - npoints,) + tuple(item.shape[1:]))
+            return torch.cat([item, zeros], 0)
+        return item
+
+    for shape_key in ["source", "target"]:
+        max_len = max(sample[shape_key]["points"].shape[0] for sample in batch)
+        for sample in batch:
+            npoints = sample[shape_key]["points"].shape[0]
+            sample[shape_key] = pad(sample[shape_key], npoints, max_len)
+    return default_collate(batch)
+
+
 def make_dir(path):
     is_exist = os.path.exists(path)
     if not is_exist:
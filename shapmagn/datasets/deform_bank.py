@@ -0,0 +1,261 @@
+"""
+a bank of pre-generated synthetic displacement fields
+
+the spline based synthesizers (e.g. lung_data_aug.lung_synth_data) recompute an expensive deformation for every sample,
+while an enlarged dataset (enlarge_dataset_size_by_factor) only contains a few hundred shapes.
+the bank generates num_deform_per_shape displacement fields the first time a shape is seen and saves them as
+bank_path/{key}.npy (float16, NxD per field) together with the points they are defined on (bank_path/{key}_points.npy),
+later requests read a random field from the memory map, so the synthesis of a sample is an index lookup plus an add;
+the recently used fields are kept decoded in a LRU in-memory tier.
+
+a shape is keyed by its name, so the random (re)samplings of a shape share their entry: if the requested points
+are not the banked ones, the displacement of each point is taken from its nearest banked point.
+without a name, the shape is keyed by the hash of its points.
+the bank keeps at most max_num_shapes entries, the least recently written ones are removed first.
+
+the bank is shared by the DataLoader workers, a field file is written atomically, the worst case of two workers
+meeting the same new shape is a duplicated generation
+"""
+import os
+import glob
+import random
+import hashlib
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import torch
+
+POINTS_SUFFIX = "_points"
+
+
+def get_points_hash(points):
+    """
+    :param points: torch.tensor, NxD
+    :return: str
+    """
+    array = points.detach().contiguous().cpu().float().numpy()
+    sha = hashlib.sha1()
+    sha.update(str(array.shape).encode())
+    sha.update(array.tobytes())
+    return sha.hexdigest()[:16]
+
+
+def get_name_hash(name):
+    """
+    :param name: str, shape name
+    :return: str
+    """
+    return hashlib.sha1(str(name).encode()).hexdigest()[:16]
+
+
+class DeformBank(object):
+    def __init__(
+        self,
+        bank_path,
+        deform_fn,
+        num_deform_per_shape=16,
+        cache_size=32,
+        max_num_shapes=1000,
+    ):
+        """
+        :param bank_path: str, folder of the displacement fields, should be specific to the deformation settings
+        :param deform_fn: deform_fn(points, weights) -> deformed points, NxD, called num_deform_per_shape times for a new shape
+        :param num_deform_per_shape: int, number of displacement fields generated for each shape
+        :param cache_size: int, number of decoded displacement fields kept in memory
+        :param max_num_shapes: int, max number of shapes kept in the bank folder
+        """
+        self.bank_path = bank_path
+        self.deform_fn = deform_fn
+        self.num_deform_per_shape = num_deform_per_shape
+        self.cache_size = cache_size
+        self.max_num_shapes = max_num_shapes
+        self.bank = OrderedDict()
+        self.cache = OrderedDict()
+        os.makedirs(bank_path, exist_ok=True)
+
+    def get_path(self, key):
+        return os.path.join(self.bank_path, key + ".npy")
+
+    def get_points_path(self, key):
+        return os.path.join(self.bank_path, key + POINTS_SUFFIX + ".npy")
+
+    def generate(self, points, weights):
+        disp_list = []
+        for _ in range(self.num_deform_per_shape):
+            deformed_points = self.deform_fn(points, weights)
+            disp_list.append((deformed_points - points).detach().cpu().numpy())
+        return np.stack(disp_list).astype(np.float16)
+
+    def _save_array(self, path, array):
+        fd, tmp_path = tempfile.mkstemp(dir=self.bank_path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+    def save(self, key, disp, points):
+        # the field file is written last, its presence marks a complete entry
+        self._save_array(
+            self.get_points_path(key), points.detach().cpu().float().numpy()
+        )
+        self._save_array(self.get_path(key), disp)
+        self.evict()
+
+    def evict(self):
+        """
+        remove the least recently written shapes beyond max_num_shapes,
+        the memory maps already opened by other workers stay valid
+        """
+        path_list = [
+            path
+            for path in glob.glob(os.path.join(self.bank_path, "*.npy"))
+            if not path.endswith(POINTS_SUFFIX + ".npy")
+        ]
+        if len(path_list) <= self.max_num_shapes:
+            return
+        mtime_list = []
+        for path in path_list:
+            try:
+                mtime_list.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        mtime_list.sort()
+        for _, path in mtime_list[: len(mtime_list) - self.max_num_shapes]:
+            for _path in [path, path[: -len(".npy")] + POINTS_SUFFIX + ".npy"]:
+                try:
+                    os.remove(_path)
+                except OSError:
+                    pass
+
+    def open(self, key, points, weights):
+        """
+        :return: the banked points, torch.tensor NxD, and the memory map of the fields, num_deform x N x D
+        """
+        if key in self.bank:
+            self.bank.move_to_end(key)
+            return self.bank[key]
+        path = self.get_path(key)
+        try:
+            entry = (
+                torch.from_numpy(np.load(self.get_points_path(key))),
+                np.load(path, mmap_mode="r"),
+            )
+        except (IOError, ValueError):
+            # a new shape, or an entry removed by the eviction of another worker
+            self.save(key, self.generate(points, weights), points)
+            entry = (
+                points.detach().cpu().float(),
+                np.load(path, mmap_mode="r"),
+            )
+        self.bank[key] = entry
+        if len(self.bank) > self.max_num_shapes:
+            self.bank.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def transfer(bank_points, disp, points):
+        """
+        the displacement of each point is the one of its nearest banked point
+        """
+        if bank_points.shape == points.shape and torch.equal(bank_points, points):
+            return disp
+        from shapmagn.utils.knn_utils import NN
+
+        nn_index = NN(return_value=False)(
+            points[None].contiguous(), bank_points[None].contiguous()
+        )
+        return disp[nn_index.view(-1)]
+
+    def __call__(self, points, weights, name=None):
+        """
+        :param points: torch.tensor, NxD
+        :param weights: torch.tensor, Nx1
+        :param name: str, shape name, the key of the shape in the bank
+        :return: torch.tensor, NxD, a random displacement field of the shape
+        """
+        key = get_name_hash(name) if name is not None else get_points_hash(points)
+        index = random.randrange(self.num_deform_per_shape)
+        bank_points, disp_bank = self.open(key, points, weights)
+        if (key, index) in self.cache:
+            self.cache.move_to_end((key, index))
+            disp = self.cache[(key, index)]
+        else:
+            disp = torch.from_numpy(disp_bank[index % len(disp_bank)].astype(np.float32))
+            self.cache[(key, index)] = disp
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        disp = disp.to(points.device)
+        return self.transfer(bank_points.to(points.device), disp, points.float())
+
+
+def get_deform_bank(aug_settings, spline_aug, **kwargs):
+    """
+    if deform_bank_path is given, the spline deformations (local and grid) are drawn from a DeformBank,
+    the rigid and the point augmentations are still random for each sample
+    the bank folder is specific to the deformation settings
+
+    :param aug_settings: ParameterDict, settings of the synthesizer
+    :param spline_aug: SplineAug
+    :param kwargs: deform_bank_path, num_deform_per_shape (16), deform_bank_cache_size (64),
+        deform_bank_max_num_shapes (1000)
+    :return: DeformBank or None
+    """
+    from shapmagn.utils.reg_result_store import get_settings_hash
+
+    deform_bank_path = kwargs.get("deform_bank_path", None)
+    if not deform_bank_path:
+        return None
+    settings_hash = get_settings_hash(
+        aug_settings["do_local_deform_aug"],
+        aug_settings["do_grid_aug"],
+        aug_settings["local_deform_aug"],
+        aug_settings["grid_spline_aug"],
+    )
+
+    def deform(points, weights):
+        deformed_points = points
+        if spline_aug.do_local_deform_aug:
+            deformed_points, _, _ = spline_aug.local_deform_spline_deform(
+                deformed_points, weights
+            )
+        if spline_aug.do_grid_aug:
+            deformed_points, _, _ = spline_aug.grid_spline_deform(deformed_points, weights)
+        return deformed_points
+
+    return DeformBank(
+        os.path.join(deform_bank_path, settings_hash),
+        deform,
+        num_deform_per_shape=kwargs.get("num_deform_per_shape", 16),
+        cache_size=kwargs.get("deform_bank_cache_size", 64),
+        max_num_shapes=kwargs.get("deform_bank_max_num_shapes", 1000),
+    )
+
+
+def synth_via_deform_bank(
+    data_dict, synth_info, deform_bank, spline_aug, point_aug, aug_settings, name_list=None
+):
+    """
+    the same synthesis as the spline augmentation, but the displacement is read from the bank:
+    a banked displacement of the raw shape + point augmentation + rigid augmentation,
+    the displacement follows the points kept by the point augmentation (corr_index)
+
+    :param name_list: list of str, shape names of the batch, the keys of the bank
+    """
+    points, weights = data_dict["points"], data_dict["weights"]
+    name_list = [None] * len(points) if name_list is None else name_list
+    disp = torch.stack(
+        [
+            deform_bank(_points, _weights, _name)
+            for _points, _weights, _name in zip(points, weights, name_list)
+        ]
+    ).to(points.dtype)
+    if aug_settings["do_point_aug"]:
+        points, weights, corr_index = point_aug(points, weights)
+        synth_info["corr_index"] = corr_index
+        disp = torch.gather(
+            disp, 1, corr_index[..., None].expand(-1, -1, disp.shape[-1])
+        )
+    points = points + disp
+    if aug_settings["do_rigid_aug"]:
+        points = torch.stack([spline_aug.rigid_deform(_points)[0] for _points in points])
+    data_dict["points"], data_dict["weights"] = points, weights
+    return data_dict, synth_info
@@ -1,17 +1,13 @@
 from __future__ import print_function, division
 import os
 import time
-import blosc
 import torch
 import random
 import numpy as np
-from shapmagn.datasets.data_utils import read_json_into_list, split_dict
+from shapmagn.datasets.data_utils import read_json_into_list
+from shapmagn.datasets.shape_store import build_shape_store
 from torch.utils.data import Dataset
 from shapmagn.utils.obj_factory import obj_factory
-from multiprocessing import *
-
-blosc.set_nthreads(1)
-from tqdm import tqdm
 
 
 class GeneralDataset(Dataset):
@@ -42,25 +38,7 @@ class GeneralDataset(Dataset):
         self.file_list = []
         self.get_file_list()
         self.reg_option = option
-        self.reader = obj_factory(option[("reader", "", "a reader instance")])
-        self.sampler = obj_factory(
-            option[
-                (
-                    "sampler",
-                    "",
-                    "a sampler instance, the goal of sampling here is for batch consistency, where we pick the same index order from the source and the target",
-                )
-            ]
-        )
-        self.normalizer = obj_factory(
-            option[("normalizer", "", "a normalizer instance")]
-        )
-        shape_postprocess_obj = option[
-            ("shape_postprocess_obj", "", "a file_postprocess instance")
-        ]
-        self.shape_postprocess = (
-            obj_factory(shape_postprocess_obj) if shape_postprocess_obj else None
-        )
+        self._init_processors()
         load_training_data_into_memory = option[
             (
                 "load_training_data_into_memory",
@@ -68,6 +46,20 @@ class GeneralDataset(Dataset):
                 "when train network, load all training sample into memory can relieve disk burden",
             )
         ]
+        self.shape_store_path = option[
+            (
+                "shape_store_path",
+                "",
+                "folder of the memory-mapped store of the preprocessed training shapes, default is data_path/shape_store",
+            )
+        ]
+        self.num_preprocess_workers = option[
+            (
+                "num_preprocess_workers",
+                12,
+                "number of processes that preprocess the shapes when building the shape store",
+            )
+        ]
         self.load_into_memory = (
             load_training_data_into_memory if phase == "train" else False
         )
@@ -81,6 +73,42 @@ class GeneralDataset(Dataset):
         if self.load_into_memory:
             self._init_data_pool()
 
+    def _init_processors(self):
+        """
+        build the reader, the sampler, the normalizer and the postprocess from their factory strings
+        """
+        option = self.reg_option
+        self.reader = obj_factory(option[("reader", "", "a reader instance")])
+        self.sampler = obj_factory(
+            option[
+                (
+                    "sampler",
+                    "",
+                    "a sampler instance, the goal of sampling here is for batch consistency, where we pick the same index order from the source and the target",
+                )
+            ]
+        )
+        self.normalizer = obj_factory(
+            option[("normalizer", "", "a normalizer instance")]
+        )
+        shape_postprocess_obj = option[
+            ("shape_postprocess_obj", "", "a file_postprocess instance")
+        ]
+        self.shape_postprocess = (
+            obj_factory(shape_postprocess_obj) if shape_postprocess_obj else None
+        )
+
+    def __getstate__(self):
+        # the processors are closures that can't be pickled, the "spawn" dataloader workers rebuild them
+        state = self.__dict__.copy()
+        for name in ["reader", "sampler", "normalizer", "shape_postprocess"]:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_processors()
+
     def get_file_list(self):
         """"""
         if not os.path.exists(self.data_path):
@@ -96,8 +124,6 @@ class GeneralDataset(Dataset):
 
     def _init_data_pool(self):
         """"""
-        manager = Manager()
-        data_dic = manager.dict()
         data_info_dic = {}
         _file_name_list = []
         for file_info in self.file_info_list:
@@ -106,34 +132,28 @@ class GeneralDataset(Dataset):
                 data_info_dic[fname] = file_info
             _file_name_list.append(fname)
 
-        #  multi process
-        num_of_workers = 12
-        num_of_workers = num_of_workers if len(_file_name_list) > 12 else 2
-        dict_splits = split_dict(data_info_dic, num_of_workers)
-        procs = []
-        for i in range(num_of_workers):
-            p = Process(
-                target=self._data_into_zipnp,
-                args=(
-                    dict_splits[i],
-                    data_dic,
-                ),
-            )
-            p.start()
-            print("pid:{} start:".format(p.pid))
-            procs.append(p)
-        for p in procs:
-            p.join()
-        print(
-            "the loading phase finished, total {} data have been loaded".format(
-                len(data_dic)
-            )
-        )
-        data_dic = dict(data_dic)
+        self.shape_store = self._build_shape_store(data_info_dic)
+        self.file_list = _file_name_list
 
-        # organize data into pair list
-        for file_name in _file_name_list:
-            self.file_list.append(data_dic[file_name])
+    def _build_shape_store(self, data_info_dic):
+        """
+        preprocess the shapes once into a memory-mapped store, the store is reused as long as
+        the shape list, the reader and the normalizer are unchanged
+        :param data_info_dic: dict, {shape_name: shape_info}
+        :return: ShapeStore
+        """
+        store_path = self.shape_store_path or os.path.join(self.data_path, "shape_store")
+        settings = [
+            self.reg_option["reader"],
+            self.reg_option["normalizer"],
+        ]
+        return build_shape_store(
+            store_path,
+            data_info_dic,
+            self._preprocess_data,
+            num_workers=self.num_preprocess_workers,
+            settings=settings,
+        )
 
     def _preprocess_data(self, file_info):
         """
@@ -147,24 +167,6 @@ class GeneralDataset(Dataset):
         case_dict = self.normalizer(case_dict)
         return case_dict
 
-    def _data_into_zipnp(self, data_path_dic, data_dict):
-        """
-        compress the data into zip to save memory
-        :param data_path_dic:
-        :param data_dict:
-        :return:
-        """
-
-        def zip_fn(item):
-            if isinstance(item, dict):
-                return {key: zip_fn(_item) for key, _item in item.items()}
-            else:
-                return blosc.pack_array(item)
-
-        for fn in tqdm(data_path_dic):
-            case_dict = self._preprocess_data(data_path_dic[fn])
-            data_dict[fn] = zip_fn(case_dict)
-
     def setup_random_seed(self):
         """due to the property of the dataloader, we manually set the random seed here"""
         if self.phase != "train":
@@ -196,29 +198,28 @@ class GeneralDataset(Dataset):
 
         """
 
-        def unzip_shape_fn(item):
-            if isinstance(item, dict):
-                return {key: unzip_shape_fn(_item) for key, _item in item.items()}
-            else:
-                return blosc.unpack_array(item)
-
         # print(idx)
         self.setup_random_seed()
+        raw_idx = idx
         idx = idx % len(self.file_name_list)
         file_info = self.file_info_list[idx]
         file_name = self.file_name_list[idx]
         if not self.load_into_memory:
             shape_dict = self._preprocess_data(file_info)
         else:
-            zip_shape_dict = self.file_list[idx]
-            shape_dict = unzip_shape_fn(zip_shape_dict)
+            shape_dict = self.shape_store.get(self.file_list[idx])
 
         shape_dict = self.shape_postprocess(
             shape_dict, phase=self.phase, sampler=self.sampler
         )
         if self.transform:
             shape_dict = {key: self.transform(fea) for key, fea in shape_dict.items()}
-        sample = {"shape": shape_dict, "file_name": file_name, "shape_info": file_info}
+        sample = {
+            "shape": shape_dict,
+            "file_name": file_name,
+            "shape_info": file_info,
+            "index": raw_idx,
+        }
         return sample
 
 
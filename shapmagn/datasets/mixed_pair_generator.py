@@ -1,6 +1,10 @@
 from copy import deepcopy
 import random
+import zlib
+import numpy as np
 import torch
+from torch.utils.data import get_worker_info
+from torch.utils.data.dataloader import default_collate
 from shapmagn.shape.point_sampler import batch_uniform_sampler
 from shapmagn.utils.obj_factory import obj_factory
 from shapmagn.utils.utils import index_points
@@ -100,9 +104,15 @@ class HybirdData(object):
     def prepare_synth_input(self, input_data, batch_info):
         synth_on_source = random.random() > 0.5
         source_dict = input_data["source"] if synth_on_source else input_data["target"]
-        input_data["target"], synth_info = self.synthsizer(deepcopy(source_dict))
+        # the shape names key the deformation banks of the synthesizers
+        name_list = (
+            batch_info["source_info"] if synth_on_source else batch_info["target_info"]
+        )["name"]
+        input_data["target"], synth_info = self.synthsizer(
+            deepcopy(source_dict), name_list=name_list
+        )
         if self.data_aug is not None:
-            input_data["source"], _ = self.data_aug(source_dict)
+            input_data["source"], _ = self.data_aug(source_dict, name_list=name_list)
         input_data["source"] = source_dict
         batch_info["source_info"] = (
             batch_info["source_info"] if synth_on_source else batch_info["target_info"]
@@ -118,8 +128,12 @@ class HybirdData(object):
 
     def prepare_raw_pair(self, input_data, batch_info):
         if self.data_aug is not None and batch_info["phase"] == "train":
-            input_data["source"], _ = self.data_aug(input_data["source"])
-            input_data["target"], _ = self.data_aug(input_data["target"])
+            input_data["source"], _ = self.data_aug(
+                input_data["source"], name_list=batch_info["source_info"]["name"]
+            )
+            input_data["target"], _ = self.data_aug(
+                input_data["target"], name_list=batch_info["target_info"]["name"]
+            )
         batch_info["is_synth"] = False
         batch_info["corr_source_target"] = self.raw_source_target_has_corr
 
@@ -226,6 +240,13 @@ class HybirdData(object):
         :param batch_info:
         :return:
         """
+        prepared_batch_info = input_data.pop("prepared_batch_info", None)
+        if prepared_batch_info is not None:
+            # the pair has been prepared in the DataLoader workers, see HybirdDataCollate
+            device = input_data["source"]["points"].device
+            input_data["extra_info"] = _to_device(input_data.get("extra_info", {}), device)
+            batch_info.update(prepared_batch_info)
+            return input_data, batch_info
         use_synth, corr_sampled_source_target, has_gt = self.planner(
             batch_info["phase"], batch_info["epoch"]
         )
@@ -241,3 +262,100 @@ class HybirdData(object):
             return self.sampling(input_data, use_synth), batch_info
         else:
             return self.non_sampling(input_data, use_synth), batch_info
+
+
+def _to_device(item, device):
+    if isinstance(item, dict):
+        return {key: _to_device(_item, device) for key, _item in item.items()}
+    if isinstance(item, (list, tuple)):
+        return type(item)(_to_device(_item, device) for _item in item)
+    if isinstance(item, torch.Tensor):
+        return item.to(device)
+    return item
+
+
+class HybirdDataCollate(object):
+    """
+    collate function that runs the input preparation (HybirdData: synthesis, augmentation, sampling)
+    inside the DataLoader workers, so the training loop receives ready pairs instead of waiting on the synthesis.
+    the number of prepared batches waiting for the training loop is bounded by num_workers*prefetch_factor.
+
+    KeOps/cuda can't be used in forked workers, the DataLoader should use the "spawn" context when device is cuda.
+    before each batch, the random generators of the worker are seeded from the sample indices, the phase and the epoch,
+    so a batch is synthesized the same way whatever the worker that prepares it.
+    the samples should carry their dataset index under "index", without it the batch is seeded from
+    the worker id and the number of batches the worker has prepared in the epoch.
+    the prepared batch is returned on cpu with the derived batch_info under "prepared_batch_info",
+    the model's HybirdData then only moves it to the device.
+    """
+
+    def __init__(self, prepare_input_obj, phase, device="cpu", base_seed=0, collate_fn=None):
+        """
+        :param prepare_input_obj: str, factory string of the HybirdData, the same as the model's prepare_input_object
+        :param phase: str, train/val/test/debug
+        :param device: str, device of the preparation in the workers
+        :param base_seed: int
+        :param collate_fn: the collate function of the samples, default_collate by default
+        """
+        self.prepare_input_obj = prepare_input_obj
+        self.phase = phase
+        self.device = device
+        self.base_seed = base_seed
+        self.collate_fn = collate_fn if collate_fn is not None else default_collate
+        self.epoch = 0
+        self.num_batches = 0
+        self.prepare_input = None
+
+    def set_epoch(self, epoch):
+        """
+        should be called before iterating the DataLoader, the workers get a copy of the collate function
+        """
+        self.epoch = epoch
+        self.num_batches = 0
+
+    def __getstate__(self):
+        # the HybirdData is built in each worker
+        state = self.__dict__.copy()
+        state["prepare_input"] = None
+        return state
+
+    def get_seed(self, index_list):
+        return zlib.crc32(
+            "{}_{}_{}_{}".format(self.base_seed, self.phase, self.epoch, index_list).encode()
+        )
+
+    def __call__(self, sample_list):
+        if self.prepare_input is None:
+            self.prepare_input = obj_factory(self.prepare_input_obj)
+        if all("index" in sample for sample in sample_list):
+            seed = self.get_seed([int(sample["index"]) for sample in sample_list])
+        else:
+            # the batches are assigned to the workers in turn, so (worker id, batch count) identifies the batch
+            worker_info = get_worker_info()
+            worker_id = worker_info.id if worker_info is not None else 0
+            seed = self.get_seed(["worker", worker_id, self.num_batches])
+        self.num_batches += 1
+        random.seed(seed)
+        np.random.seed(seed % 2 ** 32)
+        torch.manual_seed(seed)
+        input_data = self.collate_fn(sample_list)
+        batch_info = {
+            "pair_name": input_data["pair_name"],
+            "source_info": input_data["source_info"],
+            "target_info": input_data["target_info"],
+            "is_synth": False,
+            "phase": self.phase,
+            "epoch": self.epoch,
+        }
+        input_data["source"] = _to_device(input_data["source"], self.device)
+        input_data["target"] = _to_device(input_data["target"], self.device)
+        input_data, batch_info = self.prepare_input(input_data, batch_info)
+        input_data = _to_device(input_data, "cpu")
+        input_data["pair_name"] = batch_info["pair_name"]
+        input_data["source_info"] = batch_info["source_info"]
+        input_data["target_info"] = batch_info["target_info"]
+        input_data["prepared_batch_info"] = _to_device(
+            {key: item for key, item in batch_info.items() if key not in ["phase", "epoch"]},
+            "cpu",
+        )
+        return input_data
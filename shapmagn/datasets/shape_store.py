@@ -0,0 +1,213 @@
+"""
+memory-mapped columnar store of the preprocessed (read + normalized) shapes
+
+the store is built once: the shapes are split over several processes, each process writes its own shard,
+i.e. a flat binary file where every array of a shape dict (points, weights, pointfea, ...) is a contiguous block,
+plus an index of (dtype, shape, offset) per array. the shard indices are then merged into "index.json",
+which also records a signature of the shape list and the reader/normalizer settings,
+the store is rebuilt whenever the signature changes.
+
+reading a shape returns views on the memory-mapped shards (copy-on-write), so nothing is unpacked,
+and the dataloader workers share the page cache instead of receiving pickled copies
+"""
+import os
+import json
+import hashlib
+import numpy as np
+from multiprocessing import Process
+from tqdm import tqdm
+from shapmagn.utils.distributed import is_main_process, barrier
+
+INDEX_NAME = "index.json"
+ALIGNMENT = 64
+
+
+def _flatten(case_dict, prefix=()):
+    for key, item in case_dict.items():
+        if isinstance(item, dict):
+            for path, array in _flatten(item, prefix + (key,)):
+                yield path, array
+        else:
+            yield prefix + (key,), item
+
+
+def _unflatten(items):
+    case_dict = {}
+    for path, array in items:
+        cur_dict = case_dict
+        for key in path[:-1]:
+            cur_dict = cur_dict.setdefault(key, {})
+        cur_dict[path[-1]] = array
+    return case_dict
+
+
+def get_store_signature(shape_info_dic, settings=()):
+    """
+    :param shape_info_dic: dict, {shape_name: shape_info}
+    :param settings: list of the settings that affect the preprocessed shapes, e.g. the reader and the normalizer
+    :return: str
+    """
+    content = json.dumps(
+        {"shapes": shape_info_dic, "settings": list(settings)},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def _write_shard(shard_path, shape_info_dic, preprocess_fn):
+    """
+    :param shard_path: str, the shard is saved into shard_path.bin and its index into shard_path.json
+    :param shape_info_dic: dict, {shape_name: shape_info}
+    :param preprocess_fn: callable, shape_info -> shape dict of numpy arrays
+    """
+    index = {}
+    offset = 0
+    with open(shard_path + ".bin", "wb") as f:
+        for name in tqdm(shape_info_dic):
+            case_dict = preprocess_fn(shape_info_dic[name])
+            columns = []
+            for path, array in _flatten(case_dict):
+                array = np.ascontiguousarray(array)
+                if array.dtype.hasobject:
+                    raise ValueError(
+                        "{} of {} is not a numeric array".format("/".join(path), name)
+                    )
+                padding = -offset % ALIGNMENT
+                f.write(b"\0" * padding)
+                offset += padding
+                f.write(array.tobytes())
+                columns.append(
+                    {
+                        "key": list(path),
+                        "dtype": array.dtype.str,
+                        "shape": list(array.shape),
+                        "offset": offset,
+                    }
+                )
+                offset += array.nbytes
+            index[name] = columns
+    with open(shard_path + ".json", "w") as f:
+        json.dump(index, f)
+
+
+def build_shape_store(
+    store_path, shape_info_dic, preprocess_fn, num_workers=12, settings=()
+):
+    """
+    build the store if it doesn't exist or is outdated, the shapes are preprocessed only once
+
+    :param store_path: str, folder of the store
+    :param shape_info_dic: dict, {shape_name: shape_info}
+    :param preprocess_fn: callable, shape_info -> shape dict of numpy arrays
+    :param num_workers: int, number of processes that preprocess the shapes
+    :param settings: list of the settings that affect the preprocessed shapes, e.g. the reader and the normalizer
+    :return: ShapeStore
+    """
+    # in the distributed training, the store is built by the rank 0, the other ranks wait and load it
+    if not is_main_process():
+        barrier()
+        return ShapeStore(store_path)
+    store = _build_shape_store(
+        store_path, shape_info_dic, preprocess_fn, num_workers, settings
+    )
+    barrier()
+    return store
+
+
+def _build_shape_store(store_path, shape_info_dic, preprocess_fn, num_workers, settings):
+    signature = get_store_signature(shape_info_dic, settings)
+    index_path = os.path.join(store_path, INDEX_NAME)
+    if os.path.isfile(index_path):
+        with open(index_path) as f:
+            if json.load(f)["signature"] == signature:
+                print("load the shape store from {}".format(store_path))
+                return ShapeStore(store_path)
+    os.makedirs(store_path, exist_ok=True)
+    name_list = list(shape_info_dic.keys())
+    num_workers = max(1, min(num_workers, len(name_list)))
+    procs = []
+    for i in range(num_workers):
+        p = Process(
+            target=_write_shard,
+            args=(
+                os.path.join(store_path, "shard_{}".format(i)),
+                {name: shape_info_dic[name] for name in name_list[i::num_workers]},
+                preprocess_fn,
+            ),
+        )
+        p.start()
+        print("pid:{} start:".format(p.pid))
+        procs.append(p)
+    for p in procs:
+        p.join()
+    if any(p.exitcode != 0 for p in procs):
+        raise RuntimeError("failed to build the shape store in {}".format(store_path))
+    index = {}
+    for i in range(num_workers):
+        shard_index_path = os.path.join(store_path, "shard_{}.json".format(i))
+        with open(shard_index_path) as f:
+            shard_index = json.load(f)
+        os.remove(shard_index_path)
+        index.update({name: [i, columns] for name, columns in shard_index.items()})
+    with open(index_path + ".tmp", "w") as f:
+        json.dump({"signature": signature, "index": index}, f)
+    os.replace(index_path + ".tmp", index_path)
+    print(
+        "the loading phase finished, total {} data have been saved into {}".format(
+            len(index), store_path
+        )
+    )
+    return ShapeStore(store_path)
+
+
+class ShapeStore(object):
+    """
+    read-only access to a store built by build_shape_store
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with open(os.path.join(store_path, INDEX_NAME)) as f:
+            self.index = json.load(f)["index"]
+        self._shards = {}
+
+    def __getstate__(self):
+        # the memory maps are reopened by each dataloader worker
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def _get_shard(self, shard_id):
+        if shard_id not in self._shards:
+            self._shards[shard_id] = np.memmap(
+                os.path.join(self.store_path, "shard_{}.bin".format(shard_id)),
+                dtype=np.uint8,
+                mode="c",
+            )
+        return self._shards[shard_id]
+
+    def get(self, name):
+        """
+        :param name: str, shape name
+        :return: shape dict, the arrays are copy-on-write views on the store
+        """
+        shard_id, columns = self.index[name]
+        items = []
+        for column in columns:
+            dtype, shape = np.dtype(column["dtype"]), tuple(column["shape"])
+            nbytes = dtype.itemsize * int(np.prod(shape))
+            if nbytes == 0:
+                array = np.empty(shape, dtype=dtype)
+            else:
+                shard = self._get_shard(shard_id)
+                offset = column["offset"]
+                array = np.asarray(shard[offset : offset + nbytes]).view(dtype).reshape(shape)
+            items.append((tuple(column["key"]), array))
+        return _unflatten(items)
@@ -1,18 +1,146 @@
+import os
+import json
 import vtk
 import pyvista as pv
 import numpy as np
 
+SIDECAR_SUFFIX = ".sidecar"
+SIDECAR_ALIGNMENT = 64
 
-def read_vtk(path):
-    data = pv.read(path)
+
+def _wanted(name, fields):
+    return fields is None or name in fields
+
+
+def _read_pv(path, fields=None):
+    """
+    the xml polydata reader only decodes the selected point arrays, other formats are fully decoded by pyvista
+    """
+    if fields is not None and path.endswith(".vtp"):
+        reader = vtk.vtkXMLPolyDataReader()
+        reader.SetFileName(path)
+        reader.UpdateInformation()
+        for i in range(reader.GetNumberOfPointArrays()):
+            name = reader.GetPointArrayName(i)
+            reader.SetPointArrayStatus(name, int(name in fields))
+        for i in range(reader.GetNumberOfCellArrays()):
+            reader.SetCellArrayStatus(reader.GetCellArrayName(i), 0)
+        reader.Update()
+        return pv.wrap(reader.GetOutput())
+    return pv.read(path)
+
+
+def _get_sidecar_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def write_vtk_sidecar(path, data_dict):
+    """
+    save the arrays of a vtk file into a flat binary sidecar (path + ".sidecar"),
+    the file starts with the length of a json header, which records (dtype, shape, offset) of each array
+    together with the size and the modification time of the vtk file
+
+    :param path: str, path of the vtk file
+    :param data_dict: dict of numpy arrays
+    """
+    columns, offset = {}, 0
+    arrays = {}
+    for name, array in data_dict.items():
+        array = np.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            continue
+        offset += -offset % SIDECAR_ALIGNMENT
+        columns[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        arrays[name] = array
+        offset += array.nbytes
+    header = json.dumps(
+        {"signature": _get_sidecar_signature(path), "columns": columns}
+    ).encode()
+    data_start = 8 + len(header)
+    data_start += -data_start % SIDECAR_ALIGNMENT
+    tmp_path = path + SIDECAR_SUFFIX + ".{}.tmp".format(os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(np.array([len(header)], dtype="<u8").tobytes())
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + columns[name]["offset"])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path + SIDECAR_SUFFIX)
+
+
+def read_vtk_sidecar(path, fields=None):
+    """
+    :param path: str, path of the vtk file
+    :param fields: list of the array names to read, None to read all
+    :return: dict of copy-on-write memory-mapped arrays, None if the sidecar doesn't exist or is outdated
+    """
+    sidecar_path = path + SIDECAR_SUFFIX
+    if not os.path.isfile(sidecar_path):
+        return None
+    with open(sidecar_path, "rb") as f:
+        header_len = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+        header = json.loads(f.read(header_len).decode())
+    if header["signature"] != _get_sidecar_signature(path):
+        return None
+    data_start = 8 + header_len
+    data_start += -data_start % SIDECAR_ALIGNMENT
     data_dict = {}
-    data_dict["points"] = data.points.astype(np.float32)
-    data_dict["faces"] = data.faces.reshape(-1, 4)[:, 1:].astype(np.int32)
+    for name, column in header["columns"].items():
+        if not _wanted(name, fields):
+            continue
+        shape = tuple(column["shape"])
+        if int(np.prod(shape)) == 0:
+            data_dict[name] = np.empty(shape, dtype=np.dtype(column["dtype"]))
+            continue
+        data_dict[name] = np.memmap(
+            sidecar_path,
+            dtype=np.dtype(column["dtype"]),
+            mode="c",
+            offset=data_start + column["offset"],
+            shape=shape,
+        )
+    return data_dict
+
+
+def read_vtk(path, fields=None, use_sidecar=False):
+    """
+    :param path: str, path of the vtk file
+    :param fields: list of the array names to read, e.g. ["points", "radius"], None to read all,
+        "points" and "faces" are selected in the same way as the point arrays
+    :param use_sidecar: bool, read from the binary sidecar (path + ".sidecar"), which is written at the first read
+        and rewritten once the vtk file is modified
+    :return: dict of numpy arrays, the arrays are views on the vtk data (or the memory-mapped sidecar) whenever possible
+    """
+    if use_sidecar:
+        data_dict = read_vtk_sidecar(path, fields)
+        if data_dict is not None:
+            return data_dict
+    data = _read_pv(path, None if use_sidecar else fields)
+    data_dict = {}
+    if use_sidecar or _wanted("points", fields):
+        data_dict["points"] = np.asarray(data.points, dtype=np.float32)
+    if use_sidecar or _wanted("faces", fields):
+        data_dict["faces"] = data.faces.reshape(-1, 4)[:, 1:].astype(np.int32)
     for name in data.array_names:
+        if not (use_sidecar or _wanted(name, fields)):
+            continue
         try:
             data_dict[name] = data[name]
         except:
             pass
+    if use_sidecar:
+        try:
+            write_vtk_sidecar(path, data_dict)
+        except OSError:
+            print("failed to write the sidecar of {}".format(path))
+        data_dict = {
+            name: array for name, array in data_dict.items() if _wanted(name, fields)
+        }
     return data_dict
 
 
@@ -21,12 +21,14 @@ attri TCoords with size (82550, 2)
 """
 
 
-def body_reader():
+def body_reader(use_sidecar=False):
     """
+    :param use_sidecar: bool, read from the binary sidecar of the vtk file, see vtk_utils.read_vtk
     :return:
     """
-    reader = read_vtk
     fea_to_merge = ["TCoords"]
+    fields = ["points", "faces"] + fea_to_merge
+    reader = lambda path: read_vtk(path, fields=fields, use_sidecar=use_sidecar)
     exp_dim_fn = lambda x: x[:, None] if len(x.shape) == 1 else x
 
     def norm_fea(fea):
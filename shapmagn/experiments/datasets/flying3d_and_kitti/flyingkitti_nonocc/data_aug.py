@@ -7,6 +7,7 @@ import time
 from shapmagn.experiments.datasets.lung.lung_data_analysis import *
 from shapmagn.global_variable import *
 from shapmagn.datasets.data_aug import SplineAug, PointAug
+from shapmagn.datasets.deform_bank import get_deform_bank, synth_via_deform_bank
 from shapmagn.utils.module_parameters import ParameterDict
 from shapmagn.utils.utils import enlarge_by_factor
 from functools import partial
@@ -77,9 +78,21 @@ def flyingkitti_nonocc_synth_data(**kwargs):
     points_aug["plot"] = False
     point_aug = PointAug(points_aug)
 
-    def _synth(data_dict):
+    deform_bank = get_deform_bank(aug_settings, spline_aug, **kwargs)
+
+    def _synth(data_dict, name_list=None):
         synth_info = {"aug_settings": aug_settings}
         points, weights = data_dict["points"], data_dict["weights"]
+        if deform_bank is not None:
+            return synth_via_deform_bank(
+                data_dict,
+                synth_info,
+                deform_bank,
+                spline_aug,
+                point_aug,
+                aug_settings,
+                name_list,
+            )
         if aug_settings["do_point_aug"]:
             points, weights, corr_index = point_aug(points, weights)
             synth_info["corr_index"] = corr_index
@@ -158,9 +171,21 @@ def flyingkitti_nonocc_aug_data(**kwargs):
     points_aug["plot"] = False
     point_aug = PointAug(points_aug)
 
-    def _synth(data_dict):
+    deform_bank = get_deform_bank(aug_settings, spline_aug, **kwargs)
+
+    def _synth(data_dict, name_list=None):
         synth_info = {"aug_settings": aug_settings}
         points, weights = data_dict["points"], data_dict["weights"]
+        if deform_bank is not None:
+            return synth_via_deform_bank(
+                data_dict,
+                synth_info,
+                deform_bank,
+                spline_aug,
+                point_aug,
+                aug_settings,
+                name_list,
+            )
 
         if aug_settings["do_local_deform_aug"] or aug_settings["do_spline_aug"]:
             points, weights = spline_aug(points, weights)
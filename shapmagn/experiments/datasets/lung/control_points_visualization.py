@@ -14,7 +14,8 @@ import subprocess
 import torch
 from shapmagn.datasets.data_utils import read_json_into_list, get_pair_obj
 from shapmagn.experiments.datasets.lung.visualizer import lung_plot, camera_pos
-from shapmagn.global_variable import shape_type, obj_factory, SHAPMAGN_PATH
+from shapmagn.global_variable import shape_type, SHAPMAGN_PATH
+from shapmagn.utils.obj_factory import obj_factory
 from shapmagn.experiments.datasets.lung.global_variable import lung_expri_path
 import pointnet2.lib.pointnet2_utils as pointutils
 from shapmagn.utils.visualizer import visualize_point_pair_overlap, visualize_point_overlap, visualize_landmark_overlap, \
@@ -25,6 +25,7 @@ from shapmagn.experiments.datasets.lung.lung_data_analysis import *
 from shapmagn.global_variable import *
 from shapmagn.experiments.datasets.lung.visualizer import camera_pos, lung_plot
 from shapmagn.datasets.data_aug import SplineAug, PointAug
+from shapmagn.datasets.deform_bank import get_deform_bank, synth_via_deform_bank
 from shapmagn.utils.module_parameters import ParameterDict
 from shapmagn.utils.utils import enlarge_by_factor
 from functools import partial
@@ -95,9 +96,21 @@ def lung_synth_data(**kwargs):
     points_aug["plot"] = False
     point_aug = PointAug(points_aug)
 
-    def _synth(data_dict):
+    deform_bank = get_deform_bank(aug_settings, spline_aug, **kwargs)
+
+    def _synth(data_dict, name_list=None):
         synth_info = {"aug_settings": aug_settings}
         points, weights = data_dict["points"], data_dict["weights"]
+        if deform_bank is not None:
+            return synth_via_deform_bank(
+                data_dict,
+                synth_info,
+                deform_bank,
+                spline_aug,
+                point_aug,
+                aug_settings,
+                name_list,
+            )
         if aug_settings["do_point_aug"]:
             points, weights, corr_index = point_aug(points, weights)
             synth_info["corr_index"] = corr_index
@@ -176,9 +189,21 @@ def lung_aug_data(**kwargs):
     points_aug["plot"] = False
     point_aug = PointAug(points_aug)
 
-    def _synth(data_dict):
+    deform_bank = get_deform_bank(aug_settings, spline_aug, **kwargs)
+
+    def _synth(data_dict, name_list=None):
         synth_info = {"aug_settings": aug_settings}
         points, weights = data_dict["points"], data_dict["weights"]
+        if deform_bank is not None:
+            return synth_via_deform_bank(
+                data_dict,
+                synth_info,
+                deform_bank,
+                spline_aug,
+                point_aug,
+                aug_settings,
+                name_list,
+            )
         if aug_settings["do_point_aug"]:
             points, weights, corr_index = point_aug(points, weights)
             synth_info["corr_index"] = corr_index
@@ -32,24 +32,38 @@ attri dnn_radius with size (73412,)
 """
 
 
-def lung_reader(use_radius=True):
+class LungReader(object):
     """
-    :return:
+    a module level class instead of a closure, so the reader can be pickled into the "spawn" dataloader workers
     """
-    reader = read_vtk
-    fea_to_merge = ["points"]
-    exp_dim_fn = lambda x: x[:, None] if len(x.shape) == 1 else x
 
+    def __init__(self, use_radius=True, use_sidecar=False):
+        """
+        :param use_radius: bool, use the radius as the weights
+        :param use_sidecar: bool, read from the binary sidecar of the vtk file, see vtk_utils.read_vtk
+        """
+        self.use_radius = use_radius
+        self.use_sidecar = use_sidecar
+        self.fea_to_merge = ["points"]
+        self.fields = (
+            ["points"] + self.fea_to_merge + (["radius", "weights"] if use_radius else [])
+        )
+
+    @staticmethod
+    def exp_dim_fn(x):
+        return x[:, None] if len(x.shape) == 1 else x
+
+    @staticmethod
     def norm_fea(fea):
         fea = (fea - fea.mean()) / (fea.std())
         return fea
 
-    def read(file_info):
+    def __call__(self, file_info):
         path = file_info["data_path"]
-        raw_data_dict = reader(path)
+        raw_data_dict = read_vtk(path, fields=self.fields, use_sidecar=self.use_sidecar)
         data_dict = {}
         data_dict["points"] = raw_data_dict["points"]
-        if not use_radius:
+        if not self.use_radius:
             num_sample = data_dict["points"].shape[0]
             data_dict["weights"] =np.ones([num_sample, 1], dtype=np.float32)
         else:
@@ -58,12 +72,20 @@ def lung_reader(use_radius=True):
             except:
                 data_dict["weights"] = raw_data_dict["weights"][:, None]
         fea_list = [
-            norm_fea(exp_dim_fn(raw_data_dict[fea_name])) for fea_name in fea_to_merge
+            self.norm_fea(self.exp_dim_fn(raw_data_dict[fea_name]))
+            for fea_name in self.fea_to_merge
         ]
         data_dict["pointfea"] = np.concatenate(fea_list, 1)
         return data_dict
 
-    return read
+
+def lung_reader(use_radius=True, use_sidecar=False):
+    """
+    :param use_radius: bool, use the radius as the weights
+    :param use_sidecar: bool, read from the binary sidecar of the vtk file, see vtk_utils.read_vtk
+    :return: LungReader
+    """
+    return LungReader(use_radius=use_radius, use_sidecar=use_sidecar)
 
 
 
@@ -1,5 +1,6 @@
 import os, sys
 import numpy as np
+import torch
 
 from shapmagn.experiments.datasets.lung.global_variable import lung_expri_path
 from shapmagn.experiments.datasets.lung.lung_data_analysis import get_half_lung
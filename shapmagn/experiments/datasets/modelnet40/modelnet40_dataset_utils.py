@@ -9,8 +9,6 @@ import numpy as np
 import torch
 from scipy.spatial.transform import Rotation
 from torch.utils.data import Dataset
-from sklearn.neighbors import NearestNeighbors
-from scipy.spatial.distance import minkowski
 
 
 def download():
@@ -58,18 +56,36 @@ def jitter_pointcloud(pointcloud, sigma=0.01, clip=0.05):
     return pointcloud
 
 
-def farthest_subsample_points(pointcloud1, pointcloud2, num_subsampled_points=768):
+def nearest_to_anchor(pointcloud, anchor, num_subsampled_points):
+    """
+    :param pointcloud: Nx3 array
+    :param anchor: 1x3 array
+    :param num_subsampled_points: int
+    :return: index of the num_subsampled_points points nearest to the anchor, sorted by the distance
+    """
+    dist2 = ((pointcloud.astype(np.float64) - anchor) ** 2).sum(1)
+    idx = np.argpartition(dist2, num_subsampled_points - 1)[:num_subsampled_points]
+    return idx[np.argsort(dist2[idx], kind="stable")]
+
+
+def farthest_subsample_points(pointcloud1, pointcloud2, num_subsampled_points=768, return_index=False):
+    """
+    keep the points of each point cloud that are nearest to a random far-away anchor
+
+    :param pointcloud1: 3xN array
+    :param pointcloud2: 3xN array
+    :param num_subsampled_points: int
+    :param return_index: bool, return the index of the kept points as well
+    :return: 3xK array, 3xK array, (index1, index2)
+    """
     pointcloud1 = pointcloud1.T
     pointcloud2 = pointcloud2.T
-    num_points = pointcloud1.shape[0]
-    nbrs1 = NearestNeighbors(n_neighbors=num_subsampled_points, algorithm='auto',
-                             metric=lambda x, y: minkowski(x, y)).fit(pointcloud1)
     random_p1 = np.random.random(size=(1, 3)) + np.array([[500, 500, 500]]) * np.random.choice([1, -1, 1, -1])
-    idx1 = nbrs1.kneighbors(random_p1, return_distance=False).reshape((num_subsampled_points,))
-    nbrs2 = NearestNeighbors(n_neighbors=num_subsampled_points, algorithm='auto',
-                             metric=lambda x, y: minkowski(x, y)).fit(pointcloud2)
+    idx1 = nearest_to_anchor(pointcloud1, random_p1, num_subsampled_points)
     random_p2 = random_p1 #np.random.random(size=(1, 3)) + np.array([[500, 500, 500]]) * np.random.choice([1, -1, 2, -2])
-    idx2 = nbrs2.kneighbors(random_p2, return_distance=False).reshape((num_subsampled_points,))
+    idx2 = nearest_to_anchor(pointcloud2, random_p2, num_subsampled_points)
+    if return_index:
+        return pointcloud1[idx1, :].T, pointcloud2[idx2, :].T, (idx1, idx2)
     return pointcloud1[idx1, :].T, pointcloud2[idx2, :].T
 
 
@@ -106,7 +122,8 @@ def transfer_into_support_format(item_id, pointcloud1, pointcloud2, R_ab, transl
         "target":target_dict,
         "pair_name": pair_name,
         "source_info":{},
-        "target_info":{}
+        "target_info":{},
+        "index": item_id
     }
 
 
@@ -122,6 +139,7 @@ class ModelNet40(Dataset):
         unseen = dataset_opt[("unseen", False, "Whether to test on unseen category")]
         rot_factor = dataset_opt[("rot_factor", 4, "Divided factor of rotation")]
         partial_only_during_test = dataset_opt[("partial_only_during_test", False, "run paritial registration during test")]
+        cache_subsample_index = dataset_opt[("cache_subsample_index", False, "memorize the subsampled index of each case, only for the non-train phase where the random seed is fixed")]
         # to be compatible to shapmagn interface
         if partition=="val":
             partition = "test"
@@ -139,6 +157,7 @@ class ModelNet40(Dataset):
         self.label = self.label.squeeze()
         self.rot_factor = rot_factor
         self.subsampled = False
+        self.subsample_index_cache = {} if cache_subsample_index and partition != "train" else None
         if partition=="train":
             self.subsampled=False
         else:
@@ -202,9 +221,15 @@ class ModelNet40(Dataset):
             pointcloud1 = jitter_pointcloud(pointcloud1)
             pointcloud2 = jitter_pointcloud(pointcloud2)
 
-        if self.subsampled:
-            pointcloud1, pointcloud2 = farthest_subsample_points(pointcloud1, pointcloud2,
-                                                                 num_subsampled_points=self.num_subsampled_points)
+        if self.subsampled and self.subsample_index_cache is not None and item in self.subsample_index_cache:
+            idx1, idx2 = self.subsample_index_cache[item]
+            pointcloud1, pointcloud2 = pointcloud1[:, idx1], pointcloud2[:, idx2]
+        elif self.subsampled:
+            pointcloud1, pointcloud2, subsample_index = farthest_subsample_points(pointcloud1, pointcloud2,
+                                                                 num_subsampled_points=self.num_subsampled_points,
+                                                                 return_index=True)
+            if self.subsample_index_cache is not None:
+                self.subsample_index_cache[item] = subsample_index
         return transfer_into_support_format(item, pointcloud1,
                                              pointcloud2, R_ab, translation_ab, R_ba, translation_ba, euler_ab, euler_ba)
 
@@ -2,6 +2,7 @@ import os
 from shapmagn.shape.point_cloud import PointCloud
 from shapmagn.shape.surface_mesh import SurfaceMesh, SurfaceMesh_Point
 from shapmagn.shape.poly_line import PolyLine
+from shapmagn.utils.obj_factory import LazyRegistry
 #SHAPMAGN_PATH =os.path.abspath("/playpen-raid1/zyshen/proj/shapmagn/shapmagn")
 SHAPMAGN_PATH =os.path.abspath("/home/zyshen/proj/shapmagn/shapmagn")
 shape_type = "pointcloud"
@@ -13,57 +14,50 @@ SHAPE_POOL = {
 }
 Shape = SHAPE_POOL[shape_type]
 
-
-from shapmagn.metrics.reg_losses import *
-
-LOSS_POOL = {
-    "current": CurrentDistance,
-    "varifold": VarifoldDistance,
-    "geomloss": GeomDistance,
-    "l2": L2Distance,
-    "localreg": LocalReg,
-    "gmm": GMMLoss,
-}
-
-
-from shapmagn.datasets.general_dataset import GeneralDataset
-from shapmagn.datasets.pair_dataset import RegistrationPairDataset
-
-DATASET_POOL = {
-    "general_dataset": GeneralDataset,
-    "pair_dataset": RegistrationPairDataset,
-    "custom_dataset": None,
-}
-
-
-from shapmagn.models_reg.model_lddmm import LDDMMOPT
-from shapmagn.models_reg.model_discrete_flow import DiscreteFlowOPT
-from shapmagn.models_reg.model_gradient_flow import GradientFlowOPT
-from shapmagn.models_reg.model_probreg import ProRegOPT
-from shapmagn.models_reg.model_prealign import PrealignOPT
-from shapmagn.models_reg.model_deep_feature import DeepFeature
-from shapmagn.models_reg.model_deep_flow import DeepDiscreteFlow
-from shapmagn.models_reg.model_wasserstein_barycenter import WasserBaryCenterOPT
-from shapmagn.models_general.model_deep_pred import DeepPredictor
-
-MODEL_POOL = {
-    "lddmm_opt": LDDMMOPT,
-    "discrete_flow_opt": DiscreteFlowOPT,
-    "prealign_opt": PrealignOPT,
-    "gradient_flow_opt": GradientFlowOPT,
-    "feature_deep": DeepFeature,
-    "flow_deep": DeepDiscreteFlow,
-    "discrete_flow_deep": DeepDiscreteFlow,
-    "barycenter_opt": WasserBaryCenterOPT,
-    "probreg_opt": ProRegOPT,
-    "deep_predictor": DeepPredictor,
-}
-
-
-from shapmagn.shape.point_sampler import point_grid_sampler, point_uniform_sampler
-
-SHAPE_SAMPLER_POOL = {
-    "point_grid": point_grid_sampler,
-    "point_uniform": point_uniform_sampler,
-}
+# the pools below are lazy, an entry (and its dependencies, e.g. pykeops, geomloss, probreg, pointnet2)
+# is only imported at its first lookup
+
+LOSS_POOL = LazyRegistry(
+    {
+        "current": "shapmagn.metrics.reg_losses.CurrentDistance",
+        "varifold": "shapmagn.metrics.reg_losses.VarifoldDistance",
+        "geomloss": "shapmagn.metrics.reg_losses.GeomDistance",
+        "l2": "shapmagn.metrics.reg_losses.L2Distance",
+        "localreg": "shapmagn.metrics.reg_losses.LocalReg",
+        "gmm": "shapmagn.metrics.reg_losses.GMMLoss",
+    }
+)
+
+
+DATASET_POOL = LazyRegistry(
+    {
+        "general_dataset": "shapmagn.datasets.general_dataset.GeneralDataset",
+        "pair_dataset": "shapmagn.datasets.pair_dataset.RegistrationPairDataset",
+        "custom_dataset": None,
+    }
+)
+
+
+MODEL_POOL = LazyRegistry(
+    {
+        "lddmm_opt": "shapmagn.models_reg.model_lddmm.LDDMMOPT",
+        "discrete_flow_opt": "shapmagn.models_reg.model_discrete_flow.DiscreteFlowOPT",
+        "prealign_opt": "shapmagn.models_reg.model_prealign.PrealignOPT",
+        "gradient_flow_opt": "shapmagn.models_reg.model_gradient_flow.GradientFlowOPT",
+        "feature_deep": "shapmagn.models_reg.model_deep_feature.DeepFeature",
+        "flow_deep": "shapmagn.models_reg.model_deep_flow.DeepDiscreteFlow",
+        "discrete_flow_deep": "shapmagn.models_reg.model_deep_flow.DeepDiscreteFlow",
+        "barycenter_opt": "shapmagn.models_reg.model_wasserstein_barycenter.WasserBaryCenterOPT",
+        "probreg_opt": "shapmagn.models_reg.model_probreg.ProRegOPT",
+        "deep_predictor": "shapmagn.models_general.model_deep_pred.DeepPredictor",
+    }
+)
+
+
+SHAPE_SAMPLER_POOL = LazyRegistry(
+    {
+        "point_grid": "shapmagn.shape.point_sampler.point_grid_sampler",
+        "point_uniform": "shapmagn.shape.point_sampler.point_uniform_sampler",
+    }
+)
 # INTERPOLATOR_POOL = {"point_kernel":nadwat_kernel_interpolator, "point_spline": spline_intepolator}
@@ -0,0 +1,306 @@
+"""
+a kernel front-end that picks the backend per call
+
+TorchKernel (dense) is the fastest for small problems but needs O(B*N*M) memory,
+LazyKeopsKernel scales to large problems but pays a JIT compile at the first call of each formula.
+AutoKernel dispatches each call to
+    "dense":   TorchKernel, when B*N*M is below the calibrated threshold and fits into the memory budget
+    "chunked": TorchKernel on chunks of the N rows, the peak memory is bounded by max_chunk_bytes
+    "keops":   LazyKeopsKernel
+the thresholds are read from a per-machine profile (json) written by calibrate_kernel_profile,
+default thresholds are used for the devices that haven't been calibrated
+
+python auto_kernels.py --device cpu --dtype float32
+"""
+import os
+import json
+from time import time
+import torch
+from torch.utils.checkpoint import checkpoint
+from shapmagn.kernels.torch_kernels import TorchKernel
+
+PROFILE_PATH = os.environ.get(
+    "SHAPMAGN_KERNEL_PROFILE",
+    os.path.join(os.path.expanduser("~"), ".shapmagn", "kernel_profile.json"),
+)
+DEFAULT_PROFILE = {
+    "cpu": {"dense_max_pairs": 4e6, "large_backend": "chunked"},
+    "cuda": {"dense_max_pairs": 1e7, "large_backend": "keops"},
+}
+# index of the i/j position in the input arguments and the index of the arguments indexed by i
+KERNEL_SIGNATURE = {
+    "gauss": {"x": 0, "y": 1, "i_args": [0]},
+    "multi_gauss": {"x": 0, "y": 1, "i_args": [0]},
+    "gauss_lin": {"x": 0, "y": 1, "i_args": [0, 2]},
+    "gauss_grad": {"x": 1, "y": 3, "i_args": [0, 1]},
+    "multi_gauss_grad": {"x": 1, "y": 3, "i_args": [0, 1]},
+}
+
+_profile_cache = {}
+_keops_available = []
+
+
+def keops_available():
+    if not _keops_available:
+        try:
+            import pykeops
+
+            _keops_available.append(True)
+        except ImportError:
+            _keops_available.append(False)
+    return _keops_available[0]
+
+
+def get_profile_key(device, dtype):
+    return "{}_{}".format(torch.device(device).type, str(dtype).replace("torch.", ""))
+
+
+def load_kernel_profile(profile_path=PROFILE_PATH):
+    if profile_path not in _profile_cache:
+        profile = {}
+        if os.path.isfile(profile_path):
+            with open(profile_path) as f:
+                profile = json.load(f)
+        _profile_cache[profile_path] = profile
+    return _profile_cache[profile_path]
+
+
+class AutoKernel(object):
+    """
+    kernel front-end over TorchKernel/LazyKeopsKernel, support batch
+    """
+
+    def __init__(
+        self,
+        kernel_type="gauss",
+        backend="auto",
+        max_dense_bytes=2 ** 30,
+        max_chunk_bytes=2 ** 28,
+        profile_path=PROFILE_PATH,
+        **kernel_args
+    ):
+        """
+        :param kernel_type: str, one of the kernels supported by both TorchKernel and LazyKeopsKernel
+        :param backend: 'auto'/'dense'/'chunked'/'keops', force a backend if not 'auto'
+        :param max_dense_bytes: int, estimated memory budget of an unchunked dense call
+        :param max_chunk_bytes: int, estimated memory budget of each chunk in the chunked mode
+        :param profile_path: str, path of the calibrated profile
+        :param kernel_args: settings of the kernel
+        """
+        assert kernel_type in KERNEL_SIGNATURE, "{} is not supported".format(
+            kernel_type
+        )
+        assert backend in ["auto", "dense", "chunked", "keops"]
+        self.kernel_type = kernel_type
+        self.backend = backend
+        self.max_dense_bytes = max_dense_bytes
+        self.max_chunk_bytes = max_chunk_bytes
+        self.profile_path = profile_path
+        self.kernel_args = kernel_args
+        self.signature = KERNEL_SIGNATURE[kernel_type]
+        self.torch_kernel = TorchKernel(kernel_type, **kernel_args)
+        self._keops_kernel = None
+
+    @property
+    def keops_kernel(self):
+        if self._keops_kernel is None:
+            from shapmagn.kernels.keops_kernels import LazyKeopsKernel
+
+            self._keops_kernel = LazyKeopsKernel(self.kernel_type, **self.kernel_args)
+        return self._keops_kernel
+
+    def _fill_default_args(self, data_args):
+        # the gradient kernels take y=x and py=px by default
+        data_args = list(data_args) + [None] * (4 - len(data_args))
+        if self.kernel_type.endswith("grad"):
+            if data_args[3] is None:
+                data_args[3] = data_args[1]
+            if data_args[2] is None:
+                data_args[2] = data_args[0]
+        return [arg for arg in data_args if arg is not None]
+
+    def _pair_bytes(self, data_args):
+        # rough estimate of the memory of the BxNxM intermediate tensors per (i,j) pair
+        x = data_args[self.signature["x"]]
+        return x.element_size() * (2 * x.shape[-1] + 4)
+
+    def select_backend(self, data_args):
+        """
+        :return: 'dense'/'chunked'/'keops'
+        """
+        if self.backend != "auto":
+            return self.backend
+        x, y = data_args[self.signature["x"]], data_args[self.signature["y"]]
+        B, N, M = x.shape[0], x.shape[1], y.shape[1]
+        profile = load_kernel_profile(self.profile_path).get(
+            get_profile_key(x.device, x.dtype),
+            DEFAULT_PROFILE.get(x.device.type, DEFAULT_PROFILE["cpu"]),
+        )
+        pairs = B * N * M
+        if pairs <= profile["dense_max_pairs"]:
+            fits = pairs * self._pair_bytes(data_args) <= self.max_dense_bytes
+            return "dense" if fits else "chunked"
+        large_backend = profile["large_backend"]
+        if large_backend == "keops" and not keops_available():
+            large_backend = "chunked"
+        return large_backend
+
+    def chunked_dense(self, data_args):
+        """
+        evaluate the dense kernel on chunks of the N rows, with autograd each chunk is checkpointed,
+        i.e. recomputed during the backward, so the BxNxM intermediate tensors are never stored at once
+        """
+        x, y = data_args[self.signature["x"]], data_args[self.signature["y"]]
+        B, N, M = x.shape[0], x.shape[1], y.shape[1]
+        chunk_size = max(
+            1, int(self.max_chunk_bytes // (B * M * self._pair_bytes(data_args)))
+        )
+        if chunk_size >= N:
+            return self.torch_kernel(*data_args)
+        i_args = self.signature["i_args"]
+        use_checkpoint = torch.is_grad_enabled() and any(
+            arg.requires_grad for arg in data_args
+        )
+
+        def chunk_kernel(*chunk_args):
+            return self.torch_kernel(*chunk_args)
+
+        res_list = []
+        for start in range(0, N, chunk_size):
+            chunk_args = [
+                arg[:, start : start + chunk_size] if i in i_args else arg
+                for i, arg in enumerate(data_args)
+            ]
+            if use_checkpoint:
+                res_list.append(checkpoint(chunk_kernel, *chunk_args))
+            else:
+                res_list.append(chunk_kernel(*chunk_args))
+        return torch.cat(res_list, 1)
+
+    def __call__(self, *data_args):
+        data_args = self._fill_default_args(data_args)
+        backend = self.select_backend(data_args)
+        if backend == "dense":
+            return self.torch_kernel(*data_args)
+        elif backend == "chunked":
+            return self.chunked_dense(data_args)
+        else:
+            return self.keops_kernel(*data_args)
+
+
+def _timing(fn, device, repeat=3):
+    elapsed_list = []
+    for _ in range(repeat):
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time()
+        fn()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        elapsed_list.append(time() - start)
+    return min(elapsed_list)
+
+
+def calibrate_kernel_profile(
+    device="cpu",
+    dtype=torch.float32,
+    sizes=(256, 1024, 4096, 16384),
+    D=3,
+    repeat=3,
+    profile_path=PROFILE_PATH,
+):
+    """
+    micro-benchmark of the gauss kernel (N=M, batch 1) with the three backends, the result is saved into the profile:
+    dense_max_pairs: the largest N*M where the dense(or chunked) torch kernel is still faster than keops
+    large_backend: the faster one between keops and chunked at the largest size
+    the keops compile time (first call) is excluded from the timing but recorded
+
+    :param device: str or torch.device
+    :param dtype: torch.dtype
+    :param sizes: list of N
+    :param D: int, dimension of the points
+    :param repeat: int
+    :param profile_path: str
+    :return: dict, the profile entry of the device/dtype
+    """
+    device = torch.device(device)
+    kernels = {
+        backend: AutoKernel("gauss", backend=backend, sigma=0.1)
+        for backend in ["dense", "chunked", "keops"]
+    }
+    use_keops = keops_available()
+    timings = {}
+    keops_compile_time = None
+    for n in sizes:
+        x = torch.rand(1, n, D, device=device, dtype=dtype)
+        b = torch.rand(1, n, 1, device=device, dtype=dtype)
+        timing = {}
+        dense = kernels["dense"]
+        if n * n * dense._pair_bytes([x, x, b]) <= dense.max_dense_bytes:
+            timing["dense"] = _timing(lambda: dense(x, x, b), device, repeat)
+        timing["chunked"] = _timing(
+            lambda: kernels["chunked"](x, x, b), device, repeat
+        )
+        if use_keops:
+            if keops_compile_time is None:
+                keops_compile_time = _timing(
+                    lambda: kernels["keops"](x, x, b), device, 1
+                )
+            timing["keops"] = _timing(lambda: kernels["keops"](x, x, b), device, repeat)
+        timings[n] = timing
+        print("N=M={}: {}".format(n, {k: "{:.4f}s".format(v) for k, v in timing.items()}))
+
+    dense_max_pairs = 0
+    for n in sizes:
+        timing = timings[n]
+        torch_time = min(timing.get("dense", float("inf")), timing["chunked"])
+        if torch_time <= timing.get("keops", float("inf")):
+            dense_max_pairs = n * n
+    if not use_keops:
+        dense_max_pairs = 1e18
+    largest = timings[sizes[-1]]
+    large_backend = (
+        "keops"
+        if largest.get("keops", float("inf")) < largest["chunked"]
+        else "chunked"
+    )
+    entry = {
+        "dense_max_pairs": dense_max_pairs,
+        "large_backend": large_backend,
+        "keops_compile_time": keops_compile_time,
+        "timings": {str(n): timing for n, timing in timings.items()},
+    }
+    profile = {}
+    if os.path.isfile(profile_path):
+        with open(profile_path) as f:
+            profile = json.load(f)
+    profile[get_profile_key(device, dtype)] = entry
+    os.makedirs(os.path.dirname(os.path.abspath(profile_path)), exist_ok=True)
+    with open(profile_path, "w") as f:
+        json.dump(profile, f, indent=4)
+    _profile_cache.pop(profile_path, None)
+    print("the kernel profile is saved into {}".format(profile_path))
+    return entry
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="calibrate the dense/keops dispatch thresholds of AutoKernel"
+    )
+    parser.add_argument("--device", type=str, default="cpu", help="cpu or cuda:0")
+    parser.add_argument("--dtype", type=str, default="float32", help="float32/float64")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[256, 1024, 4096, 16384], help="list of N"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--profile_path", type=str, default=PROFILE_PATH)
+    args = parser.parse_args()
+    calibrate_kernel_profile(
+        args.device,
+        getattr(torch, args.dtype),
+        args.sizes,
+        repeat=args.repeat,
+        profile_path=args.profile_path,
+    )
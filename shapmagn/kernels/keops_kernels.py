@@ -1,6 +1,8 @@
 import numpy as np
 import torch
 from pykeops.torch import Vi, Vj, Pm, LazyTensor
+from shapmagn.utils.voxel_hash_utils import build_truncated_ranges
+from shapmagn.utils.profiler import profile
 
 ##################  Lazy Tensor  #######################
 
@@ -10,7 +12,14 @@ class LazyKeopsKernel(object):
     LazyTensor formulaton in Keops,  support batch
     """
 
-    def __init__(self, kernel_type="gauss", **kernel_args):
+    def __init__(self, kernel_type="gauss", truncate_sigma=None, **kernel_args):
+        """
+        :param kernel_type: str, name of the kernel
+        :param truncate_sigma: optional float, if set, the kernel is computed as a block-sparse reduction:
+            the points are voxel-hashed and the interactions farther than truncate_sigma*sigma (the largest sigma
+            for multi-scale kernels) are dropped, supported for gauss, multi_gauss, gauss_grad, multi_gauss_grad and gauss_lin
+        :param kernel_args: settings of the kernel
+        """
         assert kernel_type in [
             "gauss",
             "multi_gauss",
@@ -35,7 +44,22 @@ class LazyKeopsKernel(object):
             "aniso_gauss": self.aniso_gauss_kernel,
             "aniso_multi_gauss": self.aniso_multi_gauss_kernel,
         }
-        self.kernel = self.kernels[self.kernel_type](**kernel_args)
+        self.block_sparse_kernels = {
+            "gauss": self.block_sparse_gauss_kernel,
+            "multi_gauss": self.block_sparse_multi_gauss_kernel,
+            "gauss_grad": self.block_sparse_gaussian_gradient,
+            "multi_gauss_grad": self.block_sparse_multi_gaussian_gradient,
+            "gauss_lin": self.block_sparse_gauss_lin_kernel,
+        }
+        if truncate_sigma is None:
+            self.kernel = self.kernels[self.kernel_type](**kernel_args)
+        else:
+            assert (
+                self.kernel_type in self.block_sparse_kernels
+            ), "block-sparse mode is not supported for {}".format(self.kernel_type)
+            self.kernel = self.block_sparse_kernels[self.kernel_type](
+                truncate_sigma=truncate_sigma, **kernel_args
+            )
 
     @staticmethod
     def gauss_kernel(sigma=0.1):
@@ -257,7 +281,196 @@ class LazyKeopsKernel(object):
         return conv
 
     def __call__(self, *data_args):
-        return self.kernel(*data_args)
+        with profile("kernel"):
+            return self.kernel(*data_args)
+
+    @staticmethod
+    def block_sparse_reduction(formula, cutoff, x, y, i_vars, j_vars):
+        """
+        sum over j of formula(i_vars, j_vars), only the (i,j) pairs whose voxels (of size cutoff) are adjacent are visited
+        the block-sparse ranges of KeOps only work without batch dimension, so the batch is looped over
+
+        :param formula: callable, (list of LazyTensor Nx1x*, list of LazyTensor 1xMx*) -> LazyTensor NxMxd
+        :param cutoff: float, interactions farther than the cutoff can be dropped
+        :param x: torch.Tensor, BxNxD, the positions i used to build the voxel hash
+        :param y: torch.Tensor, BxMxD, the positions j used to build the voxel hash
+        :param i_vars: list of BxNx* tensors
+        :param j_vars: list of BxMx* tensors
+        :return: torch.Tensor, BxNxd
+        """
+        res_list = []
+        for b in range(x.shape[0]):
+            x_order, y_order, ranges_ij = build_truncated_ranges(x[b], y[b], cutoff)
+            lazy_i = [LazyTensor(var[b][x_order][:, None]) for var in i_vars]
+            lazy_j = [LazyTensor(var[b][y_order][None]) for var in j_vars]
+            reduction = formula(lazy_i, lazy_j)
+            reduction.ranges = ranges_ij
+            res_sorted = reduction.sum(dim=1)
+            res_list.append(res_sorted[torch.argsort(x_order)])
+        return torch.stack(res_list, 0)
+
+    @staticmethod
+    def block_sparse_gauss_kernel(sigma=0.1, truncate_sigma=4.0):
+        """
+        block-sparse counterpart of gauss_kernel
+        :param sigma: scalar
+        :param truncate_sigma: float, interactions farther than truncate_sigma*sigma are dropped
+        :return:
+        """
+        sig2 = sigma * (2 ** (1 / 2))
+
+        def formula(lazy_i, lazy_j):
+            x, (y, b) = lazy_i[0], lazy_j
+            return (-x.sqdist(y)).exp() * b
+
+        def conv(x, y, b):
+            """
+
+            :param x: torch.Tensor, BxNxD,  input position1
+            :param y: torch.Tensor, BxMxD input position2
+            :param b: torch.Tensor, BxMxd, input val
+            :return:torch.Tensor, BxNxd, output
+            """
+            return LazyKeopsKernel.block_sparse_reduction(
+                formula, truncate_sigma * sigma, x, y, [x / sig2], [y / sig2, b]
+            )
+
+        return conv
+
+    @staticmethod
+    def block_sparse_multi_gauss_kernel(
+        sigma_list=None, weight_list=None, truncate_sigma=4.0
+    ):
+        """
+        block-sparse counterpart of multi_gauss_kernel, the cutoff is set by the largest sigma
+        :param sigma_list: a list of sigma
+        :param weight_list: corresponding list of weight, sum(weight_list)=1
+        :param truncate_sigma: float, interactions farther than truncate_sigma*max(sigma_list) are dropped
+        :return:
+        """
+        gamma_list = [1 / (2 * sigma * sigma) for sigma in sigma_list]
+
+        def formula(lazy_i, lazy_j):
+            x, (y, b) = lazy_i[0], lazy_j
+            dist2 = x.sqdist(y)
+            kernel = 0
+            for gamma, weight in zip(gamma_list, weight_list):
+                kernel += weight * (-dist2 * gamma).exp()
+            return kernel * b
+
+        def conv(x, y, b):
+            """
+
+            :param x: torch.Tensor, BxNxD,  input position1
+            :param y: torch.Tensor, BxMxD input position2
+            :param b: torch.Tensor, BxMxd, input val
+            :return:torch.Tensor, BxNxd, output
+            """
+            return LazyKeopsKernel.block_sparse_reduction(
+                formula, truncate_sigma * max(sigma_list), x, y, [x], [y, b]
+            )
+
+        return conv
+
+    @staticmethod
+    def block_sparse_gaussian_gradient(sigma=0.1, truncate_sigma=4.0):
+        """
+        block-sparse counterpart of gaussian_gradient
+        :param sigma: scalar
+        :param truncate_sigma: float, interactions farther than truncate_sigma*sigma are dropped
+        :return:
+        """
+
+        def formula(lazy_i, lazy_j):
+            (x, px), (y, py) = lazy_i, lazy_j
+            kernel = (-x.sqdist(y) * 0.5).exp()
+            return (x - y) * kernel * (py | px)
+
+        def conv(px, x, py=None, y=None):
+            """
+            :param px: torch.Tensor, BxNxD,  input position1
+             :param y: torch.Tensor, BxMxD, input val1
+            :param py: torch.Tensor, BxNxD input position2
+            :param y: torch.Tensor, BxMxD, input val2
+            :return: torch.Tensor, BxNxD, output
+            """
+            if y is None:
+                y = x
+            if py is None:
+                py = px
+            return (-1 / sigma) * LazyKeopsKernel.block_sparse_reduction(
+                formula, truncate_sigma * sigma, x, y, [x / sigma, px], [y / sigma, py]
+            )
+
+        return conv
+
+    @staticmethod
+    def block_sparse_multi_gaussian_gradient(
+        sigma_list=None, weight_list=None, truncate_sigma=4.0
+    ):
+        """
+        block-sparse counterpart of multi_gaussian_gradient, the cutoff is set by the largest sigma
+        :param sigma_list: a list of sigma
+        :param weight_list: corresponding list of weight, sum(weight_list)=1
+        :param truncate_sigma: float, interactions farther than truncate_sigma*max(sigma_list) are dropped
+        :return:
+        """
+        gamma_list = [1 / (2 * sigma * sigma) for sigma in sigma_list]
+
+        def formula(lazy_i, lazy_j):
+            (x, px), (y, py) = lazy_i, lazy_j
+            dist2 = x.sqdist(y)
+            kernel = 0.0
+            for gamma, weight in zip(gamma_list, weight_list):
+                kernel += ((-dist2 * gamma).exp()) * gamma * weight
+            return (x - y) * kernel * (py | px)
+
+        def conv(px, x, py=None, y=None):
+            """
+            :param px: torch.Tensor, BxNxD,  input position1
+            :param x: torch.Tensor, BxNxD input position2
+            :param y: torch.Tensor, BxMxD, input val1
+            :param py: torch.Tensor, BxMxD, input val2
+            :return: torch.Tensor, BxNxD, output
+            """
+            if y is None:
+                y = x
+            if py is None:
+                py = px
+            return (-2) * LazyKeopsKernel.block_sparse_reduction(
+                formula, truncate_sigma * max(sigma_list), x, y, [x, px], [y, py]
+            )
+
+        return conv
+
+    @staticmethod
+    def block_sparse_gauss_lin_kernel(sigma=0.1, truncate_sigma=4.0):
+        """
+        block-sparse counterpart of gauss_lin_kernel
+        :param sigma: scalar
+        :param truncate_sigma: float, interactions farther than truncate_sigma*sigma are dropped
+        :return:
+        """
+        sig2 = sigma * (2 ** (1 / 2))
+
+        def formula(lazy_i, lazy_j):
+            (x, u), (y, v, b) = lazy_i, lazy_j
+            return (-x.sqdist(y)).exp() * ((u | v).square()) * b
+
+        def conv(x, y, u, v, b):
+            """
+            :param x: torch.Tensor, BxNxD,  input position1
+            :param y: torch.Tensor, BxMxD input position2
+            :param u: torch.Tensor, BxNxD, input val1
+            :param v: torch.Tensor, BxMxD, input val2
+            :param b: torch.Tensor, BxMxd, input scalar vector
+            :return: torch.Tensor, BxNxd, output
+            """
+            return LazyKeopsKernel.block_sparse_reduction(
+                formula, truncate_sigma * sigma, x, y, [x / sig2, u], [y / sig2, v, b]
+            )
+
+        return conv
 
     @staticmethod
     def aniso_gauss_kernel(self_center=False):
@@ -1,4 +1,5 @@
 import torch
+from shapmagn.utils.profiler import profile
 
 
 class TorchKernel(object):
@@ -155,4 +156,5 @@ class TorchKernel(object):
         return reduce
 
     def __call__(self, *data_args):
-        return self.kernel(*data_args)
+        with profile("kernel"):
+            return self.kernel(*data_args)
@@ -6,23 +6,30 @@ import torch
 from pykeops.torch import LazyTensor
 from shapmagn.kernels.keops_kernels import LazyKeopsKernel
 from shapmagn.kernels.torch_kernels import TorchKernel
+from shapmagn.kernels.auto_kernels import AutoKernel
 from shapmagn.modules_reg.networks.pointconv_util import index_points_group
 from shapmagn.utils.obj_factory import obj_factory
 from shapmagn.global_variable import Shape
 from shapmagn.utils.utils import sigmoid_decay
+from shapmagn.utils.profiler import profile
 
 
 class CurrentDistance(object):
     def __init__(self, opt):
         kernel_backend = opt[
-            ("kernel_backend", "torch", "kernel backend can either be 'torch'/'keops'")
+            (
+                "kernel_backend",
+                "torch",
+                "kernel backend can either be 'torch'/'keops'/'auto', 'auto' picks the backend per call",
+            )
         ]
         sigma = opt[("sigma", 0.1, "the sigma in gaussian kernel")]
-        self.kernel = (
-            LazyKeopsKernel("gauss", sigma=sigma)
-            if kernel_backend == "keops"
-            else TorchKernel("gauss", sigma=sigma)
-        )
+        kernel_class = {
+            "torch": TorchKernel,
+            "keops": LazyKeopsKernel,
+            "auto": AutoKernel,
+        }[kernel_backend]
+        self.kernel = kernel_class("gauss", sigma=sigma)
 
     def __call__(self, flowed, target):
         assert flowed.type == "PolyLine"
@@ -47,14 +54,19 @@ class CurrentDistance(object):
 class VarifoldDistance(object):
     def __init__(self, opt):
         kernel_backend = opt[
-            ("kernel_backend", "torch", "kernel backend can either be 'torch'/'keops'")
+            (
+                "kernel_backend",
+                "torch",
+                "kernel backend can either be 'torch'/'keops'/'auto', 'auto' picks the backend per call",
+            )
         ]
         sigma = opt[("sigma", 0.1, "the sigma in gaussian lin kernel")]
-        self.kernel = (
-            LazyKeopsKernel("gauss_lin", sigma=sigma)
-            if kernel_backend == "keops"
-            else TorchKernel("gauss_lin", sigma=sigma)
-        )
+        kernel_class = {
+            "torch": TorchKernel,
+            "keops": LazyKeopsKernel,
+            "auto": AutoKernel,
+        }[kernel_backend]
+        self.kernel = kernel_class("gauss_lin", sigma=sigma)
 
     def __call__(self, flowed, target, epoch=None):
         assert flowed.type == "SurfaceMesh"
@@ -247,7 +259,8 @@ class GeomDistance(object):
         weight1 = flowed.weights[:, :, 0]  # remove the last dim
         weight2 = target.weights[:, :, 0]  # remove the last dim
         grad_enable_record = torch.is_grad_enabled()
-        loss = self.gemoloss(weight1, attr1, weight2, attr2)
+        with profile("sinkhorn"):
+            loss = self.gemoloss(weight1, attr1, weight2, attr2)
         torch.set_grad_enabled(grad_enable_record)
         return loss
 
@@ -268,8 +281,8 @@ class CurvatureReg(object):
         knn_obj = opt[
             (
                 "knn_obj",
-                "knn_utils.KNN()",
-                "the kernel size used to interpolate between the flowed shape from the target shape",
+                "knn_utils.KNN(use_graph_cache=True)",
+                "the knn used to define the curvature, the self query on the (static) source/target is cached",
             )
         ]
         self.knn = obj_factory(knn_obj)
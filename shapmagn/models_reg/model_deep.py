@@ -1,8 +1,11 @@
 import os
+import torch
 import torch.nn as nn
 from shapmagn.models_reg.model_base import ModelBase
-from shapmagn.global_variable import *
+from shapmagn.global_variable import MODEL_POOL
+from shapmagn.utils.obj_factory import obj_factory
 from shapmagn.utils.net_utils import print_model
+from shapmagn.utils.distributed import is_distributed
 from shapmagn.utils.shape_visual_utils import save_shape_pair_into_files
 from shapmagn.modules_reg.optimizer import optimizer_builder
 from shapmagn.modules_reg.scheduler import scheduler_builder
@@ -73,8 +76,23 @@ class DeepModel(ModelBase):
             self._model = MODEL_POOL[method_name](method_opt)
         else:
             raise ValueError("method not supported")
-        self._model = nn.DataParallel(self._model, gpus)
-        self._model.to(device)
+        if is_distributed():
+            find_unused_parameters = opt[
+                (
+                    "ddp_find_unused_parameters",
+                    True,
+                    "let DistributedDataParallel skip the parameters not used in the forward",
+                )
+            ]
+            self._model.to(device)
+            self._model = nn.parallel.DistributedDataParallel(
+                self._model,
+                device_ids=gpus if device.type == "cuda" else None,
+                find_unused_parameters=find_unused_parameters,
+            )
+        else:
+            self._model = nn.DataParallel(self._model, gpus)
+            self._model.to(device)
         self.optimizer = optimizer_builder(self.opt_optim)(self._model.parameters())
         self.lr_scheduler = scheduler_builder(self.opt_scheduler)(self.optimizer)
         self.shape_folder_3d = os.path.join(self.record_path, "3d")
@@ -158,7 +176,7 @@ class DeepModel(ModelBase):
         input_data, self.batch_info = self.prepare_input(input_data, batch_info)
 
         ##################### unknown bug during single gpu training, when gpu_id!=0 and call pointnet2_utils.py an ugly workaround  todo debug the pointnet2_utils
-        if len(self.gpu_ids) == 1 and self.gpu_ids[0] != 0:
+        if self.gpu_ids and len(self.gpu_ids) == 1 and self.gpu_ids[0] != 0:
             from pykeops.torch import LazyTensor
 
             a = LazyTensor(input_data["source"]["points"][:, :, None])
@@ -7,6 +7,7 @@ from shapmagn.metrics.reg_losses import Loss, GeomDistance
 from shapmagn.modules_reg.opt_flowed_eval import opt_flow_model_eval
 from shapmagn.utils.obj_factory import obj_factory, partial_obj_factory
 from shapmagn.utils.utils import sigmoid_decay
+from shapmagn.utils.profiler import profile
 from shapmagn.modules_reg.module_gradient_flow import (
     gradient_flow_guide,
     wasserstein_barycenter_mapping,
@@ -150,7 +151,10 @@ class DiscreteFlowOPT(nn.Module):
         )
         self.spline_kernel.set_flow(True)
         interped_control_points_disp = self.spline_kernel(
-            toflow_points, control_points, shape_pair.reg_param, control_weights
+            toflow_points,
+            control_points,
+            shape_pair.reg_param * shape_pair.get_control_mask(),
+            control_weights,
         )
         self.spline_kernel.set_flow(False)
         flowed_points = interped_control_points_high + interped_control_points_disp
@@ -179,11 +183,17 @@ class DiscreteFlowOPT(nn.Module):
     #     shape_pair.set_flowed(flowed)
     #     return shape_pair
 
-    def regularization(self, sm_flow, flow):
+    def regularization(self, sm_flow, flow, control_mask=None):
+        """
+        :param sm_flow: BxNxD, the smoothed momentum
+        :param flow: BxNxD, the momentum
+        :param control_mask: BxNx1, if given, the energy is averaged over the masked control points only
+        :return: B
+        """
         dist = sm_flow * flow
-        dist = dist.mean(2).mean(1)
-
-        return dist
+        if control_mask is None:
+            return dist.mean(2).mean(1)
+        return (dist * control_mask).mean(2).sum(1) / control_mask[..., 0].sum(1)
 
     def get_factor(self):
         """
@@ -327,7 +337,7 @@ class DiscreteFlowOPT(nn.Module):
         """DiscreteFlowOPT supports feature extraction"""
         if not self.pair_feature_extractor:
             return self.extract_point_fea(flowed, target, self.global_iter)
-        else:
+        with profile("feature_extraction"):
             return self.pair_feature_extractor(flowed, target, self.global_iter)
 
     def standard_spline_forward(self, shape_pair):
@@ -343,10 +353,13 @@ class DiscreteFlowOPT(nn.Module):
             self.drift(shape_pair)
             control_points = self.drift_buffer["moving_control_points"]
         # todo check the behavior of spline kernel with shape_pair.control points as input
+        # the zero weight padding points carry no momentum
+        control_mask = shape_pair.get_control_mask()
+        reg_param = shape_pair.reg_param * control_mask
         smoothed_reg_param = self.spline_kernel(
             control_points,
             control_points,
-            shape_pair.reg_param,
+            reg_param,
             shape_pair.control_weights,
         )
         flowed_control_points = control_points + smoothed_reg_param
@@ -357,7 +370,7 @@ class DiscreteFlowOPT(nn.Module):
             shape_pair.flowed, shape_pair.target
         )
         sim_loss = self.sim_loss_fn(shape_pair.flowed, shape_pair.target)
-        reg_loss = self.reg_loss_fn(smoothed_reg_param, shape_pair.reg_param)
+        reg_loss = self.reg_loss_fn(smoothed_reg_param, reg_param, control_mask)
         sim_factor, reg_factor = self.get_factor()
         sim_loss = sim_loss * sim_factor
         reg_loss = reg_loss * reg_factor
@@ -365,8 +378,8 @@ class DiscreteFlowOPT(nn.Module):
             print(
                 "{} th step, sim_loss is {}, reg_loss is {}, sim_factor is {}, reg_factor is {}".format(
                     self.local_iter.item(),
-                    sim_loss.item(),
-                    reg_loss.item(),
+                    sim_loss.mean().item(),
+                    reg_loss.mean().item(),
                     sim_factor,
                     reg_factor,
                 )
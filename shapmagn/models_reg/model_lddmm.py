@@ -1,7 +1,11 @@
 from copy import deepcopy
 import torch
 import torch.nn as nn
-from shapmagn.modules_reg.module_lddmm import LDDMMHamilton, LDDMMVariational
+from shapmagn.modules_reg.module_lddmm import (
+    LDDMMHamilton,
+    LDDMMVariational,
+    LDDMMTrajectory,
+)
 from shapmagn.modules_reg.module_gradient_flow import gradient_flow_guide
 from shapmagn.global_variable import Shape
 from shapmagn.metrics.reg_losses import Loss
@@ -9,6 +13,7 @@ from shapmagn.modules_reg.ode_int import ODEBlock
 from shapmagn.modules_reg.opt_flowed_eval import opt_flow_model_eval
 from shapmagn.utils.utils import sigmoid_decay
 from shapmagn.utils.obj_factory import obj_factory
+from shapmagn.utils.profiler import profile, count
 
 
 class LDDMMOPT(nn.Module):
@@ -57,6 +62,18 @@ class LDDMMOPT(nn.Module):
         self.integrator_opt = self.opt[("integrator", {}, "settings for integrator")]
         self.integrator = ODEBlock(self.integrator_opt)
         self.integrator.set_func(self.lddmm_module)
+        self.cache_trajectory = self.opt[
+            (
+                "cache_trajectory",
+                False,
+                "the flow calls after the optimization (upsampling, landmarks, grids) are integrated without gradient "
+                "along a shooting trajectory recorded once for the current momentum",
+            )
+        ]
+        self.trajectory_time_steps = self.opt[
+            ("trajectory_time_steps", 20, "number of recorded time intervals of the trajectory")
+        ]
+        self.trajectory = None
         self.call_thirdparty_package = False
         self.register_buffer(
             "local_iter", torch.Tensor([0])
@@ -101,6 +118,22 @@ class LDDMMOPT(nn.Module):
             shape_pair.set_reg_param(reg_param)
         return shape_pair
 
+    def get_inverse_reg_param(self, reg_param, control_points, flowed_control_points):
+        """
+        the inverse geodesic starts from the end of the shooting with the negated transported momentum
+
+        :param reg_param: BxNxD, momentum
+        :param control_points: BxNxD
+        :param flowed_control_points: BxNxD, not used, the end points are recomputed with the transported momentum
+        :return: inverse momentum, control points of the inverse
+        """
+        self.lddmm_module.set_mode("shooting")
+        with torch.no_grad():
+            momentum_t, control_points_t = self.integrator.solve(
+                (reg_param.clamp(-1, 1), control_points)
+            )
+        return -momentum_t, control_points_t
+
     def set_loss_fn(self, loss_fn):
         self.sim_loss_fn = loss_fn
 
@@ -112,35 +145,94 @@ class LDDMMOPT(nn.Module):
         self.local_iter = self.local_iter * 0
         self.global_iter = self.global_iter * 0
         self.gradflow_guided_buffer = {}
+        self.trajectory = None
 
     def shooting(self, shape_pair):
         momentum = shape_pair.reg_param
-        momentum = momentum.clamp(-1, 1)
+        momentum = momentum.clamp(-1, 1) * shape_pair.get_control_mask()
         control_points = shape_pair.get_control_points()
         self.lddmm_module.set_mode("shooting")
-        _, flowed_control_points = self.integrator.solve((momentum, control_points))
+        self.integrator.nfe = 0
+        with profile("ode_shooting"):
+            _, flowed_control_points = self.integrator.solve((momentum, control_points))
+        count("ode_nfe", self.integrator.nfe)
         shape_pair.set_flowed_control_points(flowed_control_points)
         return shape_pair
 
+    def get_trajectory(self, momentum, control_points):
+        """
+        the recorded shooting trajectory, it is (re)computed if the momentum or the control points have changed
+        """
+        if self.trajectory is None or not self.trajectory.is_valid_for(
+            momentum, control_points
+        ):
+            self.lddmm_module.set_mode("shooting")
+            self.integrator.nfe = 0
+            with profile("ode_shooting"):
+                times, (momentum_list, control_points_list) = self.integrator.solve_trajectory(
+                    (momentum, control_points), self.trajectory_time_steps
+                )
+            count("ode_nfe", self.integrator.nfe)
+            self.trajectory = LDDMMTrajectory(times, momentum_list, control_points_list)
+        return self.trajectory
+
+    def flow_along_trajectory(self, shape_pair):
+        with torch.no_grad():
+            trajectory = self.get_trajectory(
+                shape_pair.reg_param * shape_pair.get_control_mask(),
+                shape_pair.control_points,
+            )
+            with profile("ode_flow_cached"):
+                flowed_points = trajectory.flow(
+                    self.lddmm_module.velocity, shape_pair.get_toflow_points()
+                )[0]
+        shape_pair.flowed_control_points = trajectory.flowed_control_points()
+        flowed = Shape()
+        flowed.set_data_with_refer_to(flowed_points, shape_pair.source)
+        shape_pair.set_flowed(flowed)
+        return shape_pair
+
     def flow(self, shape_pair):
-        momentum = shape_pair.reg_param
+        """
+        with cache_trajectory, the points are flowed along the recorded trajectory and carry no gradient,
+        the optimization (forward) always integrates the full system
+        """
+        if self.cache_trajectory:
+            return self.flow_along_trajectory(shape_pair)
+        return self.integrate_flow(shape_pair)
+
+    def integrate_flow(self, shape_pair):
+        # the zero weight padding points carry no momentum
+        momentum = shape_pair.reg_param * shape_pair.get_control_mask()
         control_points = shape_pair.control_points
         toflow_points = shape_pair.get_toflow_points()
         self.lddmm_module.set_mode("flow")
-        _, flowed_control_points, flowed_points = self.integrator.solve(
-            (momentum, control_points, toflow_points)
-        )
+        self.integrator.nfe = 0
+        with profile("ode_flow"):
+            _, flowed_control_points, flowed_points = self.integrator.solve(
+                (momentum, control_points, toflow_points)
+            )
+        count("ode_nfe", self.integrator.nfe)
         shape_pair.flowed_control_points = flowed_control_points
         flowed = Shape()
         flowed.set_data_with_refer_to(flowed_points, shape_pair.source)
         shape_pair.set_flowed(flowed)
         return shape_pair
 
-    def geodesic_distance(self, momentum, control_points):
+    def geodesic_distance(self, momentum, control_points, control_mask=None):
+        """
+        :param momentum: BxNxD
+        :param control_points: BxNxD
+        :param control_mask: BxNx1, if given, the distance is averaged over the masked control points only
+        :return: B
+        """
         momentum = momentum.clamp(-1, 1)
+        if control_mask is not None:
+            momentum = momentum * control_mask
         dist = momentum * self.lddmm_kernel(control_points, control_points, momentum)
-        dist = dist.mean(2).mean(1)
-        return dist
+        if control_mask is None:
+            return dist.mean(2).mean(1)
+        return dist.mean(2).sum(1) / control_mask[..., 0].sum(1)
 
     def get_factor(self):
         """
@@ -345,7 +437,7 @@ class LDDMMOPT(nn.Module):
         """LDDMMM support feature extraction"""
         if not self.pair_feature_extractor:
             return self.extract_point_fea(flowed, target, self.global_iter)
-        else:
+        with profile("feature_extraction"):
             return self.pair_feature_extractor(flowed, target, self.global_iter)
 
     def forward(self, shape_pair):
@@ -353,13 +445,15 @@ class LDDMMOPT(nn.Module):
             shape_pair = self.shooting(shape_pair)
             shape_pair.infer_flowed()
         else:
-            shape_pair = self.flow(shape_pair)
+            shape_pair = self.integrate_flow(shape_pair)
         flowed, target = self.extract_fea(shape_pair.flowed, shape_pair.target)
         if self.use_gradflow_guided:
             flowed, target = self.wasserstein_gradient_flow_guidence(flowed, target)
         sim_loss = self.sim_loss_fn(flowed, target)
         reg_loss = self.reg_loss_fn(
-            shape_pair.reg_param, shape_pair.get_control_points()
+            shape_pair.reg_param,
+            shape_pair.get_control_points(),
+            shape_pair.get_control_mask(),
         )
         sim_factor, reg_factor = self.get_factor()
         sim_loss = sim_loss * sim_factor
@@ -368,8 +462,8 @@ class LDDMMOPT(nn.Module):
             print(
                 "{} th step, sim_loss is {}, reg_loss is {}, sim_factor is {}, reg_factor is {}".format(
                     self.local_iter.item(),
-                    sim_loss.item(),
-                    reg_loss.item(),
+                    sim_loss.mean().item(),
+                    reg_loss.mean().item(),
                     sim_factor,
                     reg_factor,
                 )
@@ -1,12 +1,21 @@
 import os
+import torch
 import numpy as np
 from shapmagn.models_reg.model_base import ModelBase
-from shapmagn.global_variable import *
+from shapmagn.global_variable import MODEL_POOL, Shape
+from shapmagn.utils.obj_factory import obj_factory
 from shapmagn.utils.net_utils import print_model
 from shapmagn.models_reg.multiscale_optimization import build_multi_scale_solver
 from shapmagn.utils.shape_visual_utils import save_shape_pair_into_files
+from shapmagn.shape.shape_pair import ShapePair
 from shapmagn.shape.shape_pair_utils import create_shape_pair
 from shapmagn.utils.utils import timming
+from shapmagn.utils.async_writer import submit_write
+from shapmagn.utils.reg_result_store import (
+    RegResultStore,
+    get_shape_content_hash,
+    get_settings_hash,
+)
 
 
 class OptModel(ModelBase):
@@ -63,6 +72,38 @@ class OptModel(ModelBase):
         )
         analyzer_obj = opt[("analyzer_obj", "", "result analyzer")]
         self.external_analyzer = obj_factory(analyzer_obj) if analyzer_obj else None
+        reg_result_store_path = opt[
+            (
+                "reg_result_store_path",
+                "",
+                "folder of the registration result store, the solutions are saved there and used to warm start"
+                " the later runs on the same pairs, disabled if empty",
+            )
+        ]
+        self.reg_result_store = (
+            RegResultStore(reg_result_store_path) if reg_result_store_path else None
+        )
+        self.skip_solved_pair = opt[
+            (
+                "skip_solved_pair",
+                True,
+                "restore the stored solution instead of optimizing if the pair was solved with the same input and settings",
+            )
+        ]
+        self.warm_start = opt[
+            (
+                "warm_start",
+                True,
+                "initialize from the stored solution of the same pair solved with other settings",
+            )
+        ]
+        self.warm_start_from_inverse = opt[
+            (
+                "warm_start_from_inverse",
+                True,
+                "initialize from the inverted solution of the inverse pair (target->source) if it is stored",
+            )
+        ]
 
     def init_optimization_env(self, opt, device):
         method_name = opt[("method_name", "lddmm_opt", "specific optimization method")]
@@ -94,6 +135,7 @@ class OptModel(ModelBase):
             self._model = None
         else:
             raise NotImplemented
+        self.method_name = method_name
         # if gpus and len(gpus) >= 1:
         #     self._model = nn.DataParallel(self._model, gpus)
         if self._prealign_model is not None:
@@ -180,7 +222,13 @@ class OptModel(ModelBase):
             source, target, extra_info=shape_pair.extra_info
         )
         shape_pair.set_pair_name(self.batch_info["pair_name"])
+        source_hash, target_hash = None, None
+        if self.reg_result_store is not None:
+            # the hashes of the input are computed before the prealignment moves the source
+            source_hash = get_shape_content_hash(shape_pair.source)
+            target_hash = get_shape_content_hash(shape_pair.target)
         forward_t_prealign, forward_t_nonp = 0, 0
+        prealign_settings_hash = None
         if self.run_prealign:
             multi_scale_opt = self.opt[
                 (
@@ -190,8 +238,18 @@ class OptModel(ModelBase):
                 )
             ]
             multi_scale_opt["record_path"] = self.record_path
-            sovler = build_multi_scale_solver(multi_scale_opt, self._prealign_model)
-            shape_pair, forward_t_prealign = timming(sovler, return_t=True)(shape_pair)
+            prealign_settings_hash = get_settings_hash(
+                "prealign_opt", self.opt["prealign_opt"], multi_scale_opt
+            )
+            shape_pair, forward_t_prealign = self._solve(
+                "prealign_opt",
+                self._prealign_model,
+                multi_scale_opt,
+                shape_pair,
+                prealign_settings_hash,
+                source_hash,
+                target_hash,
+            )
             save_shape_pair_into_files(
                 self.record_path,
                 "shape_prealigned",
@@ -210,8 +268,21 @@ class OptModel(ModelBase):
                 )
             ]
             multi_scale_opt["record_path"] = self.record_path
-            sovler = build_multi_scale_solver(multi_scale_opt, self._model)
-            shape_pair, forward_t_nonp = timming(sovler, return_t=True)(shape_pair)
+            settings_hash = get_settings_hash(
+                self.method_name,
+                self.opt[self.method_name],
+                multi_scale_opt,
+                prealign_settings_hash,
+            )
+            shape_pair, forward_t_nonp = self._solve(
+                self.method_name,
+                self._model,
+                multi_scale_opt,
+                shape_pair,
+                settings_hash,
+                source_hash,
+                target_hash,
+            )
             save_shape_pair_into_files(
                 self.record_path,
                 "shape_nonparametric",
@@ -221,6 +292,140 @@ class OptModel(ModelBase):
         forward_t = forward_t_prealign + forward_t_nonp
         return shape_pair, forward_t
 
+    def _solve(
+        self,
+        stage,
+        model,
+        multi_scale_opt,
+        shape_pair,
+        settings_hash,
+        source_hash,
+        target_hash,
+    ):
+        """
+        run the multi-scale solver of one stage, warm started from the result store if it is enabled
+
+        :param stage: str, name of the stage, e.g. prealign_opt, lddmm_opt
+        :param model: the model of the stage
+        :param multi_scale_opt: ParameterDict, settings of the multi-scale solver
+        :param shape_pair: ShapePair
+        :param settings_hash: str, hash of the settings that the solution depends on
+        :param source_hash: list of str, content hash of the input source of each pair, None if the store is disabled
+        :param target_hash: list of str, content hash of the input target of each pair, None if the store is disabled
+        :return: ShapePair, forward time
+        """
+        solver = build_multi_scale_solver(multi_scale_opt, model)
+        if self.reg_result_store is None:
+            return timming(solver, return_t=True)(shape_pair)
+        pair_name_list = shape_pair.get_pair_name()
+        allow_inverse = self.warm_start_from_inverse and hasattr(
+            model, "get_inverse_reg_param"
+        )
+        lookup_list = [
+            self.reg_result_store.lookup(
+                stage,
+                pair_name,
+                source_hash[b],
+                target_hash[b],
+                settings_hash,
+                allow_warm=self.warm_start,
+                allow_inverse=allow_inverse,
+            )
+            for b, pair_name in enumerate(pair_name_list)
+        ]
+        match_list = [match for match, _ in lookup_list]
+        entry_list = [entry for _, entry in lookup_list]
+        if self.skip_solved_pair and all(match == "exact" for match in match_list):
+            print(
+                "{} have been solved with the same settings, the stored solution is restored".format(
+                    pair_name_list
+                )
+            )
+            return self._restore_solution(shape_pair, entry_list), 0
+        init_shape_pair = None
+        # the batch is warm started only if every pair has a stored solution
+        if all(match is not None for match in match_list):
+            init_shape_pair = self._build_init_shape_pair(
+                model, match_list, entry_list, shape_pair.source.points.device
+            )
+            if init_shape_pair is not None:
+                print("warm start {} from the stored {}".format(pair_name_list, match_list))
+        shape_pair, forward_t = timming(solver, return_t=True)(
+            shape_pair, init_shape_pair
+        )
+        self._save_solution(stage, shape_pair, settings_hash, source_hash, target_hash)
+        return shape_pair, forward_t
+
+    @staticmethod
+    def _stack_entries(entry_list, key, device):
+        return torch.stack(
+            [torch.from_numpy(entry[key]) for entry in entry_list]
+        ).to(device)
+
+    def _restore_solution(self, shape_pair, entry_list):
+        device = shape_pair.source.points.device
+        stack = lambda key: self._stack_entries(entry_list, key, device)
+        shape_pair.set_control_points(stack("control_points"), stack("control_weights"))
+        shape_pair.set_reg_param(stack("reg_param").requires_grad_())
+        if all("flowed_control_points" in entry for entry in entry_list):
+            shape_pair.set_flowed_control_points(stack("flowed_control_points"))
+        flowed = Shape()
+        flowed.set_data_with_refer_to(stack("flowed_points"), shape_pair.source)
+        shape_pair.set_flowed(flowed)
+        return shape_pair
+
+    def _build_init_shape_pair(self, model, match_list, entry_list, device):
+        """
+        :return: ShapePair with the stored reg_param and control points, the solutions of the inverse
+            pairs are inverted by the model, None if the stored solutions can not be batched
+        """
+        reg_param_list, control_points_list, control_weights_list = [], [], []
+        for match, entry in zip(match_list, entry_list):
+            to_tensor = lambda key: torch.from_numpy(entry[key])[None].to(device)
+            reg_param = to_tensor("reg_param")
+            control_points = to_tensor("control_points")
+            if match == "inverse":
+                if "flowed_control_points" not in entry:
+                    return None
+                reg_param, control_points = model.get_inverse_reg_param(
+                    reg_param, control_points, to_tensor("flowed_control_points")
+                )
+            reg_param_list.append(reg_param.detach())
+            control_points_list.append(control_points.detach())
+            control_weights_list.append(to_tensor("control_weights"))
+        if len({tuple(cp.shape) for cp in control_points_list}) > 1:
+            return None
+        if len({tuple(param.shape) for param in reg_param_list}) > 1:
+            return None
+        init_shape_pair = ShapePair()
+        init_shape_pair.set_control_points(
+            torch.cat(control_points_list), torch.cat(control_weights_list)
+        )
+        init_shape_pair.set_reg_param(torch.cat(reg_param_list))
+        return init_shape_pair
+
+    def _save_solution(self, stage, shape_pair, settings_hash, source_hash, target_hash):
+        to_numpy = (
+            lambda tensor, b: tensor[b].detach().cpu().numpy()
+            if tensor is not None
+            else None
+        )
+        for b, pair_name in enumerate(shape_pair.get_pair_name()):
+            # the arrays are snapshots, the write can run in the background
+            submit_write(
+                self.reg_result_store.save,
+                stage,
+                pair_name,
+                source_hash[b],
+                target_hash[b],
+                settings_hash,
+                reg_param=to_numpy(shape_pair.reg_param, b),
+                control_points=to_numpy(shape_pair.control_points, b),
+                control_weights=to_numpy(shape_pair.control_weights, b),
+                flowed_control_points=to_numpy(shape_pair.flowed_control_points, b),
+                flowed_points=to_numpy(shape_pair.flowed.points, b),
+            )
+
     def get_evaluation(self, input_data):
         """
         get
@@ -85,6 +85,20 @@ class PrealignOPT(nn.Module):
         self.identity_param = reg_param.clone().detach()
         shape_pair.set_reg_param(reg_param)
 
+    def get_inverse_reg_param(self, reg_param, control_points, flowed_control_points):
+        """
+        the inverse of the affine transform x -> xA+t is y -> (y-t)A^-1, defined on the flowed control points
+
+        :param reg_param: Bx(D+1)xD
+        :param control_points: BxNxD
+        :param flowed_control_points: BxNxD
+        :return: inverse reg_param, control points of the inverse
+        """
+        dim = reg_param.shape[-1]
+        inverse_transform = torch.inverse(reg_param[:, :dim])
+        inverse_translation = -torch.bmm(reg_param[:, dim:], inverse_transform)
+        return torch.cat([inverse_transform, inverse_translation], 1), flowed_control_points
+
     def set_loss_fn(self, loss_fn):
         self.sim_loss_fn = loss_fn
 
@@ -127,7 +141,9 @@ class PrealignOPT(nn.Module):
     def update_reg_param_from_low_scale_to_high_scale(
         self, shape_pair_low, shape_pair_high
     ):
-        shape_pair_high.set_reg_param(shape_pair_low.reg_param.detach())
+        shape_pair_high.set_reg_param(
+            shape_pair_low.reg_param.detach().clone().requires_grad_()
+        )
         return shape_pair_high
 
     def compute_regularization(self, prealign_params):
@@ -179,8 +195,8 @@ class PrealignOPT(nn.Module):
             print(
                 "{} th step, sim_loss is {}, reg_loss is {}, sim_factor is {}, reg_factor is {}".format(
                     self.local_iter.item(),
-                    sim_loss.item(),
-                    reg_loss.item(),
+                    sim_loss.mean().item(),
+                    reg_loss.mean().item(),
                     sim_factor,
                     reg_factor,
                 )
@@ -1,3 +1,4 @@
+from time import time
 import torch
 import torch.nn as nn
 from shapmagn.global_variable import Shape
@@ -109,9 +110,7 @@ class ProRegOPT(nn.Module):
         :param shape_pair:
         :return:
         """
-        start = torch.cuda.Event(enable_timing=True)
-        end = torch.cuda.Event(enable_timing=True)
-        start.record()
+        start = time()
         assert shape_pair.dense_mode == True
         shape_pair.set_control_points(
             shape_pair.source.points.clone(), shape_pair.source.weights
@@ -119,10 +118,8 @@ class ProRegOPT(nn.Module):
         flowed_points = self.probreg_module(
             shape_pair.source, shape_pair.target, return_tranform_param=False
         )
-        end.record()
-        torch.cuda.synchronize()
         print(
-            "{}, it takes {} ms".format(shape_pair.pair_name, start.elapsed_time(end))
+            "{}, it takes {} ms".format(shape_pair.pair_name, (time() - start) * 1000)
         )
 
         shape_pair.flowed_control_points = flowed_points.detach().clone()
@@ -98,6 +98,12 @@ class WasserBaryCenterOPT(nn.Module):
         shape_pair_high.set_reg_param(reg_param_high)
         return shape_pair_high
 
+    def get_inverse_reg_param(self, reg_param, control_points, flowed_control_points):
+        """
+        reg_param is the flowed control points, the inverse moves the flowed control points back
+        """
+        return control_points, reg_param
+
     def init_reg_param(self, shape_pair):
         reg_param = shape_pair.get_control_points().clone().detach()
         reg_param.requires_grad_()
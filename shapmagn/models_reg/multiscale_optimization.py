@@ -1,11 +1,19 @@
 import os
 from copy import deepcopy
+import torch
 from shapmagn.modules_reg.optimizer import optimizer_builder
 from shapmagn.modules_reg.scheduler import scheduler_builder
 from shapmagn.global_variable import SHAPE_SAMPLER_POOL
 from shapmagn.shape.shape_pair_utils import create_shape_pair
 from shapmagn.utils.shape_visual_utils import save_shape_pair_into_files
 from shapmagn.utils.obj_factory import obj_factory
+from shapmagn.utils.profiler import (
+    profile,
+    flush_profile,
+    enable_profiler,
+    disable_profiler,
+    profiler_enabled,
+)
 
 
 def build_multi_scale_solver(opt, model):
@@ -87,6 +95,21 @@ def build_multi_scale_solver(opt, model):
         )
         for i in range(num_scale)
     ]
+    profile_on = opt[
+        (
+            "profile",
+            False,
+            "record the per-stage timing, counters and peak memory into record_path/profile.jsonl",
+        )
+    ]
+    profile_tensorboard = opt[
+        (
+            "profile_tensorboard",
+            False,
+            "also log the profiling records into record_path/profile_logs with tensorboard",
+        )
+    ]
+    record_path = opt[("record_path", "", "record path")]
     print("Multi-scale solver initialized!")
     print(
         "The optimization works on the strategy '{}' with setting {}".format(
@@ -94,7 +117,22 @@ def build_multi_scale_solver(opt, model):
         )
     )
 
-    def solve(shape_pair):
+    def solve(shape_pair, init_shape_pair=None):
+        """
+        :param shape_pair: ShapePair
+        :param init_shape_pair: optional ShapePair with reg_param and control points, e.g. a stored solution,
+            the first scale is initialized from it the same way a scale is initialized from the previous one
+        :return: ShapePair
+        """
+        # a profiler enabled by the caller, e.g. the pipeline, is kept running
+        own_profiler = profile_on and not profiler_enabled()
+        if own_profiler:
+            enable_profiler(
+                os.path.join(record_path, "profile.jsonl"),
+                os.path.join(record_path, "profile_logs")
+                if profile_tensorboard
+                else None,
+            )
         source, target = shape_pair.source, shape_pair.target
         output_shape_pair = None
         model.clean()
@@ -104,30 +142,43 @@ def build_multi_scale_solver(opt, model):
                     i, shape_sampler_type, scale_args_list[i]
                 )
             )
-            if scale_args_list[i] > 0:
-                scale_source = scale_shape_sampler_list[i](source)
-                scale_target = scale_shape_sampler_list[i](target)
-                toinput_shape_pair = create_shape_pair(
-                    scale_source, scale_target, pair_name=shape_pair.get_pair_name()
-                )
-            else:
-                toinput_shape_pair = shape_pair
-            reg_param_initializer(toinput_shape_pair)
-            # save_shape_pair_into_files(opt["record_path"], "debugging".format(iter), toinput_shape_pair)
-            if i != 0:
-                toinput_shape_pair = param_updater(
-                    output_shape_pair, toinput_shape_pair
-                )
-                del output_shape_pair
+            with profile("scale_{}".format(i)):
+                if scale_args_list[i] > 0:
+                    with profile("sampling"):
+                        scale_source = scale_shape_sampler_list[i](source)
+                        scale_target = scale_shape_sampler_list[i](target)
+                    toinput_shape_pair = create_shape_pair(
+                        scale_source, scale_target, pair_name=shape_pair.get_pair_name()
+                    )
+                else:
+                    toinput_shape_pair = shape_pair
+                reg_param_initializer(toinput_shape_pair)
+                # save_shape_pair_into_files(opt["record_path"], "debugging".format(iter), toinput_shape_pair)
+                if i != 0:
+                    toinput_shape_pair = param_updater(
+                        output_shape_pair, toinput_shape_pair
+                    )
+                    del output_shape_pair
+                elif init_shape_pair is not None:
+                    toinput_shape_pair = param_updater(
+                        init_shape_pair, toinput_shape_pair
+                    )
+            flush_profile(scale=scale_args_list[i], stage="setup")
             output_shape_pair = single_scale_solver_list[i](toinput_shape_pair)
         if scale_args_list[-1] != -1:
-            output_shape_pair = param_updater(
-                output_shape_pair,
-                create_shape_pair(
-                    source, target, pair_name=output_shape_pair.get_pair_name()
-                ),
-            )
-            output_shape_pair = update_shape_pair_after_upsampling(output_shape_pair)
+            with profile("upsampling"):
+                output_shape_pair = param_updater(
+                    output_shape_pair,
+                    create_shape_pair(
+                        source, target, pair_name=output_shape_pair.get_pair_name()
+                    ),
+                )
+                output_shape_pair = update_shape_pair_after_upsampling(
+                    output_shape_pair
+                )
+            flush_profile(scale=-1, stage="upsampling")
+        if own_profiler:
+            disable_profiler()
         return output_shape_pair
 
     return solve
@@ -181,43 +232,87 @@ def build_single_scale_general_solver(
     opt_optim["lr"] = lr
     opt_scheduler = opt[("scheduler", {}, "setting for the scheduler")]
     """settings for the scheduler"""
+    per_pair_convergence = opt[
+        (
+            "per_pair_convergence",
+            True,
+            "when several pairs are optimized in one batch, each pair stops (its reg_param is frozen) once it converges,"
+            " the optimization exits when all pairs converge; if False, the batch is stopped as a whole on the summed energy",
+        )
+    ]
 
     def solve(shape_pair):
-        model.init_reg_param(shape_pair)
+        # the reg_param set by the multi-scale solver (from the previous scale or a warm start) is kept
+        if shape_pair.reg_param is None:
+            model.init_reg_param(shape_pair)
+        elif not (shape_pair.reg_param.is_leaf and shape_pair.reg_param.requires_grad):
+            shape_pair.set_reg_param(
+                shape_pair.reg_param.detach().clone().requires_grad_()
+            )
         ######################################3
         shape_pair.reg_param.register_hook(grad_hook)
         ############################################3
         optimizer = optimizer_builder(opt_optim)([shape_pair.reg_param])
         lr_scheduler = scheduler_builder(opt_scheduler)(optimizer)
         """initialize the optimizer and scheduler"""
-        last_energy = 0.0
-        patient_count = 0
-        previous_converged_iter = 0.0
+        nbatch = shape_pair.reg_param.shape[0]
+        device = shape_pair.reg_param.device
+        if per_pair_convergence:
+            last_energy = torch.zeros(nbatch, device=device)
+            patient_count = torch.zeros(nbatch, dtype=torch.long, device=device)
+            previous_converged_iter = torch.zeros(
+                nbatch, dtype=torch.long, device=device
+            )
+        else:
+            last_energy = 0.0
+            patient_count = 0
+            previous_converged_iter = 0.0
+        active = torch.ones(nbatch, dtype=torch.bool, device=device)
+        frozen_reg_param = shape_pair.reg_param.detach().clone()
+        pair_energy_buffer = {}
 
         def closure():
             optimizer.zero_grad()
-            cur_energy = model(shape_pair)
-            cur_energy.backward()
+            with profile("forward"):
+                pair_energy = model(shape_pair).view(-1)
+            # the energy of the first evaluation in a step, the one returned by optimizer.step
+            pair_energy_buffer.setdefault("energy", pair_energy.detach())
+            cur_energy = (pair_energy * active.to(pair_energy.dtype)).sum()
+            with profile("backward"):
+                cur_energy.backward()
             return cur_energy
 
         for iter in range(num_iter):
-            cur_energy = optimizer.step(closure)
+            pair_energy_buffer.clear()
+            # for the closure based optimizers, e.g. lbfgs, the step includes the forward/backward evaluations
+            with profile("optimizer_step"):
+                cur_energy = optimizer.step(closure)
             lr_scheduler.step(iter)
-            cur_energy = cur_energy.item()
-            rel_f = abs(last_energy - cur_energy) / (abs(cur_energy))
-            last_energy = cur_energy
+            if not active.all():
+                # the optimizer (e.g. momentum, lbfgs history) may still move the converged pairs
+                with torch.no_grad():
+                    shape_pair.reg_param[~active] = frozen_reg_param[~active]
+            pair_energy = pair_energy_buffer["energy"].expand(nbatch)
+            if per_pair_convergence:
+                rel_f = (last_energy - pair_energy).abs() / pair_energy.abs()
+                last_energy = pair_energy
+            else:
+                cur_energy = cur_energy.item()
+                rel_f = abs(last_energy - cur_energy) / (abs(cur_energy))
+                last_energy = cur_energy
             if (
                 save_res
                 and shape_pair.dimension == 3
                 and save_3d_shape_every_n_iter > 0
                 and iter % save_3d_shape_every_n_iter == 0
             ):
-                save_shape_pair_into_files(
-                    shape_folder_3d,
-                    "iter_{}".format(iter),
-                    shape_pair.get_pair_name(),
-                    shape_pair,
-                )
+                with profile("save"):
+                    save_shape_pair_into_files(
+                        shape_folder_3d,
+                        "iter_{}".format(iter),
+                        shape_pair.get_pair_name(),
+                        shape_pair,
+                    )
             if (
                 save_res
                 and save_2d_capture_every_n_iter > 0
@@ -229,15 +324,50 @@ def build_single_scale_general_solver(
                     shape_pair.get_pair_name(),
                     shape_pair,
                 )
-            if rel_f < rel_ftol:
-                print("the converge rate: {} is too small".format(rel_f))
-                patient_count = (
-                    patient_count + 1 if (iter - previous_converged_iter) == 1 else 0
+            flush_profile(scale=scale, iter=iter, energy=pair_energy)
+            if not per_pair_convergence:
+                # the batch is stopped as a whole on the summed energy
+                if rel_f < rel_ftol:
+                    print("the converge rate: {} is too small".format(rel_f))
+                    patient_count = (
+                        patient_count + 1
+                        if (iter - previous_converged_iter) == 1
+                        else 0
+                    )
+                    previous_converged_iter = iter
+                    if patient_count > patient:
+                        print(
+                            "Reached relative function tolerance of = " + str(rel_ftol)
+                        )
+                        break
+                continue
+            small_rel_f = (rel_f < rel_ftol) & active
+            if small_rel_f.any():
+                print(
+                    "the converge rate: {} is too small".format(
+                        rel_f[small_rel_f].tolist()
+                    )
                 )
-                previous_converged_iter = iter
-                if patient_count > patient:
-                    print("Reached relative function tolerance of = " + str(rel_ftol))
-                    break
+                patient_count[small_rel_f] = torch.where(
+                    (iter - previous_converged_iter[small_rel_f]) == 1,
+                    patient_count[small_rel_f] + 1,
+                    torch.zeros_like(patient_count[small_rel_f]),
+                )
+                previous_converged_iter[small_rel_f] = iter
+                converged = small_rel_f & (patient_count > patient)
+                if converged.any():
+                    print(
+                        "Reached relative function tolerance of = {} for {} pair(s)".format(
+                            rel_ftol, int(converged.sum().item())
+                        )
+                    )
+                    frozen_reg_param[converged] = shape_pair.reg_param.detach()[
+                        converged
+                    ]
+                    active = active & ~converged
+                    if not active.any():
+                        print("all pairs converged at iter {}".format(iter))
+                        break
         if save_res:
             save_shape_pair_into_files(
                 record_path, "iter_last", shape_pair.get_pair_name(), shape_pair
@@ -293,13 +423,15 @@ def build_single_scale_model_embedded_solver(
     os.makedirs(shape_folder_2d, exist_ok=True)
 
     def solve(shape_pair):
-        model.init_reg_param(shape_pair)
+        if shape_pair.reg_param is None:
+            model.init_reg_param(shape_pair)
         last_energy = 0.0
         patient_count = 0
         previous_converged_iter = 0.0
         for iter in range(num_iter):
-            cur_energy = model(shape_pair)
-            cur_energy = cur_energy.item()
+            with profile("forward"):
+                cur_energy = model(shape_pair)
+            cur_energy = cur_energy.sum().item()
             rel_f = abs(last_energy - cur_energy) / (abs(cur_energy))
             last_energy = cur_energy
             if (
@@ -307,12 +439,13 @@ def build_single_scale_model_embedded_solver(
                 and save_3d_shape_every_n_iter > 0
                 and iter % save_3d_shape_every_n_iter == 0
             ):
-                save_shape_pair_into_files(
-                    shape_folder_3d,
-                    "iter_{}".format(iter),
-                    shape_pair.get_pair_name(),
-                    shape_pair,
-                )
+                with profile("save"):
+                    save_shape_pair_into_files(
+                        shape_folder_3d,
+                        "iter_{}".format(iter),
+                        shape_pair.get_pair_name(),
+                        shape_pair,
+                    )
             if (
                 save_res
                 and save_2d_capture_every_n_iter > 0
@@ -324,6 +457,7 @@ def build_single_scale_model_embedded_solver(
                     shape_pair.get_pair_name(),
                     shape_pair,
                 )
+            flush_profile(scale=scale, iter=iter, energy=cur_energy)
             if rel_f < rel_ftol:
                 print("the converge rate: {} is too small".format(rel_f))
                 patient_count = (
@@ -26,13 +26,69 @@ from shapmagn.modules_reg.networks.flownet3d import FlowNet3D, FlowNet3DIMP
 from shapmagn.modules_reg.networks.pointpwcnet2_2 import PointConvSceneFlowPWC2_2
 from shapmagn.modules_reg.networks.pointpwcnet2_4 import PointConvSceneFlowPWC2_4
 from shapmagn.modules_reg.networks.pointpwcnet2_6 import PointConvSceneFlowPWC2_6
+from shapmagn.modules_reg.networks import pointconv_util, pointconv_util_org
 from shapmagn.metrics.reg_losses import CurvatureReg
+from shapmagn.utils.net_utils import (
+    enable_activation_checkpointing,
+    enable_block_autocast,
+)
 
 PWC_POOL = {
     "disp": PointConvSceneFlowPWC2_2,
     "reg_param": PointConvSceneFlowPWC2_4,
     "adaptive": PointConvSceneFlowPWC2_6,
 }
+# the pyramid level layers, their grouped features (BxNxKxC) dominate the training memory
+PWC_CHECKPOINT_BLOCKS = [
+    "PointConvD",
+    "PointConvFlow",
+    "SceneFlowEstimatorPointConv",
+    "SceneFlowEstimatorPointConv2",
+    "SceneFlowEstimatorPointConv3",
+]
+# the MLP and WeightNet blocks of the pointconv layers, matched by class: the flow regression heads
+# (the plain nn.Conv1d of SceneFlowEstimatorPointConv*) are left out, the predicted coordinates stay in float32
+PWC_AUTOCAST_BLOCKS = [
+    pointconv_util.Conv1d,
+    pointconv_util.WeightNet,
+    pointconv_util_org.Conv1d,
+    pointconv_util_org.WeightNet,
+]
+FLOT_CHECKPOINT_BLOCKS = ["SetConv"]
+FLOT_AUTOCAST_BLOCKS = ["SetConv"]
+
+
+def init_memory_saving(opt, net, checkpoint_blocks, autocast_blocks):
+    """
+    opt-in memory saving of the deep flow networks: activation checkpointing of the pyramid levels
+    and autocast of the MLP/WeightNet blocks
+
+    :param opt: ParameterDict, settings of the network
+    :param net: nn.Module
+    :param checkpoint_blocks: list of classes or class names of the checkpointed blocks
+    :param autocast_blocks: list of classes or class names of the autocast blocks
+    :return: None
+    """
+    activation_checkpointing = opt[
+        (
+            "activation_checkpointing",
+            False,
+            "recompute the activations of each pyramid level in the backward, trade compute for memory",
+        )
+    ]
+    autocast_dtype = opt[
+        (
+            "autocast_dtype",
+            "",
+            "'bfloat16'/'float16', run the MLP/WeightNet blocks under autocast, the coordinates and the neighbor indices stay in float32, '' to disable",
+        )
+    ]
+    if activation_checkpointing:
+        num_blocks = enable_activation_checkpointing(net, checkpoint_blocks)
+        print("activation checkpointing is enabled on {} blocks".format(num_blocks))
+    if autocast_dtype:
+        num_blocks = enable_block_autocast(net, autocast_blocks, autocast_dtype)
+        print("{} autocast is enabled on {} blocks".format(autocast_dtype, num_blocks))
 
 
 class DeepFlowNetRegParam(nn.Module):
@@ -252,6 +308,9 @@ class PointConvSceneFlowPWCRegParam(nn.Module):
         if self.load_pretrained_model:
             checkpoint = torch.load(self.pretrained_model_path, map_location="cpu")
             self.flow_predictor.load_state_dict(checkpoint, strict=False)
+        init_memory_saving(
+            self.opt, self.flow_predictor, PWC_CHECKPOINT_BLOCKS, PWC_AUTOCAST_BLOCKS
+        )
 
     def deep_flow(self, cur_source, target):
         pc1, pc2, feature1, feature2 = (
@@ -336,6 +395,9 @@ class FLOTRegParam(nn.Module):
                     self.pretrained_model_path
                 )
             )
+        init_memory_saving(
+            self.opt, self.flow_predictor, FLOT_CHECKPOINT_BLOCKS, FLOT_AUTOCAST_BLOCKS
+        )
 
     def deep_flow(self, cur_source, target):
         pc1, pc2 = cur_source.points, target.points
@@ -133,7 +133,28 @@ class GradFlowPreAlign(nn.Module):
             (
                 "search_init_transform",
                 False,
-                " the 16(2D)/64(3D) initial transforms (based on position and ot similarity) would be searched and return the best one ",
+                " the 8(2D)/24(3D) initial rotations (based on moment and ot similarity) would be searched and return the best one ",
+            )
+        ]
+        self.init_search_moment_topk = self.opt[
+            (
+                "init_search_moment_topk",
+                8,
+                "the initial transforms are first ranked by a moment (covariance + skewness) score, the top k are kept",
+            )
+        ]
+        self.init_search_proxy_num_sample = self.opt[
+            (
+                "init_search_proxy_num_sample",
+                1000,
+                "the kept initial transforms are evaluated by the ot distance on # subsampled points, set -1 to use all the points",
+            )
+        ]
+        self.init_search_topk = self.opt[
+            (
+                "init_search_topk",
+                2,
+                "the top k initial transforms on the subsampled points are evaluated at full resolution",
             )
         ]
         self.geomloss_setting = self.opt[("geomloss", {}, "settings for geomloss")]
@@ -157,10 +178,121 @@ class GradFlowPreAlign(nn.Module):
         else:
             return self.pair_feature_extractor(flowed, target, iter)
 
-    def find_initial_transform(self, source, target):
+    def _init_rotation_candidates(self, D, device):
+        """
+        the rotations combined from 0/90/180/270 degrees around each axis,
+        the 64 euler angle combinations only give 24 distinct matrices in 3D,
+        in 2D the 4 rotations of 0/90/180/270 degrees are used
+        :return: KxDxD
+        """
         import numpy as np
         from scipy.spatial.transform import Rotation as R
 
+        if D == 2:
+            angle = np.deg2rad(np.arange(0, 271, 90))
+            cos, sin = np.cos(angle), np.sin(angle)
+            rotation = np.stack([np.stack([cos, -sin], -1), np.stack([sin, cos], -1)], 1)
+            return torch.tensor(np.round(rotation).astype(np.float32), device=device)
+        angle_comp = (
+            np.mgrid[0:271:90, 0:271:90, 0:271:90].transpose(1, 2, 3, 0).reshape(-1, 3)
+        )
+        rotation = R.from_euler("zyx", angle_comp, degrees=True).as_matrix()
+        rotation = np.unique(np.round(rotation).astype(np.float32), axis=0)
+        return torch.tensor(rotation, device=device)
+
+    def _proxy_points(self, points, weights, num_sample):
+        """
+        random subset of the points, the weights are rescaled to keep the total mass
+        :param points: BxNxD
+        :param weights: BxNx1
+        :return: BxnxD, Bxnx1
+        """
+        N = points.shape[1]
+        if num_sample <= 0 or N <= num_sample:
+            return points, weights
+        index = torch.randperm(N, generator=torch.Generator().manual_seed(0))
+        index = index[:num_sample].to(points.device)
+        sub_weights = weights[:, index]
+        sub_weights = sub_weights * (
+            weights.sum(1, keepdim=True) / sub_weights.sum(1, keepdim=True).clamp(min=1e-12)
+        )
+        return points[:, index], sub_weights
+
+    def _moment_score(self, x, wx, y, wy, transform):
+        """
+        cheap score of the candidate transforms, compare the center, the covariance and the per-axis skewness
+        of the transformed source with those of the target, the skewness tells apart the flips that share the covariance
+
+        :param x: BxnxD
+        :param wx: Bxnx1
+        :param y: BxmxD
+        :param wy: Bxmx1
+        :param transform: BxKx(D+1)xD
+        :return: BxK
+        """
+
+        def get_moments(points, weights):
+            weights = weights / weights.sum(1, keepdim=True)
+            center = (points * weights).sum(1, keepdim=True)
+            centered = points - center
+            cov = centered.transpose(2, 1) @ (centered * weights)
+            return center, centered, cov, weights
+
+        D = x.shape[-1]
+        center_x, centered_x, cov_x, wx = get_moments(x, wx)
+        center_y, centered_y, cov_y, wy = get_moments(y, wy)
+        M, t = transform[:, :, :D], transform[:, :, D:]  # BxKxDxD, BxKx1xD
+        center = center_x[:, None] @ M + t
+        cov = M.transpose(-1, -2) @ cov_x[:, None] @ M
+        var = torch.diagonal(cov, dim1=-2, dim2=-1).clamp(min=1e-12)
+        var_y = torch.diagonal(cov_y, dim1=-2, dim2=-1).clamp(min=1e-12)
+        skew = (wx[:, None] * (centered_x[:, None] @ M) ** 3).sum(2) / var ** 1.5
+        skew_y = (wy * centered_y ** 3).sum(1) / var_y ** 1.5
+        cov_score = (cov - cov_y[:, None]).norm(dim=(-2, -1)) / cov_y.norm(
+            dim=(-2, -1)
+        )[:, None]
+        center_score = (center - center_y[:, None]).norm(dim=(-2, -1)) / var_y.sum(
+            -1, keepdim=True
+        ).sqrt()
+        skew_score = (skew - skew_y[:, None]).abs().mean(-1)
+        return cov_score + center_score + skew_score
+
+    def _ot_score(self, x, wx, y, wy, transform, geo_dist):
+        """
+        :param x: BxnxD
+        :param wx: Bxnx1
+        :param y: BxmxD
+        :param wy: Bxmx1
+        :param transform: BxKx(D+1)xD
+        :param geo_dist: geomloss object
+        :return: BxK
+        """
+        B, K, D = transform.shape[0], transform.shape[1], x.shape[-1]
+        X = torch.cat((x, torch.ones_like(x[:, :, :1])), dim=2)
+        transformed = (X[:, None] @ transform).view(B * K, -1, D)
+        expand = lambda t: t[:, None].expand(-1, K, -1, -1).reshape(B * K, *t.shape[1:])
+        dist = geo_dist(
+            expand(wx)[..., 0], transformed, expand(wy)[..., 0], expand(y)
+        )
+        return dist.view(B, K)
+
+    def _select_topk(self, score, transform, k):
+        index = score.topk(min(k, score.shape[1]), dim=1, largest=False)[1]
+        return transform.gather(
+            1, index[..., None, None].expand(-1, -1, *transform.shape[2:])
+        )
+
+    def find_initial_transform(self, source, target):
+        """
+        coarse to fine multi-start search over the candidate rotations, vectorized over the batch:
+        1. rank all the candidates by a moment score on the subsampled points, keep the top init_search_moment_topk
+        2. rank the kept ones by the ot distance on the subsampled points, keep the top init_search_topk
+        3. pick the best by the ot distance at full resolution
+
+        :param source: Shape with points BxNxD
+        :param target: Shape with points BxMxD
+        :return: Bx(D+1)xD transform matrix, transformed source
+        """
         source_center = source.points.mean(dim=1, keepdim=True)
         target_center = target.points.mean(dim=1, keepdim=True)
         max_diameter = lambda x: (x.points.max(1)[0] - x.points.min(1)[0]).max(1)[0]
@@ -169,60 +301,42 @@ class GradFlowPreAlign(nn.Module):
             target_center - source_center
         ) / 10  # avoid fail into the identity local minimum
         D = source.points.shape[-1]
-        n_init = 16 if D == 2 else 64
-        r = None
-        if D == 2:
-            angle_comp = np.mgrid[0:271:90, 0:271:90].transpose(1, 2, 0).reshape(-1, D)
-            r = R.from_euler("yx", angle_comp, degrees=True)
-        elif D == 3:
-            angle_comp = (
-                np.mgrid[0:271:90, 0:271:90, 0:271:90]
-                .transpose(1, 2, 3, 0)
-                .reshape(-1, D)
-            )
-            r = R.from_euler("zyx", angle_comp, degrees=True)
-        init_rotation_matrix = torch.tensor(r.as_matrix().astype(np.float32)).to(
-            source.points.device
+        init_rotation_matrix = self._init_rotation_candidates(D, source.points.device)
+        K = init_rotation_matrix.shape[0]
+        transform = torch.cat(
+            [
+                init_rotation_matrix[None] * scale[:, None, None, None],
+                bias_center[:, None].expand(-1, K, -1, -1),
+            ],
+            2,
+        )  # BxKx(D+1)xD
+        geo_dist = obj_factory(self.geomloss_setting["geom_obj"])
+        proxy_source = self._proxy_points(
+            source.points, source.weights, self.init_search_proxy_num_sample
         )
-        init_best_transformed = []
-        init_best_transform = []
-        for i, (
-            b_source_points,
-            b_target_points,
-            b_source_weights,
-            b_target_weights,
-        ) in enumerate(
-            zip(source.points, target.points, source.weights, target.weights)
-        ):
-            b_source_points = b_source_points.repeat(n_init, 1, 1)
-            b_target_points = b_target_points.repeat(n_init, 1, 1)
-            b_source_weights = b_source_weights.repeat(n_init, 1, 1)
-            b_target_weights = b_target_weights.repeat(n_init, 1, 1)
-            b_init_rotation_bias = bias_center[i].repeat(n_init, 1, 1)
-            b_transform = torch.cat(
-                [init_rotation_matrix * scale[i], b_init_rotation_bias], 1
-            )
-            geo_dist = obj_factory(self.geomloss_setting["geom_obj"])
-            b_init_transformed = (
-                torch.cat(
-                    (b_source_points, torch.ones_like(b_source_points[:, :, :1])), dim=2
-                )
-                @ b_transform
-            )
-            bdist = geo_dist(
-                b_source_weights[..., 0],
-                b_init_transformed,
-                b_target_weights[..., 0],
-                b_target_points,
-            )
-            min_val, min_index = bdist.min(0)
-            b_init_best_transformed = b_init_transformed[min_index]
-            b_init_best_transform = b_transform[min_index]
-            print("the best init transform is {}".format(b_init_best_transform))
-            init_best_transformed.append(b_init_best_transformed)
-            init_best_transform.append(b_init_best_transform)
-        return torch.stack(init_best_transform, 0), Shape().set_data_with_refer_to(
-            torch.stack(init_best_transformed, 0), source
+        proxy_target = self._proxy_points(
+            target.points, target.weights, self.init_search_proxy_num_sample
+        )
+        score = self._moment_score(*proxy_source, *proxy_target, transform)
+        transform = self._select_topk(score, transform, self.init_search_moment_topk)
+        score = self._ot_score(*proxy_source, *proxy_target, transform, geo_dist)
+        transform = self._select_topk(score, transform, self.init_search_topk)
+        score = self._ot_score(
+            source.points,
+            source.weights,
+            target.points,
+            target.weights,
+            transform,
+            geo_dist,
+        )
+        init_best_transform = self._select_topk(score, transform, 1)[:, 0]
+        print("the best init transform is {}".format(init_best_transform))
+        init_best_transformed = (
+            torch.cat((source.points, torch.ones_like(source.points[:, :, :1])), dim=2)
+            @ init_best_transform
+        )
+        return init_best_transform, Shape().set_data_with_refer_to(
+            init_best_transformed, source
         )
 
     def sampling_input(self, toflow, target):
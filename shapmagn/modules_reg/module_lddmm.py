@@ -20,6 +20,7 @@ class LDDMMHamilton(nn.Module):
         ]
         self.kernel = obj_factory(kernel)
         self.mode = "shooting"
+        self.nfe = 0
 
     def hamiltonian(self, mom, control_points):
         # todo check, the omitted 1/2 is consistant with variational version
@@ -38,9 +39,12 @@ class LDDMMHamilton(nn.Module):
         torch.set_grad_enabled(record_is_grad_enabled)
         return -grad_control, grad_mom
 
+    def velocity(self, mom, control_points, flow_points):
+        return self.kernel(flow_points, control_points, mom)
+
     def flow(self, mom, control_points, flow_points):
         return self.hamiltonian_evolve(mom, control_points) + (
-            self.kernel(flow_points, control_points, mom),
+            self.velocity(mom, control_points, flow_points),
         )
 
     def set_mode(self, mode):
@@ -48,6 +52,7 @@ class LDDMMHamilton(nn.Module):
         self.mode = mode
 
     def forward(self, t, input):
+        self.nfe += 1
         if self.mode == "shooting":
             return self.hamiltonian_evolve(*input)
         else:
@@ -72,6 +77,7 @@ class LDDMMVariational(nn.Module):
         grad_kernel = kernel.replace("gauss", "gauss_grad")
         self.grad_kernel = obj_factory(grad_kernel)
         self.mode = "shooting"
+        self.nfe = 0
 
     def variational_evolve(self, mom, control_points):
         mom = mom.clamp(-1, 1)
@@ -79,10 +85,14 @@ class LDDMMVariational(nn.Module):
             control_points, control_points, mom
         )
 
+    def velocity(self, mom, control_points, flow_points):
+        mom = mom.clamp(-1, 1)
+        return self.kernel(flow_points, control_points, mom)
+
     def variational_flow(self, mom, control_points, flow_points):
         mom = mom.clamp(-1, 1)
         return self.variational_evolve(mom, control_points) + (
-            self.kernel(flow_points, control_points, mom),
+            self.velocity(mom, control_points, flow_points),
         )
 
     def set_mode(self, mode):
@@ -90,7 +100,82 @@ class LDDMMVariational(nn.Module):
         self.mode = mode
 
     def forward(self, t, input):
+        self.nfe += 1
         if self.mode == "shooting":
             return self.variational_evolve(*input)
         else:
             return self.variational_flow(*input)
+
+
+###################  flow along a recorded shooting trajectory ######################
+
+
+class LDDMMTrajectory(object):
+    """
+    the shooting trajectory (momentum and control points) recorded at uniform times,
+    the points are then flowed with the velocity field of the recorded control points,
+    so the Hamiltonian/variational system is not integrated again
+    """
+
+    def __init__(self, times, momentum_list, control_points_list):
+        """
+        :param times: torch.tensor, T, uniform times of the records
+        :param momentum_list: torch.tensor, TxBxNxD
+        :param control_points_list: torch.tensor, TxBxNxD
+        """
+        self.times = times
+        self.momentum_list = momentum_list
+        self.control_points_list = control_points_list
+
+    def is_valid_for(self, momentum, control_points):
+        """
+        the trajectory is only valid for the initial momentum and control points it has been shot from
+        """
+        return (
+            momentum.shape == self.momentum_list[0].shape
+            and control_points.shape == self.control_points_list[0].shape
+            and torch.equal(momentum.detach(), self.momentum_list[0])
+            and torch.equal(control_points.detach(), self.control_points_list[0])
+        )
+
+    def flowed_control_points(self):
+        return self.control_points_list[-1]
+
+    def flow(self, velocity_fn, flow_points, t_list=None):
+        """
+        integrate the flow points with Heun steps on the recorded times,
+        a time between two records is reached with a partial step on linearly interpolated records
+
+        :param velocity_fn: velocity_fn(momentum, control_points, flow_points) -> velocity at the flow points
+        :param flow_points: BxMxD
+        :param t_list: list of float, the times to output, the end time by default
+        :return: list of BxMxD, flowed points at each time of t_list
+        """
+        times = self.times.tolist()
+        t_list = [times[-1]] if t_list is None else t_list
+        t_list_sorted = sorted(range(len(t_list)), key=lambda i: t_list[i])
+        flowed_list = [None] * len(t_list)
+        points, k = flow_points, 0
+
+        def state(t):
+            i = min(max(sum(tk <= t for tk in times) - 1, 0), len(times) - 2)
+            w = (t - times[i]) / (times[i + 1] - times[i])
+            return (
+                self.momentum_list[i] * (1 - w) + self.momentum_list[i + 1] * w,
+                self.control_points_list[i] * (1 - w) + self.control_points_list[i + 1] * w,
+            )
+
+        def heun_step(points, t_from, t_to):
+            dt = t_to - t_from
+            v_from = velocity_fn(*state(t_from), points)
+            v_to = velocity_fn(*state(t_to), points + dt * v_from)
+            return points + 0.5 * dt * (v_from + v_to)
+
+        t_cur = times[0]
+        for i in t_list_sorted:
+            t = t_list[i]
+            while k + 1 < len(times) and times[k + 1] <= t:
+                points = heun_step(points, t_cur, times[k + 1])
+                t_cur, k = times[k + 1], k + 1
+            flowed_list[i] = heun_step(points, t_cur, t) if t > t_cur else points
+        return flowed_list
@@ -12,6 +12,8 @@ NonRigid Affine, MCT 	        TPS 	                  - 	        Deformable Kinem
 
 """
 
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import numpy as np
 import torch
 from functools import partial
@@ -39,6 +41,44 @@ METHOD_POOL = [
     "BCPD_nonrigid",
 ]
 
+# the probreg transformations that can be applied to any points, the others are defined on the solved points
+LINEAR_TRANSFORMATIONS = ["RigidTransformation", "AffineTransformation"]
+
+# the solve function of the forked workers, it is inherited through fork instead of being pickled,
+# since the probreg/open3d solvers are closures/partials that can't always be pickled
+_WORKER_STATE = {}
+
+
+def _solve_in_worker(source, target):
+    return _WORKER_STATE["solve_fn"](source, target)
+
+
+def upsample_displacement(points, sampled_points, sampled_displacement, knn=4, chunk_size=4096):
+    """
+    interpolate the displacement solved on the subsampled points back to all the points,
+    with the inverse distance weighting of the k nearest subsampled points
+
+    :param points: NxD array
+    :param sampled_points: nxD array
+    :param sampled_displacement: nxD array
+    :param knn: int
+    :param chunk_size: int, number of points processed at once
+    :return: NxD array, the displaced points
+    """
+    knn = min(knn, len(sampled_points))
+    displaced = np.empty_like(points)
+    sampled_sq = (sampled_points ** 2).sum(-1)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start : start + chunk_size]
+        dist = (chunk ** 2).sum(-1)[:, None] - 2 * chunk @ sampled_points.T + sampled_sq[None]
+        index = np.argpartition(dist, knn - 1, axis=1)[:, :knn]
+        weights = 1.0 / (np.take_along_axis(dist, index, 1).clip(min=0) + 1e-8)
+        weights = weights / weights.sum(1, keepdims=True)
+        displaced[start : start + chunk_size] = chunk + (
+            weights[..., None] * sampled_displacement[index]
+        ).sum(1)
+    return displaced
+
 
 class ProbReg(object):
     """
@@ -63,6 +103,27 @@ class ProbReg(object):
         self.solver = getattr(self, "_init_{}".format(self.method_name))(
             opt[(self.method_name, {}, "settings for {}".format(self.method_name))]
         )
+        self.num_workers = opt[
+            ("num_workers", 1, "number of pairs in the batch that are solved concurrently")
+        ]
+        self.parallel_backend = opt[
+            (
+                "parallel_backend",
+                "thread",
+                "'thread' or 'process'(forked workers), the cupy based solvers always use threads",
+            )
+        ]
+        self.solve_num_sample = opt[
+            (
+                "solve_num_sample",
+                -1,
+                "solve on # randomly subsampled points, a rigid/affine solution is then applied to all the points,"
+                "a nonrigid displacement is interpolated back to all the points, set -1 to disable",
+            )
+        ]
+        self.upsample_knn = opt[
+            ("upsample_knn", 4, "number of neighbors used to interpolate the displacement back")
+        ]
 
     def set_mode(self, mode):
         if mode == "prealign":
@@ -287,29 +348,96 @@ class ProbReg(object):
         """
         :param source: Shape with points BxNxD
         :param target_batch: Shape with points BxMxD
-        :return: Bx(D+1)xD transform matrix
+        :return: Bx(D+1)xD transform matrix or BxNxD transformed points
         """
+        if return_tranform_param and not self.prealign:
+            raise NotImplementedError(
+                "only the transform of the prealign mode can be returned"
+            )
         source_batch, target_batch = source.points, target.points
         device = source_batch.device
-        source_list, target_list = self._get_input(source_batch, target_batch)
-        solution_list = []
-        for source, target in zip(source_list, target_list):
-            solution = self.solver(source, target)
-            solution_list.append(solution)
-        if return_tranform_param:
-            return self._convert_transform_format(solution_list, device)
+        B, N, D = source_batch.shape
+        source_list = list(source_batch.detach().cpu().numpy())
+        target_list = list(target_batch.detach().cpu().numpy())
+        output = torch.empty(
+            (B, D + 1, D) if return_tranform_param else (B, N, D), dtype=torch.float32
+        )
+        solve_fn = partial(self._solve_pair, return_tranform_param=return_tranform_param)
+        for i, res in self._dispatch(solve_fn, source_list, target_list):
+            output[i] = torch.from_numpy(res)
+        return output.to(device)
+
+    def _dispatch(self, solve_fn, source_list, target_list):
+        """
+        run the per-pair solver, the (index, result) are yielded in the completion order
+        """
+        num_workers = min(self.num_workers, len(source_list))
+        if num_workers <= 1:
+            for i, (source, target) in enumerate(zip(source_list, target_list)):
+                yield i, solve_fn(source, target)
+            return
+        if self.parallel_backend == "process" and self.cp is np:
+            _WORKER_STATE["solve_fn"] = solve_fn
+            executor = ProcessPoolExecutor(
+                num_workers, mp_context=multiprocessing.get_context("fork")
+            )
+            submit = lambda source, target: executor.submit(
+                _solve_in_worker, source, target
+            )
         else:
-            return self._get_transformed_res(solution_list, source_list, device)
+            executor = ThreadPoolExecutor(num_workers)
+            submit = lambda source, target: executor.submit(solve_fn, source, target)
+        with executor:
+            futures = {
+                submit(source, target): i
+                for i, (source, target) in enumerate(zip(source_list, target_list))
+            }
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+    def _subsample(self, points):
+        if self.solve_num_sample <= 0 or len(points) <= self.solve_num_sample:
+            return points
+        index = np.random.RandomState(0).choice(
+            len(points), self.solve_num_sample, replace=False
+        )
+        return points[index]
 
-    def _get_input(self, source_batch, target_batch):
-        device_warpper = lambda x: self.cp.asarray(x)
-        source_list = [
-            device_warpper(source) for source in source_batch.detach().cpu().numpy()
-        ]
-        target_list = [
-            device_warpper(target) for target in target_batch.detach().cpu().numpy()
-        ]
-        return source_list, target_list
+    def _solve_pair(self, source, target, return_tranform_param=True):
+        """
+        solve a single pair, optionally on the subsampled points
+
+        :param source: NxD array
+        :param target: MxD array
+        :return: (D+1)xD transform matrix or NxD transformed points
+        """
+        sampled_source, sampled_target = self._subsample(source), self._subsample(target)
+        solution = self.solver(
+            self.cp.asarray(sampled_source), self.cp.asarray(sampled_target)
+        )
+        if return_tranform_param:
+            return np.concatenate(
+                [self._get_transform_matrix(solution), self._get_translation(solution)], 0
+            )
+        if len(sampled_source) == len(source) or self._is_linear(solution):
+            return self._get_transformed_points(solution, source)
+        transformed = self._get_transformed_points(solution, sampled_source)
+        transformed = upsample_displacement(
+            source,
+            sampled_source,
+            transformed - sampled_source,
+            knn=self.upsample_knn,
+        )
+        return transformed.astype(np.float32)
+
+    def _is_linear(self, solution):
+        """
+        the rigid/affine solutions can be applied to all the points,
+        the nonrigid ones (e.g. CPD nonrigid, BCPD) are only defined on the solved points
+        """
+        if self.method_name == "icp":
+            return True
+        return type(solution[0]).__name__ in LINEAR_TRANSFORMATIONS
 
     def _get_transform_matrix(self, solution):
         try:
@@ -326,45 +454,16 @@ class ProbReg(object):
         # todo to implement
         pass
 
-    def _get_prealign_deformation(self, solution_list, device):
-        transform_matrix_list = [
-            self._get_transform_matrix(solution) for solution in solution_list
-        ]
-        translation_list = [
-            self._get_translation(solution) for solution in solution_list
-        ]
-        batch_transform_matrix = torch.from_numpy(np.stack(transform_matrix_list))
-        batch_translation = torch.from_numpy(np.stack(translation_list))
-        return_param = torch.cat((batch_transform_matrix, batch_translation), dim=1)
-        return return_param.to(device)
-
-    def _convert_transform_format(self, solution_list, device):
-        if self.prealign:
-            convert_fn = self._get_prealign_deformation
-            return convert_fn(solution_list, device)
-        else:
-            NotImplemented
-
-    def _get_transformed_res(self, solution_list, source_list, device):
+    def _get_transformed_points(self, solution, source_np):
         if self.method_name == "icp":
-            transformed_list = []
-            for source_np, solution in zip(source_list, solution_list):
-                source = o3d.geometry.PointCloud()
-                source.points = o3d.utility.Vector3dVector(source_np)
-                transformed = source.transform(solution.transformation)
-                transformed_list.append(
-                    np.asarray(transformed.points).astype(np.float32)
-                )
-
+            source = o3d.geometry.PointCloud()
+            source.points = o3d.utility.Vector3dVector(source_np)
+            transformed = source.transform(solution.transformation)
+            return np.asarray(transformed.points).astype(np.float32)
         else:
-            transformed_list = [
-                self.to_cpu(solution.transformation.transform(source)).astype(
-                    np.float32
-                )
-                for solution, source in zip(solution_list, source_list)
-            ]
-        batch_transformdc = torch.from_numpy(np.stack(transformed_list))
-        return batch_transformdc.to(device)
+            return self.to_cpu(
+                solution.transformation.transform(self.cp.asarray(source_np))
+            ).astype(np.float32)
 
 
 ###############   fix cupy  input ########################
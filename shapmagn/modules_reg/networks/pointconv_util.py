@@ -11,6 +11,7 @@ import torch.nn.functional as F
 import pointnet2.lib.pointnet2_utils as pointnet2_utils
 from shapmagn.shape.point_interpolator import nadwat_kernel_interpolator
 from shapmagn.utils.knn_utils import KNN, AnisoKNN
+from shapmagn.utils.knn_graph_cache import KNN_GRAPH_CACHE
 
 LEAKY_RATE = 0.1
 use_bn = False
@@ -79,12 +80,14 @@ def square_distance(src, dst):
     return dist
 
 
-def knn_point(nsample, xyz, new_xyz):
+def knn_point(nsample, xyz, new_xyz, use_graph_cache=False):
     """
     Input:
         nsample: max sample number in local region
         xyz: all points, [B, N, C]
         new_xyz: query points, [B, S, C]
+        use_graph_cache: the self query (new_xyz is xyz) is served from KNN_GRAPH_CACHE,
+            only worth it for points queried repeatedly, the per batch points of the networks are not
     Return:
         group_idx: grouped points index, [B, S, nsample]
     """
@@ -92,6 +95,10 @@ def knn_point(nsample, xyz, new_xyz):
     # sqrdists = square_distance(new_xyz, xyz)
     # _, group_idx = torch.topk(sqrdists, nsample, dim = -1, largest=False, sorted=False)
     # return group_idx
+    if use_graph_cache and new_xyz is xyz:
+        return KNN_GRAPH_CACHE.self_knn(
+            xyz, nsample, lambda points, K: knn_point(K, points, points, False), ("sqdist",)
+        )
     new_xyz = LazyTensor(new_xyz[:, :, None].contiguous())  # BxSx1xC
     xyz = LazyTensor(xyz[:, None].contiguous())  # Bx1xNxC
     dist2 = new_xyz.sqdist(xyz)
@@ -68,6 +68,32 @@ class ODEBlock(nn.Module):
     def solve(self, x):
         return self.forward(x)
 
+    def solve_trajectory(self, x, n_time_steps=None):
+        """
+        integrate without the adjoint and record the states at uniform times of the integration interval,
+        the adaptive solvers still choose their own steps, the records are taken from their dense output
+
+        :param x: tuple of the initial states
+        :param n_time_steps: int, number of recorded intervals, number_of_time_steps by default
+        :return: times (T), tuple of the states TxBxNxD
+        """
+        n_time_steps = n_time_steps if n_time_steps is not None else self.n_step
+        times = torch.linspace(
+            float(self.integration_time[0]),
+            float(self.integration_time[-1]),
+            n_time_steps + 1,
+        ).type_as(x[0])
+        out = torchdiffeq.odeint(
+            self.odefunc,
+            x,
+            times,
+            rtol=self.rtol,
+            atol=self.atol,
+            method=self.method,
+            options={"step_size": self.dt, "eps": self.min_step},
+        )
+        return times, out
+
     def set_func(self, func):
         self.odefunc = func
 
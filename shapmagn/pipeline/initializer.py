@@ -1,5 +1,10 @@
 import os, sys
 from shapmagn.utils.utils import set_device
+from shapmagn.utils.distributed import (
+    is_distributed,
+    is_main_process,
+    set_distributed_device,
+)
 from torch.utils.tensorboard import SummaryWriter
 import shapmagn.utils.module_parameters as pars
 from shapmagn.datasets.data_manager import DataManager
@@ -58,6 +63,8 @@ class Initializer:
 
         torch.backends.cudnn.benchmark = True
         gpu_id = self.task_opt["gpu_ids"]
+        if is_distributed():
+            return set_distributed_device(gpu_id)
         device, gpus = set_device(gpu_id)
         return device, gpus
 
@@ -71,9 +78,10 @@ class Initializer:
         """
         self.data_manager = DataManager()
 
-    def build_data_loader(self):
+    def build_data_loader(self, device=None):
         """
         get task related setttings for data manager
+        :param device: torch.device, the task device, the default device of the input preparation in the workers
         """
         batch_size = self.task_opt[
             (
@@ -83,14 +91,28 @@ class Initializer:
             )
         ]
         is_train = self.task_opt[("is_train", False, "train the model")]
+        prepare_input_in_dataloader = self.task_opt[
+            (
+                "prepare_input_in_dataloader",
+                False,
+                "run the model's prepare_input_object (e.g. the synthesis of HybirdData) in the DataLoader workers",
+            )
+        ]
+        prepare_input_obj = ""
+        if prepare_input_in_dataloader:
+            prepare_input_obj = self.task_opt[
+                ("prepare_input_object", "", "input processing function")
+            ]
         return self.data_manager.build_data_loaders(
-            batch_size=batch_size, is_train=is_train
+            batch_size=batch_size,
+            is_train=is_train,
+            prepare_input_obj=prepare_input_obj,
+            device=device,
         )
 
     def setting_folder(self):
         for item in self.path:
-            if not os.path.exists(self.path[item]):
-                os.makedirs(self.path[item])
+            os.makedirs(self.path[item], exist_ok=True)
 
     def initialize_log_env(
         self,
@@ -121,6 +143,10 @@ class Initializer:
             "record_path": record_path,
         }
         self.setting_folder()
+        if not is_main_process():
+            # in the distributed training, only the rank 0 writes the logs
+            self.writer = None
+            return self.writer
         sys.stdout = self.Logger(self.task_path)
         print("start logging:")
         self.writer = SummaryWriter(logdir, self.task_name)
@@ -1,7 +1,13 @@
 from shapmagn.pipeline.build_model import build_model
 from shapmagn.pipeline.train_model import train_model
-from shapmagn.pipeline.test_model import eval_model
+from shapmagn.pipeline.test_model import eval_model, eval_model_parallel
 from shapmagn.pipeline.initializer import Initializer
+from shapmagn.utils.async_writer import (
+    enable_async_writer,
+    disable_async_writer,
+    flush_async_writer,
+)
+from shapmagn.utils.distributed import is_main_process
 
 
 class Pipline:
@@ -23,8 +29,8 @@ class Pipline:
         self.tsk_opt = initializer.init_task_option(task_setting_pth)
         self.writer = initializer.initialize_log_env()
         self.tsk_opt = initializer.get_task_option()
-        self.data_loaders = initializer.build_data_loader()
         self.device, self.gpus = initializer.initialize_compute_env()
+        self.data_loaders = initializer.build_data_loader(self.device)
         self.model = build_model(self.tsk_opt, self.device, self.gpus)
 
     def clean_up(self):
@@ -41,10 +47,40 @@ class Pipline:
         run training based model or evaluation based model
         :return: None
         """
-        _run_model = train_model if is_train else eval_model
-        _run_model(
-            self.tsk_opt, self.model, self.data_loaders, self.writer, self.device
-        )
+        eval_workers = self.tsk_opt[
+            ("eval_workers", 1, "number of processes the evaluation is sharded over")
+        ]
+        async_writer_workers = self.tsk_opt[
+            (
+                "async_writer_workers",
+                0,
+                "number of threads that write the result files in the background, 0 to write synchronously",
+            )
+        ]
+        if not is_train and not is_main_process():
+            # the distributed mode is for the training, the evaluation runs on the rank 0
+            return
+        enable_async_writer(async_writer_workers)
+        try:
+            if not is_train and eval_workers > 1:
+                eval_model_parallel(
+                    self.tsk_opt,
+                    self.model,
+                    self.data_loaders,
+                    self.task_setting_pth,
+                    eval_workers,
+                )
+            else:
+                _run_model = train_model if is_train else eval_model
+                _run_model(
+                    self.tsk_opt, self.model, self.data_loaders, self.writer, self.device
+                )
+            # raise the errors of the background writes, the task should not succeed with missing results
+            flush_async_writer()
+        finally:
+            disable_async_writer()
+        if not is_main_process():
+            return
         saving_comment_path = self.task_setting_pth.replace(".json", "_comment.json")
         self.tsk_opt.write_JSON_comments(saving_comment_path)
 
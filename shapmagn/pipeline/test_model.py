@@ -1,9 +1,22 @@
 from time import time
 from shapmagn.utils.net_utils import get_test_model, update_res
 import os
+import traceback
 import numpy as np
 
 
+def load_eval_model(model_path, model):
+    if len(model_path):
+        # todo  check  model loading for data parallel
+        get_test_model(model_path, model.get_model(), model.optimizer)
+    else:
+        print(
+            "Warning, the model is not manual loaded."
+            "Make sure the current run is in 'optimization mode' or  model has been internally initialized"
+        )
+    model.set_cur_epoch(-1)
+
+
 def eval_model(opt, model, dataloaders, writer, device, task_name=""):
     model_path = opt["path"][("model_load_path", "", "trained model path")]
     since = time()
@@ -18,16 +31,7 @@ def eval_model(opt, model, dataloaders, writer, device, task_name=""):
     if running_part_data:
         print("running part of the test data from range {}".format(running_range))
     phases = ["test"]
-    if len(model_path):
-        # todo  check  model loading for data parallel
-        get_test_model(model_path, model.get_model(), model.optimizer)
-    else:
-        print(
-            "Warning, the model is not manual loaded."
-            "Make sure the current run is in 'optimization mode' or  model has been internally initialized"
-        )
-
-    model.set_cur_epoch(-1)
+    load_eval_model(model_path, model)
     for phase in phases:
         num_samples = len(dataloaders[phase])
         if running_part_data:
@@ -103,6 +107,235 @@ def eval_model(opt, model, dataloaders, writer, device, task_name=""):
     return model
 
 
+def _eval_worker(
+    rank,
+    opt,
+    task_setting_pth,
+    batch_id_list,
+    batch_size,
+    collate_fn,
+    gpu_ids,
+    num_threads,
+    queue,
+):
+    """
+    evaluate a shard of the test batches in a separated process, the records of each batch are sent back through the queue
+    each worker owns its model and its torch/KeOps thread budget
+
+    :param rank: int, worker id
+    :param opt: ParameterDict, task settings (tsk_set) of the parent
+    :param task_setting_pth: str, path of the task setting json, used to rebuild the dataset
+    :param batch_id_list: list of int, ids of the batches assigned to the worker
+    :param batch_size: int, test batch size of the parent dataloader
+    :param collate_fn: collate function of the parent dataloader
+    :param gpu_ids: list of gpu ids or None
+    :param num_threads: int, number of cpu threads of the worker
+    :param queue: multiprocessing queue
+    """
+    import torch
+    from torch.utils.data import DataLoader, Subset
+    from shapmagn.utils.utils import set_device
+    from shapmagn.pipeline.initializer import Initializer
+    from shapmagn.pipeline.build_model import build_model
+    from shapmagn.utils.async_writer import (
+        enable_async_writer,
+        disable_async_writer,
+        flush_async_writer,
+    )
+
+    try:
+        torch.set_num_threads(num_threads)
+        enable_async_writer(
+            opt[
+                (
+                    "async_writer_workers",
+                    0,
+                    "number of threads that write the result files in the background, 0 to write synchronously",
+                )
+            ]
+        )
+        initializer = Initializer()
+        initializer.initialize_data_manager()
+        initializer.init_task_option(task_setting_pth)
+        dataset = initializer.data_manager.build_dataset("test")
+        index_list = [
+            index
+            for batch_id in batch_id_list
+            for index in range(batch_id * batch_size, min((batch_id + 1) * batch_size, len(dataset)))
+        ]
+        dataloader = DataLoader(
+            Subset(dataset, index_list),
+            batch_size=batch_size,
+            shuffle=False,
+            num_workers=0,
+            collate_fn=collate_fn,
+        )
+        device, gpus = set_device(gpu_ids)
+        model = build_model(opt, device, gpus)
+        load_eval_model(opt["path"]["model_load_path"], model)
+        save_fig_on = opt["save_fig_on"]
+        for batch_id, data in zip(batch_id_list, dataloader):
+            model.set_test()
+            input_data = model.set_input(data, device, "test")
+            ex_time = time()
+            test_res = model.get_evaluation(input_data)
+            batch_time = time() - ex_time
+            score, detailed_scores = model.analyze_res(test_res, cache_res=False)
+            name_attr = list(filter(lambda x: "name" in x, data.keys()))[0]
+            queue.put(
+                {
+                    "batch_id": batch_id,
+                    "score": float(score),
+                    "batch_size": len(test_res[0]["score"]),
+                    "batch_time": batch_time,
+                    "detailed_scores": detailed_scores,
+                    "name": list(data[name_attr]),
+                }
+            )
+            model.save_visual_res(save_fig_on, input_data, test_res, "test")
+        flush_async_writer()
+    except Exception:
+        queue.put({"error": traceback.format_exc(), "rank": rank})
+    finally:
+        disable_async_writer()
+    queue.put({"done": rank})
+
+
+def eval_model_parallel(
+    opt, model, dataloaders, task_setting_pth, num_workers, task_name=""
+):
+    """
+    process-pool counterpart of eval_model, the test batches are sharded over num_workers processes,
+    the per-batch records streamed back from the workers are merged into the same
+    records/records_time/<metric>_records_detail outputs as eval_model
+
+    :param opt: ParameterDict, task settings
+    :param model: the model of the parent, only used to save the merged results (save_res),
+        it is the model Pipline.initialize already built for every task, no model is built for this,
+        the parent never loads the weights nor runs it, the score file keeps the format of the model
+    :param dataloaders: the dataloaders of the parent, only used to count the batches
+    :param task_setting_pth: str, path of the task setting json
+    :param num_workers: int, number of worker processes
+    :param task_name: str, prefix of the saved records
+    :return: model
+    """
+    import torch.multiprocessing as mp
+
+    since = time()
+    phase = "test"
+    record_path = opt["path"]["record_path"]
+    running_range = opt[
+        ("running_range", [-1], "max running number, set -1 if not limited")
+    ]
+    opt[("save_fig_on", False, "save the visualizatio results during the evaluation")]
+    opt["path"][("model_load_path", "", "trained model path")]
+    running_part_data = running_range[0] >= 0
+    num_batches = len(dataloaders[phase])
+    batch_ids = list(running_range) if running_part_data else list(range(num_batches))
+    batch_ids = [batch_id for batch_id in batch_ids if batch_id < num_batches]
+    num_workers = max(1, min(num_workers, len(batch_ids)))
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    gpu_ids = opt[("gpu_ids", None, "list of gpu ids to use")]
+    print(
+        "evaluate {} batches with {} workers, {} threads per worker".format(
+            len(batch_ids), num_workers, num_threads
+        )
+    )
+
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    workers = []
+    omp_num_threads = os.environ.get("OMP_NUM_THREADS", None)
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    for rank in range(num_workers):
+        worker_gpu_ids = [gpu_ids[rank % len(gpu_ids)]] if gpu_ids else gpu_ids
+        worker = ctx.Process(
+            target=_eval_worker,
+            args=(
+                rank,
+                opt,
+                task_setting_pth,
+                batch_ids[rank::num_workers],
+                dataloaders[phase].batch_size,
+                dataloaders[phase].collate_fn,
+                worker_gpu_ids,
+                num_threads,
+                queue,
+            ),
+        )
+        worker.start()
+        workers.append(worker)
+    if omp_num_threads is None:
+        os.environ.pop("OMP_NUM_THREADS")
+    else:
+        os.environ["OMP_NUM_THREADS"] = omp_num_threads
+
+    records = {}
+    errors = []
+    num_done = 0
+    while num_done < num_workers:
+        record = queue.get()
+        if "done" in record:
+            num_done += 1
+        elif "error" in record:
+            errors.append(record)
+            print("worker {} failed:\n{}".format(record["rank"], record["error"]))
+        else:
+            records[record["batch_id"]] = record
+            print(
+                "id {} and current name is : {}, score: {}, takes {} to complete".format(
+                    record["batch_id"],
+                    record["name"],
+                    record["score"],
+                    record["batch_time"],
+                )
+            )
+    for worker in workers:
+        worker.join()
+    if len(errors):
+        raise RuntimeError("{} of {} eval workers failed".format(len(errors), num_workers))
+
+    num_samples = len(running_range) if running_part_data else num_batches
+    records_score_np = np.zeros(num_samples)
+    records_time_np = np.zeros(num_samples)
+    runing_detailed_scores = {}
+    running_test_score = 0
+    time_total = 0
+    batch_size_list = []
+    model.caches = {}
+    for batch_id in sorted(records):
+        record = records[batch_id]
+        i = batch_id - running_range[0] if running_part_data else batch_id
+        records_score_np[i] = record["score"]
+        records_time_np[i] = record["batch_time"]
+        time_total += record["batch_time"]
+        running_test_score += record["score"] * record["batch_size"]
+        batch_size_list.append(record["batch_size"])
+        update_res(record["detailed_scores"], runing_detailed_scores)
+        update_res(dict(record["detailed_scores"], pair_name=record["name"]), model.caches)
+
+    test_score = running_test_score / len(dataloaders[phase].dataset)
+    time_per_img = time_total / len((dataloaders[phase].dataset))
+    print("the average {}_score: {:.4f}".format(phase, test_score))
+    print("the average time for per image is {}".format(time_per_img))
+    time_elapsed = time() - since
+    print(
+        "the size of {} is {}, evaluation complete in {:.0f}m {:.0f}s".format(
+            len(dataloaders[phase].dataset),
+            phase,
+            time_elapsed // 60,
+            time_elapsed % 60,
+        )
+    )
+    np.save(os.path.join(record_path, task_name + "records"), records_score_np)
+    model.save_res(phase)
+    extract_and_save_interested_loss(
+        runing_detailed_scores, batch_size_list, record_path
+    )
+    np.save(os.path.join(record_path, task_name + "records_time"), records_time_np)
+    return model
+
+
 def extract_and_save_interested_loss(detailed_scores, batch_size_list, record_path):
     """" multi_metric_res:{loss:  acc:} ,"""
     assert len(detailed_scores) > 0
@@ -1,6 +1,7 @@
 from time import time
 from shapmagn.utils.net_utils import resume_train, save_checkpoint, update_res
 from shapmagn.utils.utils import set_seed
+from shapmagn.utils.distributed import is_main_process
 
 
 def train_model(opt, model, dataloaders, writer, device):
@@ -97,6 +98,9 @@ def train_model(opt, model, dataloaders, writer, device):
             # if # = 0 or None then skip the val or debug phase
             if not max_batch_num_per_epoch[phase]:
                 continue
+            # in the distributed training, the val and debug phases run on the rank 0 only
+            if phase != "train" and not is_main_process():
+                continue
             if phase == "train":
                 set_seed(seed=None)
                 model.update_scheduler(epoch)
@@ -111,6 +115,12 @@ def train_model(opt, model, dataloaders, writer, device):
             running_val_score = {}
             running_debug_score = {}
 
+            if hasattr(dataloaders[phase].sampler, "set_epoch"):
+                # reshuffle the shards of the DistributedSampler
+                dataloaders[phase].sampler.set_epoch(epoch)
+            if hasattr(dataloaders[phase].collate_fn, "set_epoch"):
+                # the input preparation runs in the workers, see HybirdDataCollate
+                dataloaders[phase].collate_fn.set_epoch(epoch)
             for data in dataloaders[phase]:
 
                 global_step[phase] += 1
@@ -171,7 +181,8 @@ def train_model(opt, model, dataloaders, writer, device):
                 if not is_train:
                     update_res(detailed_scores, period_detailed_scores[phase])
                 if (
-                    global_step[phase] > 0
+                    writer is not None
+                    and global_step[phase] > 0
                     and global_step[phase] % tensorboard_print_period[phase] == 0
                 ):
                     if not is_train:
@@ -234,7 +245,7 @@ def train_model(opt, model, dataloaders, writer, device):
                         best_score,
                     )
 
-            if phase == "train":
+            if phase == "train" and is_main_process():
                 if epoch % check_best_model_period == 0:
                     save_model(
                         model,
@@ -270,7 +281,8 @@ def train_model(opt, model, dataloaders, writer, device):
         )
     )
     print("Best val score : {:4f} is at epoch {}".format(best_score, best_epoch))
-    writer.close()
+    if writer is not None:
+        writer.close()
     # return the model at the last epoch, not the best epoch
     return model
 
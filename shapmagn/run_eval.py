@@ -96,6 +96,7 @@ def do_evaluation(args):
     tsm = init_eval_env(setting_folder_path, task_output_path, data_json_path)
     tsm = addition_test_setting(args, tsm)
     tsm.task_par["tsk_set"]["gpu_ids"] = args.gpus
+    tsm.task_par["tsk_set"]["eval_workers"] = args.workers
     tsm_json_path = os.path.join(task_output_path, "task_setting.json")
     tsm.save(tsm_json_path)
     pipeline = run_one_task(tsm_json_path, is_train=False)
@@ -124,6 +125,7 @@ if __name__ == "__main__":
         --setting_folder_path/ -ts: path of the folder where settings are saved,should include task_setting.json
         --model_path/ -m: for learning based approach, the model checkpoint should either provided here (first priority) or set in task_setting.json (second priority)
         --gpu_id/ -g: gpu_id to use
+        --workers/ -w: number of processes the pairs are sharded over, each process runs its own model
     """
     import argparse
 
@@ -170,6 +172,13 @@ if __name__ == "__main__":
         metavar="N",
         help="list of gpu ids to use",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        default=1,
+        type=int,
+        help="number of processes the evaluation is sharded over, each process runs its own model",
+    )
     args = parser.parse_args()
     print(args)
     do_evaluation(args)
@@ -32,6 +32,7 @@ torch.backends.cudnn.benchmark = True
 import shapmagn.utils.module_parameters as pars
 from abc import ABCMeta, abstractmethod
 from shapmagn.pipeline.run_pipeline import run_one_task
+from shapmagn.utils.distributed import init_distributed, cleanup_distributed
 
 
 class BaseTask:
@@ -117,10 +118,43 @@ def _do_learning(args):
     tsm.task_par["tsk_set"]["gpu_ids"] = args.gpus
     tsm_json_path = os.path.join(task_output_path, "task_setting.json")
     tsm.save(tsm_json_path)
+    if args.nproc_per_node > 1 or args.nnodes > 1:
+        torch.multiprocessing.spawn(
+            _run_distributed_worker,
+            args=(args, tsm_json_path, not args.eval),
+            nprocs=args.nproc_per_node,
+        )
+        return None
+    if int(os.environ.get("WORLD_SIZE", 1)) > 1:
+        # the processes are started by an external launcher, e.g. torch.distributed.launch --use_env
+        init_distributed(args.dist_backend)
     pipeline = run_one_task(tsm_json_path, not args.eval)
+    cleanup_distributed()
     return pipeline
 
 
+def _run_distributed_worker(local_rank, args, tsm_json_path, is_train):
+    """
+    run the task in one process of the distributed training
+
+    :param local_rank: int, process id on the node
+    :param args: the parsed arguments
+    :param tsm_json_path: the path of the task setting json
+    :param is_train: train or evaluate
+    :return: None
+    """
+    os.environ["MASTER_ADDR"] = args.master_addr
+    os.environ["MASTER_PORT"] = str(args.master_port)
+    os.environ["WORLD_SIZE"] = str(args.nnodes * args.nproc_per_node)
+    os.environ["RANK"] = str(args.node_rank * args.nproc_per_node + local_rank)
+    os.environ["LOCAL_RANK"] = str(local_rank)
+    init_distributed(args.dist_backend)
+    try:
+        run_one_task(tsm_json_path, is_train)
+    finally:
+        cleanup_distributed()
+
+
 def addition_test_setting(args, tsm):
     model_path = args.model_path
     if model_path is not None:
@@ -156,6 +190,9 @@ if __name__ == "__main__":
         --task_name / -tn: task name
         --setting_folder_path/ -ts: path of the folder where settings are saved,should include task_setting.json
         --gpu_id/ -g: gpu_id to use
+        --nproc_per_node: number of training processes on this node, >1 to train with DistributedDataParallel
+        --nnodes/ --node_rank/ --master_addr/ --master_port: multi-node settings of the distributed training
+        --dist_backend: gloo (cpu/gpu) or nccl (gpu)
     """
     import argparse
 
@@ -211,6 +248,31 @@ if __name__ == "__main__":
         metavar="N",
         help="list of gpu ids to use",
     )
+    parser.add_argument(
+        "--nproc_per_node",
+        default=1,
+        type=int,
+        help="number of training processes on this node, each process takes one gpu (or the cpu)",
+    )
+    parser.add_argument(
+        "--nnodes", default=1, type=int, help="number of nodes of the distributed training"
+    )
+    parser.add_argument(
+        "--node_rank", default=0, type=int, help="rank of this node"
+    )
+    parser.add_argument(
+        "--master_addr", default="127.0.0.1", type=str, help="address of the rank 0 node"
+    )
+    parser.add_argument(
+        "--master_port", default=29500, type=int, help="port of the rank 0 node"
+    )
+    parser.add_argument(
+        "--dist_backend",
+        default="gloo",
+        type=str,
+        choices=["gloo", "nccl"],
+        help="backend of torch.distributed, gloo supports the cpu training",
+    )
     args = parser.parse_args()
     print(args)
     do_learning(args)
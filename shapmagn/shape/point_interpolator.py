@@ -1,8 +1,12 @@
 import torch
 from pykeops.torch import LazyTensor
-from shapmagn.utils.local_feature_extractor import compute_anisotropic_gamma_from_points
+from shapmagn.utils.local_feature_extractor import (
+    compute_anisotropic_gamma_from_points,
+    cached_anisotropic_gamma_from_points,
+)
 from shapmagn.utils.obj_factory import obj_factory
 from shapmagn.utils.knn_utils import NN, KNN
+from shapmagn.utils.voxel_hash_utils import build_radius_neighbors
 
 
 def compute_nadwat_kernel(scale=0.1, exp_order=2, iso=True, self_center=False):
@@ -78,8 +82,128 @@ def compute_nadwat_kernel(scale=0.1, exp_order=2, iso=True, self_center=False):
     return interp
 
 
+class SparseNadWatKernel(object):
+    """
+    radius-truncated Nadaraya-Watson kernel stored in CSR order (rows, cols, values),
+    applying it is a sparse matvec of O(N*k) instead of the dense O(N*M) reduction
+    """
+
+    def __init__(self, rows, cols, values, shape):
+        """
+        :param rows: P long tensor, flattened (batch*N) index of the query points, sorted
+        :param cols: P long tensor, flattened (batch*M) index of the control points
+        :param values: P tensor, normalized kernel weights
+        :param shape: (B, N, M)
+        """
+        self.rows = rows
+        self.cols = cols
+        self.values = values
+        self.shape = shape
+
+    def __call__(self, control_value):
+        """
+        :param control_value: BxMxd tensor
+        :return: BxNxd tensor
+        """
+        B, N, M = self.shape
+        flat_value = control_value.reshape(B * M, -1)
+        output = flat_value.new_zeros(B * N, flat_value.shape[-1])
+        output = output.index_add(
+            0, self.rows, self.values[:, None] * flat_value[self.cols]
+        )
+        return output.view(B, N, -1)
+
+    def __add__(self, other):
+        return SparseNadWatKernel(
+            torch.cat([self.rows, other.rows]),
+            torch.cat([self.cols, other.cols]),
+            torch.cat([self.values, other.values]),
+            self.shape,
+        )
+
+    def __rmul__(self, weight):
+        return SparseNadWatKernel(self.rows, self.cols, weight * self.values, self.shape)
+
+    def detach(self):
+        return SparseNadWatKernel(self.rows, self.cols, self.values.detach(), self.shape)
+
+    @property
+    def density(self):
+        B, N, M = self.shape
+        return len(self.rows) / (B * N * M)
+
+
+def compute_sparse_nadwat_kernel(
+    scale=0.1, exp_order=2, iso=True, self_center=False, truncate_sigma=3.0
+):
+    """
+    sparse counterpart of compute_nadwat_kernel, the pairs whose (scaled, anisotropic) distance is larger than
+    truncate_sigma are dropped, the kernel is normalized over the kept pairs,
+    query points without any control point in reach get zero
+
+    :param scale: kernel width of isotropic kernel, if aniso, scale is use to scale the gamma
+    :param exp_order: float, 1,2,0.5
+    :param iso: bool, use isotropic kernel, sigma equals to scale
+    :param self_center: bool, if aniso, the gamma is defined on the query points instead of the control points
+    :param truncate_sigma: float, truncation radius in the unit of the kernel width
+    """
+    assert exp_order in [1, 2, 0.5]
+
+    def compute(points, control_points, control_weights, gamma=None):
+        """
+        :param points: BxNxD Tensor
+        :param control_points: BxMxD Tensor
+        :param control_weights: BxMx1 Tensor
+        :param gamma: optional BxMxDxD Tensor (BxNxDxD if self_center), anisotropic inverse kernel
+        :return: SparseNadWatKernel
+        """
+        B, N, D = points.shape
+        M = control_points.shape[1]
+        if iso:
+            radius = truncate_sigma * scale
+        else:
+            gamma = gamma * (1 / scale ** 2)
+            with torch.no_grad():
+                eigenvalue_min = torch.symeig(gamma.view(-1, D, D))[0].min()
+            radius = truncate_sigma / eigenvalue_min.clamp(min=1e-12).sqrt().item()
+        rows_list, cols_list = [], []
+        for b in range(B):
+            index_i, index_j = build_radius_neighbors(
+                points[b], control_points[b], radius
+            )
+            rows_list.append(index_i + b * N)
+            cols_list.append(index_j + b * M)
+        rows, cols = torch.cat(rows_list), torch.cat(cols_list)
+        diff = points.reshape(B * N, D)[rows] - control_points.reshape(B * M, D)[cols]
+        if iso:
+            dist2 = (diff ** 2).sum(-1) / scale ** 2
+        else:
+            pair_gamma = gamma.reshape(-1, D, D)[rows if self_center else cols]
+            dist2 = (diff[:, None] @ pair_gamma @ diff[:, :, None]).view(-1)
+            within = dist2 <= truncate_sigma ** 2
+            rows, cols, dist2 = rows[within], cols[within], dist2[within]
+        if exp_order == 1:
+            C_ij = dist2.clamp(min=1e-12).sqrt()
+        elif exp_order == 2:
+            C_ij = dist2 / 2
+        elif exp_order == 1 / 2:
+            C_ij = 2 * dist2.clamp(min=1e-12).sqrt().sqrt()
+        # C_ij is bounded by the truncation, so the normalization can be done without the log-domain
+        unnormalized = control_weights.reshape(-1)[cols] * torch.exp(-C_ij)
+        normalizer = unnormalized.new_zeros(B * N).index_add(0, rows, unnormalized)
+        values = unnormalized / normalizer[rows]
+        return SparseNadWatKernel(rows, cols, values, (B, N, M))
+
+    return compute
+
+
 def nadwat_kernel_interpolator(
-    scale=0.1, weight=1.0, exp_order=2, iso=True, self_center=False
+    scale=0.1,
+    weight=1.0,
+    exp_order=2,
+    iso=True,
+    self_center=False,
+    kernel_truncate_sigma=None,
 ):
     """
     Nadaraya-Watson kernel interpolation
@@ -88,18 +212,24 @@ def nadwat_kernel_interpolator(
      if aniso, scale is use to scale the gamma, the equvialient kernel size is aniso_kernel_scale*scale
     :param exp_order: float, 1,2,0.5
     :param iso: bool, use isotropic kernel, sigma equals to scale
+    :param kernel_truncate_sigma: float, if not None, use the sparse kernel truncated at kernel_truncate_sigma*kernel width
     """
     # todo write plot-test on this function
     multi_scale = isinstance(scale, list)
+    if multi_scale:
+        assert sum(weight) == 1, "sum of weight should be 1"
+        assert len(weight) == len(
+            scale
+        ), "weight and scale list should be of the same length"
+    if kernel_truncate_sigma is not None:
+        return sparse_nadwat_kernel_interpolator(
+            scale, weight, exp_order, iso, self_center, kernel_truncate_sigma
+        )
     if not multi_scale:
         compute_kernel = compute_nadwat_kernel(
             scale=scale, exp_order=exp_order, iso=iso, self_center=self_center
         )
     else:
-        assert sum(weight) == 1, "sum of weight should be 1"
-        assert len(weight) == len(
-            scale
-        ), "weight and scale list should be of the same length"
         compute_kernel_list = [
             compute_nadwat_kernel(
                 scale=_scale, exp_order=exp_order, iso=iso, self_center=self_center
@@ -134,6 +264,42 @@ def nadwat_kernel_interpolator(
     return interp
 
 
+def sparse_nadwat_kernel_interpolator(
+    scale=0.1, weight=1.0, exp_order=2, iso=True, self_center=False, truncate_sigma=3.0
+):
+    """
+    Nadaraya-Watson kernel interpolation with the radius-truncated sparse kernel
+
+    :param scale: kernel width, or a list of kernel widths for the multi-scale kernel
+    :param weight: weight of each kernel for the multi-scale kernel
+    :param exp_order: float, 1,2,0.5
+    :param iso: bool, use isotropic kernel, sigma equals to scale
+    :param truncate_sigma: float, truncation radius in the unit of the kernel width
+    """
+    scale_list = scale if isinstance(scale, list) else [scale]
+    weight_list = weight if isinstance(scale, list) else [1.0]
+    compute_kernel_list = [
+        compute_sparse_nadwat_kernel(_scale, exp_order, iso, self_center, truncate_sigma)
+        for _scale in scale_list
+    ]
+
+    def compute_kernel(points, control_points, control_weights, gamma=None):
+        kernel = None
+        for _weight, _compute_kernel in zip(weight_list, compute_kernel_list):
+            _kernel = _weight * _compute_kernel(
+                points, control_points, control_weights, gamma=gamma
+            )
+            kernel = _kernel if kernel is None else kernel + _kernel
+        return kernel
+
+    def interp(points, control_points, control_value, control_weights, gamma=None):
+        kernel = compute_kernel(points, control_points, control_weights, gamma=gamma)
+        return kernel(control_value)
+
+    interp.compute_kernel = compute_kernel
+    return interp
+
+
 def _spline_intepolator(scale=0.1, kernel="gauss", iso=True):
     """
     Performs a ridge kernel regression.
@@ -227,15 +393,22 @@ def nadwat_interpolator_with_aniso_kernel_extractor_embedded(
     self_center=False,
     leaf_decay=False,
     mass_thres=2.5,
+    truncate_sigma=None,
+    use_gamma_cache=True,
 ):
     interp = nadwat_kernel_interpolator(
         scale=1.0, exp_order=exp_order, iso=False, self_center=self_center
     )
+    compute_gamma = (
+        cached_anisotropic_gamma_from_points
+        if use_gamma_cache
+        else compute_anisotropic_gamma_from_points
+    )
 
     def compute(points, control_points, control_value, control_weights, gamma=None):
         Gamma_control_points = gamma
         if Gamma_control_points is None:
-            Gamma_control_points = compute_anisotropic_gamma_from_points(
+            Gamma_control_points = compute_gamma(
                 points,
                 cov_sigma_scale=cov_sigma_scale,
                 aniso_kernel_scale=aniso_kernel_scale,
@@ -244,6 +417,7 @@ def nadwat_interpolator_with_aniso_kernel_extractor_embedded(
                 iter_twice=iter_twice,
                 leaf_decay=leaf_decay,
                 mass_thres=mass_thres,
+                truncate_sigma=truncate_sigma,
             )
 
         interp_value = interp(
@@ -270,7 +444,17 @@ class NadWatAnisoSpline(object):
         mass_thres=2.5,
         self_center=False,
         requires_grad=True,
+        truncate_sigma=None,
+        use_gamma_cache=True,
+        kernel_truncate_sigma=None,
     ):
+        """
+        :param truncate_sigma: float, truncation used in the Gamma estimation
+        :param kernel_truncate_sigma: float, if not None, the interpolation kernel is truncated at
+            kernel_truncate_sigma*kernel width and stored as a sparse kernel, with fixed=True the sparse kernel
+            is built once and applied as a sparse matvec at each iteration, it is then a constant,
+            the gradient only flows into the control values
+        """
         self.exp_order = exp_order
         self.cov_sigma_scale = cov_sigma_scale
         self.aniso_kernel_scale = aniso_kernel_scale
@@ -280,6 +464,12 @@ class NadWatAnisoSpline(object):
         self.mass_thres = mass_thres
         self.leaf_decay = leaf_decay
         self.self_center = self_center
+        self.truncate_sigma = truncate_sigma
+        self.compute_gamma = (
+            cached_anisotropic_gamma_from_points
+            if use_gamma_cache
+            else compute_anisotropic_gamma_from_points
+        )
         self.relative_scale = 1.0
         self.aniso_kernel_weight = aniso_kernel_weight
         if isinstance(aniso_kernel_scale, list):
@@ -287,12 +477,14 @@ class NadWatAnisoSpline(object):
                 scale / aniso_kernel_scale[0] for scale in aniso_kernel_scale
             ]
             self.aniso_kernel_scale = aniso_kernel_scale[0]
+        self.kernel_truncate_sigma = kernel_truncate_sigma
         self.spline = nadwat_kernel_interpolator(
             scale=self.relative_scale,
             weight=aniso_kernel_weight,
             exp_order=exp_order,
             iso=False,
             self_center=self_center,
+            kernel_truncate_sigma=kernel_truncate_sigma,
         )
         self.fixed = fixed
         self.is_interp = is_interp
@@ -300,7 +492,7 @@ class NadWatAnisoSpline(object):
         self.requires_grad = requires_grad
 
     def initialize(self, points, weights=None):
-        self.Gamma = compute_anisotropic_gamma_from_points(
+        self.Gamma = self.compute_gamma(
             points,
             cov_sigma_scale=self.cov_sigma_scale,
             aniso_kernel_scale=self.aniso_kernel_scale,
@@ -309,9 +501,15 @@ class NadWatAnisoSpline(object):
             iter_twice=self.iter_twice,
             leaf_decay=self.leaf_decay,
             mass_thres=self.mass_thres,
+            truncate_sigma=self.truncate_sigma,
         )
         self.Gamma = self.Gamma if self.requires_grad else self.Gamma.detach()
-        if self.fixed and self.iter == 0:
+        if self.fixed and self.iter == 0 and self.kernel_truncate_sigma is not None:
+            # the cached values are applied at every iteration, they can't keep the graph of the first call
+            self.kernel = self.spline.compute_kernel(
+                points, points, weights, gamma=self.Gamma
+            ).detach()
+        elif self.fixed and self.iter == 0:
             if not isinstance(self.relative_scale, list):
                 compute_kernel = compute_nadwat_kernel(
                     scale=1.0,
@@ -368,18 +566,33 @@ class NadWatAnisoSpline(object):
                 self.initialize(
                     control_points, control_weights
                 )  # here control points are the same as the points, so self.self_center doesn't affect
-            value_weight_j = LazyTensor((control_value)[:, None, :, :])  # (B,1, M, D)
-            spline_value = (self.kernel * value_weight_j).sum(dim=2)
+            if self.kernel_truncate_sigma is not None:
+                spline_value = self.kernel(control_value)
+            else:
+                value_weight_j = LazyTensor(
+                    (control_value)[:, None, :, :]
+                )  # (B,1, M, D)
+                spline_value = (self.kernel * value_weight_j).sum(dim=2)
         self.iter += 1
         return spline_value
 
 
 class NadWatIsoSpline(object):
-    def __init__(self, exp_order=2, kernel_scale=0.05, kernel_weight=1.0):
+    def __init__(
+        self,
+        exp_order=2,
+        kernel_scale=0.05,
+        kernel_weight=1.0,
+        kernel_truncate_sigma=None,
+    ):
         self.exp_order = exp_order
         self.kernel_scale = kernel_scale
         self.spline = nadwat_kernel_interpolator(
-            scale=kernel_scale, weight=kernel_weight, exp_order=exp_order, iso=True
+            scale=kernel_scale,
+            weight=kernel_weight,
+            exp_order=exp_order,
+            iso=True,
+            kernel_truncate_sigma=kernel_truncate_sigma,
         )
         self.is_interp = False
         self.iter = 0
@@ -1,18 +1,104 @@
-from pykeops.torch.cluster import grid_cluster
-import numpy as np
 import torch
 
 try:
     from torch_scatter import scatter
 except:
     print("torch scatter is not detected, voxel grid sampling is disabled")
-from pointnet2.lib.pointnet2_utils import furthest_point_sample
 from shapmagn.modules_reg.networks.pointconv_util import index_points_gather
 
 from random import Random
 import time
 
 
+def _batch_grid_reduce(points, weights, scale, pointfea=None):
+    """
+    voxel grid reduction of a batch of point clouds with a single scatter,
+    the voxel keys of all batch elements are made disjoint by a batch offset
+
+    :param points: BxNxD tensor
+    :param weights: BxNx1 tensor
+    :param scale: voxelgrid gather the point info inside grids of "scale" size
+    :param pointfea: BxNxd tensor, optional
+    :return: points BxMxD, weights BxMx1, pointfea BxMxd (None if pointfea is None), index BxN of the voxel each point belongs to,
+        M is the max number of the voxels over the batch, the batch elements with fewer voxels are zero padded
+    """
+    B, N, D = points.shape
+    device = points.device
+    with torch.no_grad():
+        voxel = torch.floor(points / scale).long()
+        voxel = voxel - voxel.min(1, keepdim=True)[0]
+        extent = voxel.view(-1, D).max(0)[0] + 1
+        key = torch.zeros(B, N, dtype=torch.long, device=device)
+        for d in range(D):
+            key = key * extent[d] + voxel[..., d]
+        batch_stride = int(torch.prod(extent).item())
+        key = key + torch.arange(B, device=device).view(B, 1) * batch_stride
+        voxel_key, label = torch.unique(key.view(-1), sorted=True, return_inverse=True)
+        voxel_batch = voxel_key // batch_stride
+        counts = torch.bincount(voxel_batch, minlength=B)
+        offsets = torch.cumsum(counts, 0) - counts
+        voxel_pos = torch.arange(len(voxel_key), device=device) - offsets[voxel_batch]
+        max_len = int(counts.max().item())
+    num_voxel = len(voxel_key)
+    flat_weights = weights.reshape(B * N, 1)
+    voxel_weights = scatter(flat_weights, label, dim=0, dim_size=num_voxel)
+    # a voxel of zero weight points only (e.g. the padding of a ragged batch) is kept with zero weight
+    voxel_norm = voxel_weights.clamp(min=1e-12)
+
+    def padded(voxel_value):
+        output = voxel_value.new_zeros(B, max_len, voxel_value.shape[-1])
+        output[voxel_batch, voxel_pos] = voxel_value
+        return output
+
+    voxel_points = (
+        scatter(points.reshape(B * N, D) * flat_weights, label, dim=0, dim_size=num_voxel)
+        / voxel_norm
+    )
+    voxel_pointfea = None
+    if pointfea is not None:
+        voxel_pointfea = (
+            scatter(
+                pointfea.reshape(B * N, -1) * flat_weights,
+                label,
+                dim=0,
+                dim_size=num_voxel,
+            )
+            / voxel_norm
+        )
+        voxel_pointfea = padded(voxel_pointfea)
+    index = voxel_pos[label].view(B, N)
+    return padded(voxel_points), padded(voxel_weights), voxel_pointfea, index
+
+
+def _batch_sample_index(weights, num_sample, fixed_random_seed=True, sampled_by_weight=True):
+    """
+    draw num_sample indices per batch element on the device of the weights,
+    without replacement unless a batch element has fewer than num_sample candidates
+
+    :param weights: BxN tensor
+    :param num_sample: int
+    :param fixed_random_seed: bool, use a generator seeded with 0
+    :param sampled_by_weight: bool, sample with probability proportional to the weights, otherwise uniformly
+    :return: BxS long tensor, sorted indices
+    """
+    B = weights.shape[0]
+    generator = None
+    if fixed_random_seed:
+        generator = torch.Generator(device=weights.device)
+        generator.manual_seed(0)
+    prob = weights.detach() if sampled_by_weight else torch.ones_like(weights)
+    prob = prob.float()
+    with_replacement = (prob > 0).sum(-1) < num_sample
+    index = torch.empty(B, num_sample, dtype=torch.long, device=weights.device)
+    for replacement in [False, True]:
+        mask = with_replacement == replacement
+        if mask.any():
+            index[mask] = torch.multinomial(
+                prob[mask], num_sample, replacement=replacement, generator=generator
+            )
+    return index.sort(-1)[0]
+
+
 def grid_sampler(scale):
     """
     :param scale: voxelgrid gather the point info inside grids of "scale" size
@@ -25,13 +111,12 @@ def grid_sampler(scale):
         :param weights: Nx1 tensor
         :return:
         """
-        if weights == None:
+        if weights is None:
             weights = torch.ones(points.shape[0], 1).to(points.device)
-        index = grid_cluster(points, scale).long()
-        points = scatter(points * weights, index, dim=0)
-        cluster_weights = scatter(weights, index, dim=0)
-        points = points / cluster_weights
-        return points, cluster_weights, index
+        points, weights, _, index = _batch_grid_reduce(
+            points[None], weights.reshape(1, -1, 1), scale
+        )
+        return points[0], weights[0], index[0]
 
     return sampling
 
@@ -48,46 +133,12 @@ def uniform_sampler(num_sample, fixed_random_seed=True, sampled_by_weight=True):
         :param points:  NxD tensor
         :return:
         """
-        if fixed_random_seed:
-            np.random.seed(0)
         if weights is None:
             weights = torch.ones(points.shape[0], 1).to(points.device)
-        npoints = points.shape[0]
-        if sampled_by_weight:
-            weights_np = weights.squeeze().detach().cpu().numpy()
-            try:
-                rand_ind = np.random.choice(
-                    np.arange(npoints),
-                    num_sample,
-                    replace=False,
-                    p=weights_np / weights_np.sum(),
-                )
-            except:
-                print("failed to sample {} from {} points".format(num_sample, npoints))
-                rand_ind = np.random.choice(
-                    np.arange(npoints),
-                    num_sample,
-                    replace=True,
-                    p=weights_np / weights_np.sum(),
-                )
-        else:
-            try:
-                rand_ind = np.random.choice(
-                    np.arange(npoints), num_sample, replace=False
-                )
-            except:
-                #print("failed to sample {} from {} points".format(num_sample, npoints))
-                rand_ind = np.random.choice(
-                    np.arange(npoints), num_sample, replace=True
-                )
-        rand_ind.sort()
-        points = points[rand_ind]
-        rand_ind = torch.from_numpy(rand_ind).to(points.device)
-        if weights is not None:
-            weights = weights[rand_ind]
-            return points, weights, rand_ind
-        else:
-            return points, rand_ind
+        rand_ind = _batch_sample_index(
+            weights.reshape(1, -1), num_sample, fixed_random_seed, sampled_by_weight
+        )[0]
+        return points[rand_ind], weights[rand_ind], rand_ind
 
     return sampling
 
@@ -97,65 +148,24 @@ def point_grid_sampler(scale):
     :param scale: voxelgrid gather the point info inside grids of "scale" size
     :return:
     """
-    grid_point_sampler = grid_sampler(scale)
 
     def sampling(input_shape):
         from shapmagn.global_variable import Shape
 
-        nbatch = input_shape.nbatch
-        sampled_points_list = []
-        sampled_weights_list = []
-        sampled_pointfea_list = []
-        D = input_shape.points.shape[-1]
-        device = input_shape.points.device
-        for i in range(nbatch):
-            points = input_shape.points[i]
-            weights = input_shape.weights[i]
-            sampled_points, sampled_weights, index = grid_point_sampler(points, weights)
-            if input_shape.pointfea is not None:
-                sampled_pointfea = scatter(
-                    input_shape.pointfea[i] * weights, index, dim=0
-                )
-                sampled_pointfea = sampled_pointfea / sampled_weights
-                sampled_pointfea_list.append(sampled_pointfea)
-            sampled_points_list.append(sampled_points)
-            sampled_weights_list.append(sampled_weights)
-        max_len = max(
-            [sampled_points.shape[0] for sampled_points in sampled_points_list]
+        (
+            sampled_batch_points,
+            sampled_batch_weights,
+            sampled_batch_pointfea,
+            _,
+        ) = _batch_grid_reduce(
+            input_shape.points, input_shape.weights, scale, input_shape.pointfea
         )
-        cleaned_sampled_points_list, cleaned_sampled_weights_list = [], []
-        for sampled_points, sampled_weights in zip(
-            sampled_points_list, sampled_weights_list
-        ):
-            nsample = sampled_points.shape[0]
-            if nsample < max_len:
-                zeros_cat_points = torch.zeros(max_len - nsample, D, device=device)
-                zeros_cat_weights = torch.zeros(max_len - nsample, 1, device=device)
-                cleaned_sampled_points_list.append(
-                    torch.cat([sampled_points, zeros_cat_points], 0)
-                )
-                cleaned_sampled_weights_list.append(
-                    torch.cat([sampled_weights, zeros_cat_weights], 0)
-                )
-        sampled_batch_points = torch.stack(cleaned_sampled_points_list, dim=0)
-        sampled_batch_weights = torch.stack(cleaned_sampled_weights_list, dim=0)
         # todo for polyline and mesh, edges sampling are not supported
         new_shape = Shape()
         new_shape.set_data_with_refer_to(sampled_batch_points, input_shape)
         new_shape.set_weights(sampled_batch_weights)
         new_shape.set_scale(scale)
         if input_shape.pointfea is not None:
-            cleaned_sampled_pointfea_list = []
-            for sampled_pointfea in sampled_pointfea_list:
-                nsample, fea_dim = sampled_pointfea.shape[0], sampled_pointfea.shape[-1]
-                if nsample < max_len:
-                    zeros_cat_pointfea = torch.zeros(
-                        max_len - nsample, fea_dim, device=device
-                    )
-                    cleaned_sampled_pointfea_list.append(
-                        torch.cat([sampled_pointfea, zeros_cat_pointfea], 0)
-                    )
-            sampled_batch_pointfea = torch.stack(cleaned_sampled_pointfea_list, dim=0)
             new_shape.set_pointfea(sampled_batch_pointfea)
         return new_shape
 
@@ -169,45 +179,44 @@ def point_uniform_sampler(num_sample, fixed_random_seed=True, sampled_by_weight=
     :return:
     """
 
-    uniform_point_sampler = uniform_sampler(
-        num_sample, fixed_random_seed, sampled_by_weight
-    )
-
     def sampling(input_shape):
         from shapmagn.global_variable import Shape
 
-        nbatch = input_shape.nbatch
-        sampled_points_list = []
-        sampled_weights_list = []
-        sampled_pointfea_list = []
-        for i in range(nbatch):
-            points = input_shape.points[i]
-            weights = input_shape.weights[i]
-            sampled_points, sampled_weights, index = uniform_point_sampler(
-                points, weights
-            )
-            sampled_weights = sampled_weights
-            if input_shape.pointfea is not None:
-                sampled_pointfea = input_shape.pointfea[i][index]
-                sampled_pointfea_list.append(sampled_pointfea)
-            sampled_points_list.append(sampled_points)
-            sampled_weights_list.append(sampled_weights)
-        sampled_batch_points = torch.stack(sampled_points_list, dim=0)
-        sampled_batch_weights = torch.stack(sampled_weights_list, dim=0)
+        index = _batch_sample_index(
+            input_shape.weights[..., 0],
+            num_sample,
+            fixed_random_seed,
+            sampled_by_weight,
+        )
+        sampled_batch_points = gather_batch(input_shape.points, index)
+        sampled_batch_weights = gather_batch(input_shape.weights, index)
         # todo for polyline and mesh, edges sampling are not supported
         new_shape = Shape()
         new_shape.set_data_with_refer_to(sampled_batch_points, input_shape)
         new_shape.set_weights(sampled_batch_weights)
         new_shape.set_scale(num_sample)
         if input_shape.pointfea is not None:
-            sampled_batch_pointfea = torch.stack(sampled_pointfea_list, dim=0)
+            sampled_batch_pointfea = gather_batch(input_shape.pointfea, index)
             new_shape.set_pointfea(sampled_batch_pointfea)
         return new_shape
 
     return sampling
 
 
+def gather_batch(values, index):
+    """
+    :param values: BxNxd tensor
+    :param index: BxS long tensor
+    :return: BxSxd tensor
+    """
+    return torch.gather(
+        values, 1, index[..., None].expand(-1, -1, values.shape[-1])
+    )
+
+
 def point_fps_sampler(num_sample):
+    from pointnet2.lib.pointnet2_utils import furthest_point_sample
+
     fps_sampler = furthest_point_sample
 
     def sampling(input_shape):
@@ -235,34 +244,17 @@ def batch_grid_sampler(scale):
     :param scale: voxelgrid gather the point info inside grids of "scale" size
     :return:
     """
-    sampler = grid_sampler(scale)
 
     def sampling(points, weights=None):
-        points_list = []
-        weights_list = []
-        ind_list = []
-        if weights is not None:
-            for _points, _weights in zip(points, weights):
-                spoints, sweights, sind = sampler(points, weights)
-                points_list.append(spoints)
-                weights_list.append(sweights)
-                ind_list.append(sind)
-            return (
-                torch.stack(points_list, 0),
-                torch.stack(weights_list, 0),
-                torch.stack(ind_list, 0),
-            )
-        else:
-            for _points in zip(points):
-                spoints, sweights, sind = sampler(points)
-                points_list.append(spoints)
-                weights_list.append(sweights)
-                ind_list.append(sind)
-            return (
-                torch.stack(points_list, 0),
-                torch.stack(weights_list, 0),
-                torch.stack(ind_list, 0),
-            )
+        """
+        :param points: BxNxD tensor
+        :param weights: BxNx1 tensor
+        :return: points BxMxD, weights BxMx1, index BxN, zero padded to the max number of voxels M
+        """
+        if weights is None:
+            weights = torch.ones(points.shape[0], points.shape[1], 1).to(points.device)
+        points, weights, _, index = _batch_grid_reduce(points, weights, scale)
+        return points, weights, index
 
     return sampling
 
@@ -273,33 +265,18 @@ def batch_uniform_sampler(num_sample, fixed_random_seed=True, sampled_by_weight=
     :param rand_generator:
     :return:
     """
-    sampler = uniform_sampler(num_sample, fixed_random_seed, sampled_by_weight)
 
     def sampling(points, weights=None):
-        points_list = []
-        weights_list = []
-        ind_list = []
-        if weights is not None:
-            for _points, _weights in zip(points, weights):
-                spoints, sweights, sind = sampler(_points, _weights)
-                points_list.append(spoints)
-                weights_list.append(sweights)
-                ind_list.append(sind)
-            return (
-                torch.stack(points_list, 0),
-                torch.stack(weights_list, 0),
-                torch.stack(ind_list, 0),
-            )
-        else:
-            for _points in zip(points):
-                spoints, sweights, sind = sampler(_points)
-                points_list.append(spoints)
-                weights_list.append(sweights)
-                ind_list.append(sind)
-            return (
-                torch.stack(points_list, 0),
-                torch.stack(weights_list, 0),
-                torch.stack(ind_list, 0),
-            )
+        """
+        :param points: BxNxD tensor
+        :param weights: BxNx1 tensor
+        :return: points BxSxD, weights BxSx1, index BxS
+        """
+        if weights is None:
+            weights = torch.ones(points.shape[0], points.shape[1], 1).to(points.device)
+        index = _batch_sample_index(
+            weights[..., 0], num_sample, fixed_random_seed, sampled_by_weight
+        )
+        return gather_batch(points, index), gather_batch(weights, index), index
 
     return sampling
@@ -121,6 +121,13 @@ class ShapePair:
             self.control_weights = self.source.weights
         return self.control_points if not detach else self.control_points.detach()
 
+    def get_control_mask(self):
+        """
+        :return: BxNx1, 1 for the control points with a positive weight, 0 for the zero weight padding (e.g. of a ragged batch)
+        """
+        control_points = self.get_control_points()
+        return (self.control_weights > 0).to(control_points.dtype)
+
     def get_toflow_points(self, detach=False):
         return self.toflow.points if not detach else self.toflow.points.detach()
 
@@ -0,0 +1,86 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import pickle
+import torch
+import unittest
+from torch.utils.data import Dataset
+from shapmagn.datasets.data_manager import DataManager
+from shapmagn.utils.module_parameters import ParameterDict
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class RandomPairDataset(Dataset):
+    def __init__(self, num_pairs=16, npoints=200, D=3):
+        self.num_pairs = num_pairs
+        self.npoints = npoints
+        self.D = D
+
+    def __len__(self):
+        return self.num_pairs
+
+    def __getitem__(self, idx):
+        generator = torch.Generator().manual_seed(idx)
+        get_shape = lambda: {
+            "points": torch.rand(self.npoints, self.D, generator=generator),
+            "weights": torch.ones(self.npoints, 1) / self.npoints,
+        }
+        return {
+            "source": get_shape(),
+            "target": get_shape(),
+            "pair_name": "pair_{}".format(idx),
+            "source_info": {"name": "source_{}".format(idx)},
+            "target_info": {"name": "target_{}".format(idx)},
+            "index": idx,
+        }
+
+
+class Test_Data_Loader(unittest.TestCase):
+    def setUp(self):
+        self.phase = "val"
+        self.batch_size = 2
+        self.npoints = 64
+        self.prepare_input_obj = "hybird_data.HybirdData(synthsizer_obj='', npoints={})".format(
+            self.npoints
+        )
+        data_manager = DataManager()
+        data_manager.set_data_opt(ParameterDict())
+        data_manager.phases = [self.phase]
+        self.dataloaders = data_manager.init_dataset_loader(
+            {self.phase: RandomPairDataset()},
+            self.batch_size,
+            prepare_input_obj=self.prepare_input_obj,
+            device=torch.device("cpu"),
+        )
+
+    def tearDown(self):
+        pass
+
+    def test_prepare_input_in_workers(self):
+        dataloader = self.dataloaders[self.phase]
+        self.assertGreater(dataloader.num_workers, 0)
+        # what the "spawn" workers need to pickle
+        pickle.dumps(dataloader.worker_init_fn)
+        pickle.dumps(dataloader.collate_fn)
+        pickle.dumps(dataloader.dataset)
+        data = next(iter(dataloader))
+        self.assertEqual(
+            tuple(data["source"]["points"].shape), (self.batch_size, self.npoints, 3)
+        )
+        self.assertEqual(
+            tuple(data["target"]["weights"].shape), (self.batch_size, self.npoints, 1)
+        )
+        self.assertIn("prepared_batch_info", data)
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Data_Loader(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_prepare_input_in_workers")
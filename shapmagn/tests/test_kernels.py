@@ -6,6 +6,7 @@ from torch.autograd import grad
 import unittest
 from shapmagn.kernels.keops_kernels import LazyKeopsKernel
 from shapmagn.kernels.torch_kernels import TorchKernel
+from shapmagn.kernels.auto_kernels import AutoKernel
 
 torch.backends.cudnn.deterministic = True
 import pykeops
@@ -187,6 +188,65 @@ class Test_Kernels(unittest.TestCase):
         torch.testing.assert_allclose(keops_gauss, torch_gauss, rtol=1e-3, atol=1e-7)
         self.compare_tensors(keops_grads, torch_grads, rtol=1e-3, atol=1e-7)
 
+    def test_kernel_block_sparse(self, task_name="block_sparse"):
+        kernel_settings = [
+            ("gauss", dict(sigma=0.05), (self.x, self.y, self.b)),
+            (
+                "multi_gauss",
+                dict(sigma_list=[0.02, 0.05], weight_list=[0.4, 0.6]),
+                (self.x, self.y, self.b),
+            ),
+            ("gauss_grad", dict(sigma=0.05), (self.px, self.x, self.py, self.y)),
+            (
+                "gauss_lin",
+                dict(sigma=0.05),
+                (self.x, self.y, self.px, self.py, self.b),
+            ),
+        ]
+        for kernel_type, kernel_args, inputs in kernel_settings:
+            dense_kernel = LazyKeopsKernel(kernel_type=kernel_type, **kernel_args)
+            sparse_kernel = LazyKeopsKernel(
+                kernel_type=kernel_type, truncate_sigma=5.0, **kernel_args
+            )
+            sparse_kernel = timming(
+                sparse_kernel, "test_kernel_{} {}".format(task_name, kernel_type)
+            )
+            dense_res = dense_kernel(*inputs)
+            sparse_res = sparse_kernel(*inputs)
+            dense_grads = grad(dense_res.mean(), inputs, retain_graph=True)
+            sparse_grads = grad(sparse_res.mean(), inputs, retain_graph=True)
+            torch.testing.assert_allclose(sparse_res, dense_res, rtol=1e-3, atol=1e-6)
+            self.compare_tensors(sparse_grads, dense_grads, rtol=1e-3, atol=1e-6)
+
+    def test_kernel_chunked_dense(self, task_name="chunked_dense"):
+        kernel_settings = [
+            ("gauss", dict(sigma=0.1), (self.x, self.y, self.b)),
+            ("gauss_grad", dict(sigma=0.1), (self.px, self.x, self.py, self.y)),
+            (
+                "gauss_lin",
+                dict(sigma=0.1),
+                (self.x, self.y, self.px, self.py, self.b),
+            ),
+        ]
+        for kernel_type, kernel_args, inputs in kernel_settings:
+            torch_kernel = TorchKernel(kernel_type=kernel_type, **kernel_args)
+            # a small budget to split the 1000 rows into several chunks
+            chunked_kernel = AutoKernel(
+                kernel_type=kernel_type,
+                backend="chunked",
+                max_chunk_bytes=2 ** 20,
+                **kernel_args
+            )
+            chunked_kernel = timming(
+                chunked_kernel, "test_kernel_{} {}".format(task_name, kernel_type)
+            )
+            dense_res = torch_kernel(*inputs)
+            chunked_res = chunked_kernel(*inputs)
+            dense_grads = grad(dense_res.mean(), inputs, retain_graph=True)
+            chunked_grads = grad(chunked_res.mean(), inputs, retain_graph=True)
+            torch.testing.assert_allclose(chunked_res, dense_res, rtol=1e-5, atol=1e-7)
+            self.compare_tensors(chunked_grads, dense_grads, rtol=1e-4, atol=1e-7)
+
 
 def run_by_name(test_name):
     suite = unittest.TestSuite()
@@ -201,3 +261,5 @@ if __name__ == "__main__":
     run_by_name("test_kernel_gaussian_grad")
     run_by_name("test_kernel_multi_gaussian_grad")
     run_by_name("test_kernel_gaussian_lin")
+    run_by_name("test_kernel_block_sparse")
+    run_by_name("test_kernel_chunked_dense")
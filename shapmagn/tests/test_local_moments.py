@@ -0,0 +1,52 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+import unittest
+from shapmagn.utils.local_feature_extractor import (
+    compute_local_moments,
+    compute_aniso_local_moments,
+    compute_anisotropic_gamma_from_points,
+    check_truncated_local_moments,
+)
+
+torch.manual_seed(123)
+
+
+class Test_Local_Moments(unittest.TestCase):
+    def setUp(self):
+        B = 2
+        N = 3000
+        D = 3
+        device = torch.device("cpu")  # cuda:0, cpu
+        self.points = torch.rand(B, N, D, device=device)
+
+    def tearDown(self):
+        pass
+
+    def compare_tensors(self, tensors1, tensors2, rtol=1e-3, atol=1e-5):
+        for tensor1, tensor2 in zip(tensors1, tensors2):
+            torch.testing.assert_allclose(tensor1, tensor2, rtol=rtol, atol=atol)
+
+    def test_truncated_local_moments(self):
+        dense = compute_local_moments(self.points, radius=0.02)
+        truncated = compute_local_moments(self.points, radius=0.02, truncate_sigma=5.0)
+        self.compare_tensors(dense, truncated)
+        within_tol, _ = check_truncated_local_moments(
+            self.points, radius=0.02, truncate_sigma=5.0, rtol=1e-3
+        )
+        self.assertTrue(within_tol)
+
+    def test_truncated_aniso_local_moments(self):
+        gamma = compute_anisotropic_gamma_from_points(
+            self.points, cov_sigma_scale=0.02, aniso_kernel_scale=0.03
+        )
+        dense = compute_aniso_local_moments(self.points, gamma)
+        truncated = compute_aniso_local_moments(
+            self.points, gamma, truncate_sigma=5.0
+        )
+        self.compare_tensors(dense, truncated)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import os, sys
+
+sys.path.insert(0, os.path.abspath("../.."))
+import torch
+import unittest
+from shapmagn.datasets.data_utils import ragged_shape_pair_collate
+from shapmagn.shape.point_sampler import _batch_grid_reduce
+from shapmagn.shape.shape_pair_utils import create_shape_pair_from_data_dict
+from shapmagn.models_reg.model_lddmm import LDDMMOPT
+from shapmagn.utils.module_parameters import ParameterDict
+
+torch.backends.cudnn.deterministic = True
+torch.manual_seed(123)
+
+
+class Test_Ragged_Batch(unittest.TestCase):
+    def setUp(self):
+        D = 3
+        self.npoints_list = [200, 300]
+        self.samples = []
+        for i, npoints in enumerate(self.npoints_list):
+            self.samples.append(
+                {
+                    "source": {
+                        "points": torch.rand(npoints, D),
+                        "weights": torch.ones(npoints, 1) / npoints,
+                    },
+                    "target": {
+                        "points": torch.rand(npoints, D),
+                        "weights": torch.ones(npoints, 1) / npoints,
+                    },
+                    "pair_name": "pair_{}".format(i),
+                }
+            )
+        self.momentum_list = [
+            torch.rand(npoints, D) * 0.1 - 0.05 for npoints in self.npoints_list
+        ]
+
+    def tearDown(self):
+        pass
+
+    def get_padded_pair(self):
+        samples = [
+            {
+                key: dict(item) if isinstance(item, dict) else item
+                for key, item in sample.items()
+            }
+            for sample in self.samples
+        ]
+        shape_pair = create_shape_pair_from_data_dict()(ragged_shape_pair_collate(samples))
+        max_len = max(self.npoints_list)
+        # the padded momentum is set on purpose, it should not take effect
+        momentum = torch.rand(len(samples), max_len, 3)
+        for i, npoints in enumerate(self.npoints_list):
+            momentum[i, :npoints] = self.momentum_list[i]
+        shape_pair.reg_param = momentum
+        return shape_pair
+
+    def get_single_pair(self, index):
+        sample = self.samples[index]
+        data_dict = {
+            "source": {key: item[None] for key, item in sample["source"].items()},
+            "target": {key: item[None] for key, item in sample["target"].items()},
+        }
+        shape_pair = create_shape_pair_from_data_dict()(data_dict)
+        shape_pair.reg_param = self.momentum_list[index][None]
+        return shape_pair
+
+    def test_grid_reduce(self):
+        shape_pair = self.get_padded_pair()
+        points, weights, _, _ = _batch_grid_reduce(
+            shape_pair.source.points, shape_pair.source.weights, 0.1
+        )
+        self.assertFalse(torch.isnan(points).any())
+        for i in range(len(self.npoints_list)):
+            single_pair = self.get_single_pair(i)
+            single_points, single_weights, _, _ = _batch_grid_reduce(
+                single_pair.source.points, single_pair.source.weights, 0.1
+            )
+            mask = weights[i, :, 0] > 0
+            torch.testing.assert_allclose(points[i][mask], single_points[0])
+            torch.testing.assert_allclose(weights[i][mask], single_weights[0])
+
+    def test_lddmm_padded_pair(self):
+        opt = ParameterDict()
+        opt["module"] = "hamiltonian"
+        opt[("hamiltonian", {}, "settings for hamiltonian")]
+        opt["hamiltonian"]["kernel"] = "torch_kernels.TorchKernel('gauss',sigma=0.1)"
+        # a fixed step solver, the adaptive steps would depend on the padded points
+        opt[("integrator", {}, "settings for integrator")]
+        opt["integrator"]["solver"] = "rk4"
+        opt["integrator"]["adjoin_on"] = False
+        model = LDDMMOPT(opt)
+        shape_pair = self.get_padded_pair()
+        shape_pair = model.integrate_flow(shape_pair)
+        reg_loss = model.geodesic_distance(
+            shape_pair.reg_param,
+            shape_pair.get_control_points(),
+            shape_pair.get_control_mask(),
+        )
+        for i, npoints in enumerate(self.npoints_list):
+            single_pair = self.get_single_pair(i)
+            single_pair = model.integrate_flow(single_pair)
+            single_reg_loss = model.geodesic_distance(
+                single_pair.reg_param, single_pair.get_control_points()
+            )
+            torch.testing.assert_allclose(
+                shape_pair.flowed.points[i, :npoints],
+                single_pair.flowed.points[0],
+                rtol=1e-4,
+                atol=1e-6,
+            )
+            torch.testing.assert_allclose(
+                reg_loss[i], single_reg_loss[0], rtol=1e-4, atol=1e-8
+            )
+
+
+def run_by_name(test_name):
+    suite = unittest.TestSuite()
+    suite.addTest(Test_Ragged_Batch(test_name))
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
+
+
+if __name__ == "__main__":
+    run_by_name("test_grid_reduce")
+    run_by_name("test_lddmm_padded_pair")
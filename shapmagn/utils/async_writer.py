@@ -0,0 +1,117 @@
+"""
+background writer for the result files (vtk, npy, ...) saved during the registration/evaluation
+
+the caller snapshots the tensors into cpu numpy arrays and submits the write job, the jobs are
+executed by a pool of threads fed by a bounded queue, a submission blocks once the queue is full,
+so a slow disk slows down the loop instead of accumulating the snapshots in memory.
+the writer is disabled by default, i.e. the jobs are executed synchronously by the caller
+"""
+import atexit
+import queue
+import threading
+import traceback
+
+_STOP = object()
+
+
+class AsyncWriter(object):
+    def __init__(self, num_workers=2, max_queue_size=16):
+        """
+        :param num_workers: int, number of writing threads
+        :param max_queue_size: int, max number of pending jobs, the submission blocks once it's reached
+        """
+        self.num_workers = num_workers
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.errors = []
+        self.workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(
+                target=self._run, name="async_writer_{}".format(i), daemon=True
+            )
+            worker.start()
+            self.workers.append(worker)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is _STOP:
+                    return
+                fn, args, kwargs = job
+                fn(*args, **kwargs)
+            except Exception as e:
+                traceback.print_exc()
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        the arguments should not be modified by the caller afterwards, i.e. pass snapshots
+        """
+        self.queue.put((fn, args, kwargs))
+
+    def flush(self):
+        """
+        wait until all the submitted jobs are written, raise the first error that happened meanwhile
+        """
+        self.queue.join()
+        if self.errors:
+            error, self.errors = self.errors[0], []
+            raise RuntimeError("failed to write the files in the background") from error
+
+    def shutdown(self):
+        self.queue.join()
+        for _ in self.workers:
+            self.queue.put(_STOP)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+
+_writer = None
+_lock = threading.Lock()
+
+
+def enable_async_writer(num_workers=2, max_queue_size=16):
+    """
+    start the module level writer, num_workers=0 disables it
+    """
+    global _writer
+    disable_async_writer()
+    if num_workers > 0:
+        with _lock:
+            _writer = AsyncWriter(num_workers, max_queue_size)
+
+
+def disable_async_writer():
+    """
+    flush and stop the module level writer
+    """
+    global _writer
+    with _lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.shutdown()
+        if writer.errors:
+            print("{} background writes failed".format(len(writer.errors)))
+
+
+def flush_async_writer():
+    writer = _writer
+    if writer is not None:
+        writer.flush()
+
+
+def submit_write(fn, *args, **kwargs):
+    """
+    run the write job in the background if the writer is enabled, otherwise run it now
+    """
+    writer = _writer
+    if writer is None:
+        fn(*args, **kwargs)
+    else:
+        writer.submit(fn, *args, **kwargs)
+
+
+atexit.register(disable_async_writer)
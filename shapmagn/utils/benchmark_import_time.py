@@ -0,0 +1,115 @@
+"""
+benchmark the import time of the shapmagn entry modules
+
+each import is timed in a fresh interpreter, so nothing is shared through sys.modules,
+with --detail the slowest modules reported by "python -X importtime" are listed as well
+
+python benchmark_import_time.py
+python benchmark_import_time.py -m shapmagn.global_variable shapmagn.pipeline.run_pipeline -r 5 --detail
+"""
+import os
+import sys
+import subprocess
+import statistics
+
+DEFAULT_MODULES = [
+    "shapmagn.utils.obj_factory",
+    "shapmagn.global_variable",
+    "shapmagn.shape.shape_pair_utils",
+    "shapmagn.models_reg.model_prealign",
+    "shapmagn.pipeline.run_pipeline",
+]
+
+TIMING_CODE = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def _run(args):
+    root_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root_path] + ([env["PYTHONPATH"]] if "PYTHONPATH" in env else [])
+    )
+    return subprocess.run(
+        [sys.executable] + args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+
+
+def time_import(module, repeat=3):
+    """
+    :param module: str, module path
+    :param repeat: int, number of fresh interpreters
+    :return: list of the import time (s), None if the import failed
+    """
+    times = []
+    for _ in range(repeat):
+        res = _run(["-c", TIMING_CODE.format(module=module)])
+        if res.returncode != 0:
+            print(
+                "failed to import {}:\n{}".format(
+                    module, res.stderr.decode().strip().splitlines()[-1]
+                )
+            )
+            return None
+        times.append(float(res.stdout.decode().strip().splitlines()[-1]))
+    return times
+
+
+def slowest_imports(module, top_k=10):
+    """
+    :param module: str, module path
+    :param top_k: int
+    :return: list of (cumulative time (s), imported module), sorted from the slowest
+    """
+    res = _run(["-X", "importtime", "-c", "import {}".format(module)])
+    records = []
+    for line in res.stderr.decode().splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:") :].split("|")
+        try:
+            cumulative = int(fields[1]) * 1e-6
+        except ValueError:
+            continue
+        records.append((cumulative, fields[2].strip()))
+    return sorted(records, reverse=True)[:top_k]
+
+
+def benchmark(modules=None, repeat=3, detail=False):
+    modules = modules if modules is not None else DEFAULT_MODULES
+    results = {}
+    for module in modules:
+        times = time_import(module, repeat)
+        if times is None:
+            continue
+        results[module] = times
+        print(
+            "{:<45s} median {:.3f}s, min {:.3f}s".format(
+                module, statistics.median(times), min(times)
+            )
+        )
+        if detail:
+            for cumulative, imported in slowest_imports(module):
+                print("    {:>8.3f}s  {}".format(cumulative, imported))
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="benchmark the import time")
+    parser.add_argument(
+        "-m", "--modules", nargs="+", default=None, help="modules to be imported"
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="number of fresh interpreters"
+    )
+    parser.add_argument(
+        "--detail", action="store_true", help="list the slowest nested imports"
+    )
+    args = parser.parse_args()
+    benchmark(args.modules, args.repeat, args.detail)
@@ -0,0 +1,77 @@
+"""
+multi-process (DistributedDataParallel) training helpers
+
+each process trains a replica of the network on its own shard of the training set,
+the gradients are averaged by DistributedDataParallel, the checkpoints and the logs are written by the rank 0 only.
+the process group is set from the env variables (MASTER_ADDR, MASTER_PORT, RANK, WORLD_SIZE, LOCAL_RANK),
+set either by run_task.py (--nproc_per_node) or by an external launcher (e.g. torch.distributed.launch --use_env).
+the gloo backend works on cpu nodes, nccl should be preferred on gpu nodes
+"""
+import os
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend="gloo"):
+    """
+    :param backend: str, gloo/nccl
+    :return: None
+    """
+    if is_distributed():
+        return
+    dist.init_process_group(backend=backend, init_method="env://")
+    print(
+        "=> process {}/{} joined the {} process group".format(
+            get_rank(), get_world_size(), backend
+        )
+    )
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def get_local_rank():
+    return int(os.environ.get("LOCAL_RANK", 0)) if is_distributed() else 0
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def set_distributed_device(gpus=None):
+    """
+    each process takes the gpu of its local rank
+
+    :param gpus: int or list of int, the gpu ids of the node, all the available gpus by default,
+        a single id is shared by all the processes of the node
+    :return: torch.device, list of gpu ids of the process (None on cpu)
+    """
+    if not torch.cuda.is_available():
+        print("=> process {} uses the CPU device".format(get_rank()))
+        return torch.device("cpu"), None
+    if isinstance(gpus, int):
+        gpus = [gpus]
+    gpus = list(range(torch.cuda.device_count())) if not gpus else gpus
+    gpu = gpus[get_local_rank() % len(gpus)]
+    torch.cuda.set_device(gpu)
+    print("=> process {} uses the GPU device {}".format(get_rank(), gpu))
+    return torch.device("cuda:{}".format(gpu)), [gpu]
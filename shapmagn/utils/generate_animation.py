@@ -89,6 +89,34 @@ class FlowModel(nn.Module):
         self.integrator_opt = lddmm_opt[("integrator", {}, "settings for integrator")]
         self.integrator = ODEBlock(self.integrator_opt)
         self.integrator.set_func(self.lddmm_module)
+        self.cache_trajectory = lddmm_opt[
+            (
+                "cache_trajectory",
+                False,
+                "shoot once and flow the frames of t_list along the recorded trajectory",
+            )
+        ]
+
+    def lddmm_trajectory_interp(self, shape_pair, momentum):
+        from shapmagn.modules_reg.module_lddmm import LDDMMTrajectory
+
+        toflow = shape_pair.source
+        flow_points = (
+            shape_pair.control_points if shape_pair.dense_mode else toflow.points
+        )
+        with torch.no_grad():
+            self.lddmm_module.set_mode("shooting")
+            times, (momentum_list, control_points_list) = self.integrator.solve_trajectory(
+                (momentum, shape_pair.control_points)
+            )
+            trajectory = LDDMMTrajectory(times, momentum_list, control_points_list)
+            flowed_points_list = trajectory.flow(
+                self.lddmm_module.velocity, flow_points, self.t_list
+            )
+        return [
+            Shape().set_data_with_refer_to(flowed_points, toflow)
+            for flowed_points in flowed_points_list
+        ]
 
     def lddmm_interp(self, shape_pair):
         toflow = shape_pair.source
@@ -97,6 +125,8 @@ class FlowModel(nn.Module):
         momentum = momentum.clamp(
             -0.5, 0.5
         )  # todo  this is a temporal setting for data normalized into [0,1] should be set in class attribute
+        if self.cache_trajectory:
+            return self.lddmm_trajectory_interp(shape_pair, momentum)
         if shape_pair.dense_mode:
             self.lddmm_module.set_mode("shooting")
             _, flowed_control_points_list = self.integrator.solve(
@@ -0,0 +1,86 @@
+"""
+cache of the self knn graph of (static) point clouds, e.g. the source/target in CurvatureReg or the
+grouping layers of PointConv, which query the neighbors of the same points at every step
+
+an entry is keyed by the storage of the tensor (data pointer, shape, stride, dtype, device),
+no content hashing is involved, so a lookup is O(1) even on the gpu. the entry keeps a weak reference
+to the (base) tensor and its version counter, so it's invalidated once the tensor is modified in place,
+and evicted once the tensor is freed. the graph is computed with a K-superset, queries with a smaller K are served
+from the prefix of the cached index (the neighbors are sorted by distance)
+"""
+import weakref
+import torch
+from shapmagn.utils.tensor_cache import TensorCache
+
+
+def get_storage_key(tensor):
+    return (
+        tensor.data_ptr(),
+        tuple(tensor.shape),
+        tuple(tensor.stride()),
+        tensor.dtype,
+        tensor.device,
+    )
+
+
+class KNNGraphCache(TensorCache):
+    """
+    LRU cache of the self knn index, keyed by (tensor storage, settings)
+    """
+
+    def __init__(
+        self,
+        k_superset=16,
+        max_bytes=256 * 1024 ** 2,
+        max_items=64,
+        name="knn_graph_cache",
+    ):
+        """
+        :param k_superset: int, the graph is computed with max(K, k_superset) neighbors
+        :param max_bytes: int, byte budget of the cached index
+        :param max_items: int, max number of the cached graphs
+        :param name: str, used in the report
+        """
+        super(KNNGraphCache, self).__init__(max_bytes, max_items, name)
+        self.k_superset = k_superset
+
+    def _evict_freed(self, key, ref):
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None and entry[0][0] is ref:
+                del self._entries[key]
+                self.cur_bytes -= entry[1]
+                self.evictions += 1
+
+    def self_knn(self, points, K, knn_fn, settings=()):
+        """
+        :param points: torch.Tensor, BxNxD
+        :param K: int, number of the neighbors
+        :param knn_fn: callable, (points, K) -> BxNxK index sorted by distance
+        :param settings: hashable, settings of knn_fn, e.g. the metric
+        :return: BxNxK index
+        """
+        base = points._base if points._base is not None else points
+        key = (get_storage_key(points), settings)
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                ref, version, index = entry[0]
+                if (
+                    ref() is base
+                    and points._version == version
+                    and index.shape[-1] >= K
+                ):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return index if index.shape[-1] == K else index[..., :K].contiguous()
+            self.misses += 1
+        K_superset = min(max(K, self.k_superset), points.shape[1])
+        with torch.no_grad():
+            index = knn_fn(points, K_superset)
+        ref = weakref.ref(base, lambda _ref, _key=key: self._evict_freed(_key, _ref))
+        self.put(key, (ref, points._version, index))
+        return index if K_superset == K else index[..., :K].contiguous()
+
+
+KNN_GRAPH_CACHE = KNNGraphCache()
@@ -1,7 +1,11 @@
 from pykeops.torch import LazyTensor
 
 from shapmagn.utils.obj_factory import obj_factory
-from shapmagn.utils.local_feature_extractor import compute_anisotropic_gamma_from_points
+from shapmagn.utils.local_feature_extractor import (
+    compute_anisotropic_gamma_from_points,
+    cached_anisotropic_gamma_from_points,
+)
+from shapmagn.utils.knn_graph_cache import KNN_GRAPH_CACHE
 from functools import partial
 
 def NN(return_value=True, return_pos=False):
@@ -23,14 +27,31 @@ def NN(return_value=True, return_pos=False):
             return dist2.argmin(dim=2).long().view(B, N, 1)
     return compute
 
-def KNN(return_value=True):
+def knn_index(pc1, pc2, K):
+    pc_i = LazyTensor(pc1[:, :, None])
+    pc_j = LazyTensor(pc2[:, None])
+    dist2 = pc_i.sqdist(pc_j)
+    return dist2.argKmin(K, dim=2)
+
+
+def KNN(return_value=True, use_graph_cache=False, knn_graph_cache=None):
+    """
+    :param return_value: bool, return the distance to the neighbors as well
+    :param use_graph_cache: bool, the self query (pc1 is pc2) is served from the knn graph cache,
+        which saves the neighbor search on static points, e.g. the source over iterations
+    :param knn_graph_cache: KNNGraphCache, default is the module level KNN_GRAPH_CACHE
+    """
+    knn_graph_cache = knn_graph_cache if knn_graph_cache is not None else KNN_GRAPH_CACHE
+
     def compute(pc1, pc2, K):
         from shapmagn.modules_reg.networks.pointconv_util import index_points_group
         B, N = pc1.shape[0], pc1.shape[1]
-        pc_i = LazyTensor(pc1[:, :, None])
-        pc_j = LazyTensor(pc2[:, None])
-        dist2 = pc_i.sqdist(pc_j)
-        index = dist2.argKmin(K, dim=2)
+        if use_graph_cache and pc1 is pc2:
+            index = knn_graph_cache.self_knn(
+                pc1, K, lambda points, K: knn_index(points, points, K), ("sqdist",)
+            )
+        else:
+            index = knn_index(pc1, pc2, K)
         if return_value:
             Kmin_pc3 = index_points_group(pc2, index)
             K_min = (pc1.unsqueeze(2) - Kmin_pc3).norm(p=2, dim=3)
@@ -52,9 +73,13 @@ def AnisoKNN(
     mass_thres=2.5,
     return_value=True,
     self_center=False,
+    truncate_sigma=None,
+    use_gamma_cache=True,
 ):
     compute_gamma = partial(
-        compute_anisotropic_gamma_from_points,
+        cached_anisotropic_gamma_from_points
+        if use_gamma_cache
+        else compute_anisotropic_gamma_from_points,
         cov_sigma_scale=cov_sigma_scale,
         aniso_kernel_scale=aniso_kernel_scale,
         principle_weight=principle_weight,
@@ -62,6 +87,7 @@ def AnisoKNN(
         iter_twice=iter_twice,
         leaf_decay=leaf_decay,
         mass_thres=mass_thres,
+        truncate_sigma=truncate_sigma,
     )
 
     def compute(pc1, pc2, K):
@@ -1,9 +1,12 @@
 import math
+import time
 import numpy as np
 import torch
 from pykeops.torch import LazyTensor
 from shapmagn.utils.compute_2d_eigen import compute_2d_eigen
 from shapmagn.utils.obj_factory import partial_obj_factory
+from shapmagn.utils.voxel_hash_utils import build_truncated_ranges
+from shapmagn.utils.tensor_cache import TensorCache
 from shapmagn.utils.visualizer import (
     visualize_point_fea,
     visualize_point_fea_with_arrow,
@@ -19,7 +22,61 @@ def numpy(x):
     return x.detach().cpu().numpy()
 
 
-def compute_local_moments(points, radius=1.0):
+def _truncated_moment_descriptors(x, truncate_sigma, gamma=None):
+    """
+    block-sparse counterpart of the dense moment reduction, the points are voxel-hashed
+    and only the voxel pairs within truncate_sigma kernel widths are visited
+
+    :param x: BxNx(D+1) tensor, the (normalized) points with a leading one channel
+    :param truncate_sigma: float, interactions farther than truncate_sigma*sigma are dropped
+    :param gamma: optional BxNxDxD tensor, anisotropic inverse kernel of each point
+    :return: BxNx(D+1)x(D+1) tensor, descriptors of order 0, 1 and 2
+    """
+    shape_head, D1 = x.shape[:-1], x.shape[-1]
+    x = x.reshape(-1, shape_head[-1], D1)
+    if gamma is None:
+        # in the normalized space, the kernel exp(-d^2/2) has unit sigma
+        sigma_list = [1.0] * x.shape[0]
+    else:
+        gamma = gamma.reshape(x.shape[0], x.shape[1], D1 - 1, D1 - 1)
+        # exp(-d^T Gamma d) <= exp(-eigen_min*d^2), i.e. the widest sigma is sqrt(1/(2*eigen_min))
+        eigenvalue = compute_local_fea_from_moments(
+            "eigenvalue", None, None, None, gamma.detach()
+        )
+        eigen_min = eigenvalue.min(-1)[0].view(x.shape[0], -1).min(1)[0]
+        sigma_list = (0.5 / eigen_min.clamp(min=1e-12)).sqrt().tolist()
+        gamma = gamma.reshape(x.shape[0], x.shape[1], -1)
+    C_list = []
+    for b in range(x.shape[0]):
+        x_order, _, ranges_ij = build_truncated_ranges(
+            x[b, :, 1:], x[b, :, 1:], truncate_sigma * sigma_list[b]
+        )
+        xb = x[b][x_order]
+        xp_i = LazyTensor(xb[:, None, 1:])  # (N, 1, D)
+        xp_j = LazyTensor(xb[None, :, 1:])  # (1, N, D)
+        if gamma is None:
+            K_ij = (-xp_i.sqdist(xp_j) / 2).exp()  # (N, N)
+        else:
+            gamma_j = LazyTensor(gamma[b][x_order][None])  # 1xNxD*D
+            K_ij = (-((xp_i - xp_j) | gamma_j.matvecmult(xp_i - xp_j))).exp()
+        x_j = LazyTensor(xb[None])  # (1, N, D+1)
+        C_ij = (K_ij * x_j).tensorprod(x_j)  # (N, N, (D+1)*(D+1))
+        C_ij.ranges = ranges_ij
+        C_sorted = C_ij.sum(dim=1)
+        C = torch.empty_like(C_sorted)
+        C[x_order] = C_sorted
+        C_list.append(C)
+    return torch.stack(C_list, 0).view(shape_head + (D1, D1))
+
+
+def compute_local_moments(points, radius=1.0, truncate_sigma=None):
+    """
+    :param points: BxNxD tensor
+    :param radius: float, kernel radius
+    :param truncate_sigma: optional float, if set, interactions farther than truncate_sigma kernel widths are dropped,
+     which turns the quadratic reduction into a voxel-hash based, roughly linear one
+    :return: mass: BxNx1, dev: BxNxD, cov: BxNxDxD
+    """
     # B, N, D = points.shape
     shape_head, D = points.shape[:-1], points.shape[-1]
 
@@ -28,16 +85,19 @@ def compute_local_moments(points, radius=1.0):
     # Computation:
     x = torch.cat((torch.ones_like(x[..., :1]), x), dim=-1)  # (B, N, D+1)
 
-    x_i = LazyTensor(x[..., :, None, :])  # (B, N, 1, D+1)
-    x_j = LazyTensor(x[..., None, :, :])  # (B, 1, N, D+1)
+    if truncate_sigma is None:
+        x_i = LazyTensor(x[..., :, None, :])  # (B, N, 1, D+1)
+        x_j = LazyTensor(x[..., None, :, :])  # (B, 1, N, D+1)
 
-    D_ij = ((x_i - x_j) ** 2).sum(-1)  # (B, N, N), squared distances
-    K_ij = (-D_ij / 2).exp()  # (B, N, N), Gaussian kernel
+        D_ij = ((x_i - x_j) ** 2).sum(-1)  # (B, N, N), squared distances
+        K_ij = (-D_ij / 2).exp()  # (B, N, N), Gaussian kernel
 
-    C_ij = (K_ij * x_j).tensorprod(x_j)  # (B, N, N, (D+1)*(D+1))
-    C_i = C_ij.sum(dim=len(shape_head)).view(
-        shape_head + (D + 1, D + 1)
-    )  # (B, N, D+1, D+1) : descriptors of order 0, 1 and 2
+        C_ij = (K_ij * x_j).tensorprod(x_j)  # (B, N, N, (D+1)*(D+1))
+        C_i = C_ij.sum(dim=len(shape_head)).view(
+            shape_head + (D + 1, D + 1)
+        )  # (B, N, D+1, D+1) : descriptors of order 0, 1 and 2
+    else:
+        C_i = _truncated_moment_descriptors(x, truncate_sigma)
 
     w_i = C_i[..., :1, :1]  # (B, N, 1, 1), weights
     m_i = C_i[..., :1, 1:] * scale  # (B, N, 1, D), sum
@@ -50,27 +110,37 @@ def compute_local_moments(points, radius=1.0):
     return mass_i, dev_i, cov_i
 
 
-def compute_aniso_local_moments(points, gamma=None):
+def compute_aniso_local_moments(points, gamma=None, truncate_sigma=None):
+    """
+    :param points: BxNxD tensor
+    :param gamma: BxNxDxD tensor, anisotropic inverse kernel of each point
+    :param truncate_sigma: optional float, if set, interactions farther than truncate_sigma times the widest kernel sigma are dropped
+    :return: mass: BxNx1, dev: BxNxD, cov: BxNxDxD
+    """
     # B, N, D = points.shape
     shape_head, D = points.shape[:-1], points.shape[-1]
 
     x = points  # Normalize the kernel size
-    # Computation:
-    xp_i = LazyTensor(x[..., :, None, :])
-    xp_j = LazyTensor(x[..., None, :, :])
-    gamma = LazyTensor(
-        gamma.view(gamma.shape[0], gamma.shape[1], -1)[:, None]
-    )  # Bx1xMxD*D
-    dist2 = (xp_i - xp_j) | gamma.matvecmult(xp_i - xp_j)
-    # dist2 = xp_i.weightedsqdist(xp_j, gamma)
-    K_ij = (-dist2).exp()  # BxNxN
-
-    x = torch.cat((torch.ones_like(x[..., :1]), x), dim=-1)  # (B, N, D+1)
-    x_j = LazyTensor(x[..., None, :, :])  # (B, 1, N, D+1)
-
-    C_ij = (K_ij * x_j).tensorprod(x_j)  # (B, N, N, (D+1)*(D+1))
-    # if  dim= 1,  self-centered mode  if set dim=2, then is the interpolate mode
-    C_i = C_ij.sum(dim=2).view(shape_head + (D + 1, D + 1))  # (B, N, D+1, D+1)
+    if truncate_sigma is None:
+        # Computation:
+        xp_i = LazyTensor(x[..., :, None, :])
+        xp_j = LazyTensor(x[..., None, :, :])
+        gamma = LazyTensor(
+            gamma.view(gamma.shape[0], gamma.shape[1], -1)[:, None]
+        )  # Bx1xMxD*D
+        dist2 = (xp_i - xp_j) | gamma.matvecmult(xp_i - xp_j)
+        # dist2 = xp_i.weightedsqdist(xp_j, gamma)
+        K_ij = (-dist2).exp()  # BxNxN
+
+        x = torch.cat((torch.ones_like(x[..., :1]), x), dim=-1)  # (B, N, D+1)
+        x_j = LazyTensor(x[..., None, :, :])  # (B, 1, N, D+1)
+
+        C_ij = (K_ij * x_j).tensorprod(x_j)  # (B, N, N, (D+1)*(D+1))
+        # if  dim= 1,  self-centered mode  if set dim=2, then is the interpolate mode
+        C_i = C_ij.sum(dim=2).view(shape_head + (D + 1, D + 1))  # (B, N, D+1, D+1)
+    else:
+        x = torch.cat((torch.ones_like(x[..., :1]), x), dim=-1)  # (B, N, D+1)
+        C_i = _truncated_moment_descriptors(x, truncate_sigma, gamma=gamma)
 
     w_i = C_i[..., :1, :1]  # (B, N, 1, 1), weights
     m_i = C_i[..., :1, 1:]  # (B, N, 1, D), sum
@@ -83,6 +153,48 @@ def compute_aniso_local_moments(points, gamma=None):
     return mass_i, dev_i, cov_i
 
 
+def check_truncated_local_moments(
+    points, radius=1.0, gamma=None, truncate_sigma=4.0, rtol=1e-3
+):
+    """
+    compare the truncated local moments with the dense ones and report the speedup
+
+    :param points: BxNxD tensor
+    :param radius: float, kernel radius of the isotropic moments, disabled if gamma is given
+    :param gamma: optional BxNxDxD tensor, anisotropic inverse kernel
+    :param truncate_sigma: float, truncation in kernel widths
+    :param rtol: float, tolerance on the max error (relative to the max magnitude) of the mass, dev and cov
+    :return: bool, whether the truncated moments are within the tolerance, float, speedup over the dense path
+    """
+
+    def _timed(**kwargs):
+        if points.is_cuda:
+            torch.cuda.synchronize()
+        start = time.time()
+        if gamma is None:
+            res = compute_local_moments(points, radius=radius, **kwargs)
+        else:
+            res = compute_aniso_local_moments(points, gamma=gamma, **kwargs)
+        if points.is_cuda:
+            torch.cuda.synchronize()
+        return res, time.time() - start
+
+    dense_moments, dense_t = _timed()
+    truncated_moments, truncated_t = _timed(truncate_sigma=truncate_sigma)
+    max_err = max(
+        ((dense - truncated).abs().max() / (dense.abs().max() + 1e-12)).item()
+        for dense, truncated in zip(dense_moments, truncated_moments)
+    )
+    speedup = dense_t / max(truncated_t, 1e-12)
+    print(
+        "dense moments take {:.1f} ms, truncated moments (truncate_sigma={}) take {:.1f} ms,"
+        " speedup {:.2f}x, max relative error {:.2e}".format(
+            dense_t * 1000, truncate_sigma, truncated_t * 1000, speedup, max_err
+        )
+    )
+    return max_err <= rtol, speedup
+
+
 def compute_local_fea_from_moments(fea_type, weights, mass, dev, cov):
     fea = None
     B, N, D = cov.shape[0], cov.shape[1], cov.shape[-1]
@@ -145,7 +257,13 @@ def extract_point_fea(flowed, target):
     return flowed, target
 
 
-def feature_extractor(fea_type_list, radius=1.0, std_normalize=True, include_pos=False):
+def feature_extractor(
+    fea_type_list,
+    radius=1.0,
+    std_normalize=True,
+    include_pos=False,
+    truncate_sigma=None,
+):
     def _compute_fea(
         points,
         weights,
@@ -161,11 +279,11 @@ def feature_extractor(fea_type_list, radius=1.0, std_normalize=True, include_pos
             weight_list = [1.0] * len(fea_type_list)
         if gamma is None:
             mass, dev, cov = compute_local_moments(
-                points, radius=radius
+                points, radius=radius, truncate_sigma=truncate_sigma
             )  # (N,), (N, D), (N, D, D)
         else:
             mass, dev, cov = compute_aniso_local_moments(
-                points, gamma=gamma
+                points, gamma=gamma, truncate_sigma=truncate_sigma
             )  # (N,), (N, D), (N, D, D)
         fea_list = [
             compute_local_fea_from_moments(fea_type, weights, mass, dev, cov)
@@ -310,6 +428,7 @@ def compute_anisotropic_gamma_from_points(
     leaf_decay=False,
     mass_thres=2.5,
     return_details=False,
+    truncate_sigma=None,
 ):
     """
     compute inverse covariance matrix for anisotropic kernel
@@ -320,6 +439,8 @@ def compute_anisotropic_gamma_from_points(
     :param principle_weight: list of size D, weight of directions in anistropic kernel, don't have to be norm to 1, will normalized later, if not given, use the eigenvalue instead
     :param eigenvalue_min: float, if the principal vector is not given, then the norm2 normalized eigenvalue will be used for compute the weight of each principle direction,
      this value is to control the weight of the eigenvector, to avoid extreme narraw direction (typically happens when eigenvalue close to zero)
+    :param truncate_sigma: optional float, compute the local moments only from neighbors within truncate_sigma kernel widths,
+     see check_truncated_local_moments for the accuracy/speed tradeoff
     :return: Gamma, torch.Tensor, BxNxDxD  U{\Lambda}^{-2}U^T,  where U is the eigenvector of the local covariance matrix
     """
     aniso_kernel_scale = (
@@ -328,7 +449,11 @@ def compute_anisotropic_gamma_from_points(
     B, N, D, device = points.shape[0], points.shape[1], points.shape[2], points.device
     fea_type_list = ["eigenvalue", "eigenvector"]
     fea_extractor = feature_extractor(
-        fea_type_list, radius=cov_sigma_scale, std_normalize=False, include_pos=False
+        fea_type_list,
+        radius=cov_sigma_scale,
+        std_normalize=False,
+        include_pos=False,
+        truncate_sigma=truncate_sigma,
     )
     combined_fea, mass = fea_extractor(points, weights)
     eigenvalue, eigenvector = combined_fea[:, :, :D], combined_fea[:, :, D:]
@@ -352,7 +477,9 @@ def compute_anisotropic_gamma_from_points(
         aniso_kernel_scale, principle_weight=principle_weight, eigenvector=eigenvector
     )
     if iter_twice:
-        mass, dev, cov = compute_aniso_local_moments(points, Gamma)
+        mass, dev, cov = compute_aniso_local_moments(
+            points, Gamma, truncate_sigma=truncate_sigma
+        )
         eigenvector = compute_local_fea_from_moments(
             "eigenvector", weights, mass, dev, cov
         )
@@ -398,3 +525,36 @@ def compute_anisotropic_gamma_from_points(
         return Gamma  # , principle_weight
     else:
         return Gamma, principle_weight_ouput, eigenvector, mass
+
+
+GAMMA_CACHE = TensorCache(max_bytes=512 * 1024 ** 2, max_items=64, name="gamma_cache")
+
+
+def cached_anisotropic_gamma_from_points(
+    points, weights=None, gamma_cache=None, **gamma_args
+):
+    """
+    same as compute_anisotropic_gamma_from_points, but the Gamma is reused as long as the points
+    and the settings are unchanged, e.g. fixed control points over iterations, multi-scale or evaluation passes
+    the cache is bypassed when the points require grad, since the Gamma is then part of the graph
+
+    :param points: torch.Tensor, BxNxD
+    :param weights: torch.Tensor, BxNx1, not used in the Gamma computation
+    :param gamma_cache: TensorCache, default is the module level GAMMA_CACHE
+    :param gamma_args: settings of compute_anisotropic_gamma_from_points
+    :return: same as compute_anisotropic_gamma_from_points
+    """
+    if points.requires_grad and torch.is_grad_enabled():
+        return compute_anisotropic_gamma_from_points(points, weights, **gamma_args)
+    gamma_cache = gamma_cache if gamma_cache is not None else GAMMA_CACHE
+    settings = tuple(
+        sorted(
+            (key, tuple(item) if isinstance(item, list) else item)
+            for key, item in gamma_args.items()
+        )
+    )
+    return gamma_cache.get_or_compute(
+        points,
+        lambda: compute_anisotropic_gamma_from_points(points, weights, **gamma_args),
+        settings,
+    )
@@ -1,5 +1,6 @@
 import os
 import torch
+import torch.utils.checkpoint
 from copy import deepcopy
 
 
@@ -113,3 +114,143 @@ class VisualWarpper(torch.nn.Module):
         return -output[
             3
         ]  # here we inverse the fea because the class 0 is what we interested
+
+
+class _CheckpointedBlock(object):
+    """
+    recompute the activations of the block in the backward instead of keeping them alive,
+    the non tensor arguments (e.g. a neighbor graph) are closed over, since checkpoint only saves tensors
+    """
+
+    def forward(self, *args, **kwargs):
+        forward = super(_CheckpointedBlock, self).forward
+        tensor_pos = [i for i, arg in enumerate(args) if isinstance(arg, torch.Tensor)]
+        tensor_args = [args[i] for i in tensor_pos]
+        # without an input requiring grad, the checkpointed block would get no gradient
+        if not (
+            self.training
+            and torch.is_grad_enabled()
+            and any(arg.requires_grad for arg in tensor_args)
+        ):
+            return forward(*args, **kwargs)
+
+        def run_block(*tensors):
+            _args = list(args)
+            for i, tensor in zip(tensor_pos, tensors):
+                _args[i] = tensor
+            return forward(*_args, **kwargs)
+
+        return torch.utils.checkpoint.checkpoint(run_block, *tensor_args)
+
+
+class _AutocastBlock(object):
+    """
+    run the block under autocast, the output is cast back to float32,
+    so the coordinates and the neighbor indices computed outside the block stay in float32
+    """
+
+    def forward(self, *args, **kwargs):
+        forward = super(_AutocastBlock, self).forward
+        device = next(arg for arg in args if isinstance(arg, torch.Tensor)).device
+        autocast = get_autocast(device.type, self.autocast_dtype)
+        if autocast is None:
+            return forward(*args, **kwargs)
+        with autocast:
+            output = forward(*args, **kwargs)
+        return _to_float(output)
+
+
+def _to_float(output):
+    if isinstance(output, torch.Tensor):
+        return output.float() if output.is_floating_point() else output
+    if isinstance(output, (list, tuple)):
+        return type(output)(_to_float(item) for item in output)
+    return output
+
+
+def get_autocast(device_type, dtype):
+    """
+    :param device_type: str, cpu/cuda
+    :param dtype: torch.dtype
+    :return: autocast context, None if the autocast is not supported by the torch version for this device
+    """
+    if hasattr(torch, "autocast"):
+        # torch>=1.10, supports bfloat16 on cpu
+        return torch.autocast(device_type=device_type, dtype=dtype)
+    if device_type == "cuda":
+        # the older cuda autocast always runs in float16
+        return torch.cuda.amp.autocast()
+    return None
+
+
+_WRAPPED_CLASSES = {}
+
+
+def _wrap_block_class(module, mixin):
+    cls = type(module)
+    if issubclass(cls, mixin):
+        return
+    key = (cls, mixin)
+    if key not in _WRAPPED_CLASSES:
+        _WRAPPED_CLASSES[key] = type(cls.__name__, (mixin, cls), {})
+    # the class is swapped in place, the state dict and the DataParallel replicas are unchanged
+    module.__class__ = _WRAPPED_CLASSES[key]
+
+
+def _is_block(module, blocks):
+    for block in blocks:
+        if isinstance(block, type):
+            if isinstance(module, block):
+                return True
+        elif any(cls.__name__ == block for cls in type(module).__mro__):
+            return True
+    return False
+
+
+def _find_blocks(net, blocks):
+    """
+    the submodules of a found block are not searched, so a block is never wrapped inside another one
+
+    :param net: nn.Module
+    :param blocks: list of block classes or class names, a class name matches any class of that name
+    :return: list of nn.Module
+    """
+    if _is_block(net, blocks):
+        return [net]
+    found = []
+    for child in net.children():
+        found += _find_blocks(child, blocks)
+    return found
+
+
+def enable_activation_checkpointing(net, block_names):
+    """
+    checkpoint the blocks of the network, i.e. their intermediate activations (e.g. the BxNxKxC grouped features)
+    are recomputed in the backward instead of being stored, the checkpointing is only active in training mode
+
+    :param net: nn.Module
+    :param block_names: list of classes or class names of the blocks, e.g. the pyramid level layers
+    :return: number of checkpointed blocks
+    """
+    blocks = _find_blocks(net, block_names)
+    for block in blocks:
+        _wrap_block_class(block, _CheckpointedBlock)
+    return len(blocks)
+
+
+def enable_block_autocast(net, block_names, dtype="bfloat16"):
+    """
+    run the blocks of the network under autocast
+
+    :param net: nn.Module
+    :param block_names: list of classes or class names of the blocks, e.g. the MLP and WeightNet layers,
+        prefer the classes, a class name also matches the unrelated layers of the same name (e.g. nn.Conv1d)
+    :param dtype: str, bfloat16/float16
+    :return: number of autocast blocks
+    """
+    dtype = getattr(torch, dtype)
+    blocks = _find_blocks(net, block_names)
+    for block in blocks:
+        _wrap_block_class(block, _AutocastBlock)
+        block.autocast_dtype = dtype
+    return len(blocks)
@@ -1,6 +1,7 @@
 import os
 import importlib
 from functools import partial
+from collections.abc import Mapping
 
 KNOWN_MODULES = {
     # Torch
@@ -35,6 +36,7 @@ KNOWN_MODULES = {
     "shape_pair_utils": "shapmagn.shape.shape_pair_utils",
     "torch_kernels": "shapmagn.kernels.torch_kernels",
     "keops_kernels": "shapmagn.kernels.keops_kernels",
+    "auto_kernels": "shapmagn.kernels.auto_kernels",
     "point_interpolator": "shapmagn.shape.point_interpolator",
     "geomloss": "geomloss",
     "nn": "torch.nn",
@@ -48,6 +50,60 @@ KNOWN_MODULES = {
 }
 
 
+def import_object(obj_path):
+    """
+    import an object from its path, the module part of the path can be a key of KNOWN_MODULES
+
+    :param obj_path: str, "module_path.object_name", e.g. "keops_kernels.LazyKeopsKernel"
+    :return: the object
+    """
+    module_name, obj_name = os.path.splitext(obj_path)
+    module = importlib.import_module(
+        KNOWN_MODULES[module_name] if module_name in KNOWN_MODULES else module_name
+    )
+    return getattr(module, obj_name[1:])
+
+
+class LazyRegistry(Mapping):
+    """
+    a read-only dict of {name: "module_path.object_name"}, the object is only imported at its first lookup,
+    so building the registry doesn't import any model/loss/dataset (and their heavy dependencies)
+    """
+
+    def __init__(self, registry):
+        """
+        :param registry: dict, {name: "module_path.object_name" or an object}
+        """
+        self._registry = dict(registry)
+        self._loaded = {}
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            obj = self._registry[name]
+            self._loaded[name] = import_object(obj) if isinstance(obj, str) else obj
+        return self._loaded[name]
+
+    def __contains__(self, name):
+        return name in self._registry
+
+    def __iter__(self):
+        return iter(self._registry)
+
+    def __len__(self):
+        return len(self._registry)
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, list(self._registry.keys()))
+
+    def register(self, name, obj):
+        """
+        :param name: str
+        :param obj: "module_path.object_name" or an object
+        """
+        self._registry[name] = obj
+        self._loaded.pop(name, None)
+
+
 def extract_args(*args, **kwargs):
     return args, kwargs
 
@@ -87,12 +143,7 @@ def obj_factory(obj_exp, *args, **kwargs):
 
     # From here we can assume that dots in the remaining of the expression
     # only separate between modules_reg and classes
-    module_name, class_name = os.path.splitext(obj_exp)
-    class_name = class_name[1:]
-    module = importlib.import_module(
-        KNOWN_MODULES[module_name] if module_name in KNOWN_MODULES else module_name
-    )
-    module_class = getattr(module, class_name)
+    module_class = import_object(obj_exp)
     class_instance = module_class(*args, **kwargs)
 
     return class_instance
@@ -135,12 +186,7 @@ def partial_obj_factory(obj_exp, *args, **kwargs):
 
     # From here we can assume that dots in the remaining of the expression
     # only separate between modules_reg and classes
-    module_name, class_name = os.path.splitext(obj_exp)
-    class_name = class_name[1:]
-    module = importlib.import_module(
-        KNOWN_MODULES[module_name] if module_name in KNOWN_MODULES else module_name
-    )
-    module_class = getattr(module, class_name)
+    module_class = import_object(obj_exp)
 
     return partial(module_class, *args, **kwargs)
 
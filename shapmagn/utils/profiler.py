@@ -0,0 +1,208 @@
+"""
+per-stage profiling of the registration, nested timers and counters
+
+    with profile("sampling"):
+        ...
+    count("ode_nfe", nfe)
+    flush_profile(scale=0, iter=10)
+
+the timers opened inside another timer are recorded under "outer/inner", the timers and
+counters are accumulated until flush_profile, which writes one json line (and optionally the
+tensorboard scalars) with the accumulated values and the peak cuda memory since the last flush.
+the profiler is disabled by default, then profile returns a shared empty context and count returns
+immediately, so the instrumented code runs without measurable overhead
+"""
+import os
+import json
+import time
+import atexit
+import threading
+import torch
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        stack = self.profiler.get_stack()
+        stack.append(self.name)
+        self.path = "/".join(stack)
+        self.profiler.synchronize()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.synchronize()
+        elapsed = time.perf_counter() - self.start
+        self.profiler.get_stack().pop()
+        self.profiler.add_time(self.path, elapsed)
+        return False
+
+
+class Profiler(object):
+    def __init__(self, jsonl_path, tensorboard_path=None, sync_cuda=True):
+        """
+        :param jsonl_path: str, the records are appended into this file
+        :param tensorboard_path: str, optional, if set, the records are also logged with the TensorBoardLogger
+        :param sync_cuda: bool, synchronize cuda before reading the clock, otherwise the asynchronous kernels are
+            accounted to the stage that waits for them
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+        self.jsonl_path = jsonl_path
+        self.file = open(jsonl_path, "a")
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.tb_logger = None
+        if tensorboard_path is not None:
+            from shapmagn.utils.tensorboard_logger import TensorBoardLogger
+
+            self.tb_logger = TensorBoardLogger(tensorboard_path)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.step = 0
+        self.reset()
+
+    def reset(self):
+        self.timers = {}
+        self.counters = {}
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+
+    def get_stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def synchronize(self):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+
+    def add_time(self, path, elapsed):
+        with self.lock:
+            timer = self.timers.setdefault(path, {"total": 0.0, "count": 0, "max": 0.0})
+            timer["total"] += elapsed
+            timer["count"] += 1
+            timer["max"] = max(timer["max"], elapsed)
+
+    def add_count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def flush(self, **tags):
+        """
+        :param tags: json serializable values or tensors that identify the record, e.g. scale, iter, pair name,
+            the tensors are only copied to the host here, i.e. when the profiler is enabled
+        """
+        tags = {
+            key: tag.detach().tolist() if isinstance(tag, torch.Tensor) else tag
+            for key, tag in tags.items()
+        }
+        with self.lock:
+            record = {
+                "step": self.step,
+                "time": time.time(),
+                "timers": self.timers,
+                "counters": self.counters,
+            }
+            record.update(tags)
+            if torch.cuda.is_available():
+                record["peak_memory_mb"] = torch.cuda.max_memory_allocated() / 1024 ** 2
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            if self.tb_logger is not None:
+                self.tb_logger.reset()
+                self.tb_logger.update(
+                    "time", **{k: v["total"] for k, v in self.timers.items()}
+                )
+                self.tb_logger.update("counters", **self.counters)
+                if "peak_memory_mb" in record:
+                    self.tb_logger.update("memory", peak_memory_mb=record["peak_memory_mb"])
+                self.tb_logger.log_scalars_val("profile", self.step)
+            self.step += 1
+            self.reset()
+
+    def close(self):
+        if self.timers or self.counters:
+            self.flush()
+        self.file.close()
+        if self.tb_logger is not None:
+            self.tb_logger.close()
+
+
+_profiler = None
+
+
+def enable_profiler(jsonl_path, tensorboard_path=None, sync_cuda=True):
+    """
+    start the module level profiler, see Profiler
+    """
+    global _profiler
+    disable_profiler()
+    _profiler = Profiler(jsonl_path, tensorboard_path, sync_cuda)
+
+
+def disable_profiler():
+    """
+    flush the pending records and stop the module level profiler
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.close()
+
+
+def profiler_enabled():
+    return _profiler is not None
+
+
+def profile(name):
+    """
+    :param name: str, name of the stage
+    :return: context manager that times the stage
+    """
+    profiler = _profiler
+    if profiler is None:
+        return _NULL_TIMER
+    return _Timer(profiler, name)
+
+
+def profiled(name):
+    """
+    decorator version of profile
+    """
+
+    def decorator(func):
+        def wrapper(*args, **kwargs):
+            with profile(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1):
+    profiler = _profiler
+    if profiler is not None:
+        profiler.add_count(name, value)
+
+
+def flush_profile(**tags):
+    profiler = _profiler
+    if profiler is not None:
+        profiler.flush(**tags)
+
+
+atexit.register(disable_profiler)
@@ -0,0 +1,140 @@
+"""
+persistent store of the registration results, used to warm start the optimization
+
+an entry keeps the final solution of one pair for one stage (e.g. prealign_opt, lddmm_opt):
+reg_param, control points/weights, flowed control points and flowed points.
+the entries are saved as store_path/stage/pair_name/{source_hash}_{target_hash}_{settings_hash}.npz,
+where the hashes are computed on the input points/weights and on the method settings, a lookup returns
+
+    "exact": same pair, same input and same settings, the optimization can be skipped
+    "warm": same pair and same input solved with other settings
+    "inverse": the solution of the inverse pair (target->source, e.g. the '_inverse' pairs of aug_data_via_inverse_reg_direction)
+"""
+import os
+import glob
+import json
+import hashlib
+import tempfile
+import numpy as np
+from shapmagn.utils.module_parameters import ParameterDict
+
+HASH_LEN = 16
+INVERSE_SUFFIX = "_inverse"
+# settings that don't change the solution
+IGNORED_SETTINGS = ["record_path"]
+
+
+def get_shape_content_hash(shape):
+    """
+    :param shape: Shape, batched
+    :return: list of str, content hash of the points and weights of each batch element
+    """
+    hash_list = []
+    for b in range(shape.nbatch):
+        sha = hashlib.sha1()
+        for tensor in [shape.points[b], shape.weights[b]]:
+            array = tensor.detach().contiguous().cpu().numpy()
+            sha.update(str(array.shape).encode())
+            sha.update(array.tobytes())
+        hash_list.append(sha.hexdigest()[:HASH_LEN])
+    return hash_list
+
+
+def get_settings_hash(*settings):
+    """
+    :param settings: ParameterDict or json serializable objects
+    :return: str
+    """
+
+    def to_json_obj(setting):
+        if isinstance(setting, ParameterDict):
+            setting = setting.ext
+        if isinstance(setting, dict):
+            return {
+                key: value
+                for key, value in setting.items()
+                if key not in IGNORED_SETTINGS
+            }
+        return setting
+
+    settings = [to_json_obj(setting) for setting in settings]
+    return hashlib.sha1(
+        json.dumps(settings, sort_keys=True, default=str).encode()
+    ).hexdigest()[:HASH_LEN]
+
+
+def get_inverse_pair_name(pair_name):
+    if pair_name.endswith(INVERSE_SUFFIX):
+        return pair_name[: -len(INVERSE_SUFFIX)]
+    return pair_name + INVERSE_SUFFIX
+
+
+class RegResultStore(object):
+    def __init__(self, store_path):
+        """
+        :param store_path: str, root folder of the store
+        """
+        self.store_path = store_path
+        os.makedirs(store_path, exist_ok=True)
+
+    def get_pair_folder(self, stage, pair_name):
+        return os.path.join(self.store_path, stage, pair_name.replace(os.sep, "_"))
+
+    def get_entry_path(self, stage, pair_name, source_hash, target_hash, settings_hash):
+        return os.path.join(
+            self.get_pair_folder(stage, pair_name),
+            "{}_{}_{}.npz".format(source_hash, target_hash, settings_hash),
+        )
+
+    def save(self, stage, pair_name, source_hash, target_hash, settings_hash, **arrays):
+        """
+        :param arrays: numpy arrays of a single pair, None values are skipped
+        """
+        path = self.get_entry_path(stage, pair_name, source_hash, target_hash, settings_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {key: value for key, value in arrays.items() if value is not None}
+        # write into a temporary file first, a concurrent reader never sees a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            return {key: data[key] for key in data.files}
+
+    def _find_latest(self, stage, pair_name, prefix=""):
+        path_list = glob.glob(
+            os.path.join(self.get_pair_folder(stage, pair_name), prefix + "*.npz")
+        )
+        return max(path_list, key=os.path.getmtime) if path_list else None
+
+    def lookup(
+        self,
+        stage,
+        pair_name,
+        source_hash,
+        target_hash,
+        settings_hash,
+        allow_warm=True,
+        allow_inverse=True,
+    ):
+        """
+        :return: (match, arrays), match is "exact", "warm", "inverse" or None
+        """
+        path = self.get_entry_path(stage, pair_name, source_hash, target_hash, settings_hash)
+        if os.path.isfile(path):
+            return "exact", self.load(path)
+        same_input = "{}_{}_".format(source_hash, target_hash)
+        inverse_input = "{}_{}_".format(target_hash, source_hash)
+        if allow_warm:
+            path = self._find_latest(stage, pair_name, same_input)
+            if path is not None:
+                return "warm", self.load(path)
+        if allow_inverse:
+            for name in [get_inverse_pair_name(pair_name), pair_name]:
+                path = self._find_latest(stage, name, inverse_input)
+                if path is not None:
+                    return "inverse", self.load(path)
+        return None, None
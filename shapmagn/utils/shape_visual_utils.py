@@ -3,22 +3,21 @@ import numpy as np
 import torch
 import pyvista as pv
 from shapmagn.datasets.vtk_utils import convert_faces_into_file_format
+from shapmagn.utils.async_writer import submit_write
 
 
-def save_shape_into_file(folder_path, alias, pair_name, ftype="vtk", **args):
-    for key, item in args.items():
-        if isinstance(item, torch.Tensor):
-            args[key] = item.cpu().detach().numpy()
+def _snapshot(item):
+    # the copy is made before the write is queued, so later in-place updates don't leak into the file
+    if isinstance(item, torch.Tensor):
+        return item.detach().to("cpu", copy=True).numpy()
+    if isinstance(item, np.ndarray):
+        return item.copy()
+    return item
+
+
+def _write_shape_file(folder_path, alias, pair_name, ftype, args):
     points = args["points"]
-    if len(points.shape) == 3:
-        nbatch, _, _ = points.shape
-    elif len(points.shape) == 2:
-        points = points[None]
-        for key, item in args.items():
-            args[key] = args[key][None]
-        nbatch = 1
-    else:
-        raise ValueError("shape not supported")
+    nbatch = points.shape[0]
     os.makedirs(folder_path, exist_ok=True)
     faces = args["faces"] if "faces" in args else None
     for b in range(nbatch):
@@ -36,6 +35,23 @@ def save_shape_into_file(folder_path, alias, pair_name, ftype="vtk", **args):
         data.save(fpath)
 
 
+def save_shape_into_file(folder_path, alias, pair_name, ftype="vtk", **args):
+    """
+    the file is written in the background if the async writer is enabled, see async_writer.enable_async_writer
+    """
+    args = {key: _snapshot(item) for key, item in args.items()}
+    points = args["points"]
+    if len(points.shape) == 3:
+        pass
+    elif len(points.shape) == 2:
+        args = {
+            key: item[None] if item is not None else None for key, item in args.items()
+        }
+    else:
+        raise ValueError("shape not supported")
+    submit_write(_write_shape_file, folder_path, alias, list(pair_name), ftype, args)
+
+
 def save_shape_into_files(folder_path, alias, name, shape):
 
     attri_dict_to_save = {"points": shape.points, "weights": shape.weights}
@@ -88,8 +104,12 @@ def save_shape_pair_into_files(folder_path, stage_name, pair_name, shape_pair):
                 }
             )
         else:
-            reg_param = shape_pair.reg_param.detach().cpu().numpy()
-            np.save(os.path.join(folder_path, "reg_param_prealigned.npy"), reg_param)
+            reg_param = _snapshot(shape_pair.reg_param)
+            submit_write(
+                np.save,
+                os.path.join(folder_path, "reg_param_prealigned.npy"),
+                reg_param,
+            )
 
 
 def make_sphere(npoints=6000, ndim=3, radius=None, center=None):
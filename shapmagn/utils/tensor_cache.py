@@ -0,0 +1,152 @@
+"""
+LRU cache for quantities derived from (static) point tensors, e.g. the anisotropic Gamma or a knn graph
+
+an entry is keyed by the content of the input tensor plus the settings used to compute it.
+hashing the content is O(N), so the content hash of a tensor is memorized together with
+its identity and version counter, a repeated query on the same unmodified tensor skips the hashing.
+"""
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+import torch
+
+
+def tensor_content_hash(tensor):
+    """
+    :param tensor: torch.Tensor
+    :return: str, sha1 of the tensor content together with its shape, dtype and device
+    """
+    array = tensor.detach().contiguous().cpu().numpy()
+    return "{}_{}_{}_{}".format(
+        hashlib.sha1(array.tobytes()).hexdigest(),
+        tuple(tensor.shape),
+        tensor.dtype,
+        tensor.device,
+    )
+
+
+def get_nbytes(obj):
+    if isinstance(obj, torch.Tensor):
+        return obj.element_size() * obj.nelement()
+    if isinstance(obj, (list, tuple)):
+        return sum(get_nbytes(_obj) for _obj in obj)
+    if isinstance(obj, dict):
+        return sum(get_nbytes(_obj) for _obj in obj.values())
+    return 0
+
+
+class TensorCache(object):
+    """
+    LRU cache with a byte budget, keyed by (tensor content, settings)
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2, max_items=64, name="tensor_cache"):
+        """
+        :param max_bytes: int, byte budget of the cached values, the least recently used entries are evicted first
+        :param max_items: int, max number of the cached entries
+        :param name: str, used in the report
+        """
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.name = name
+        self._entries = OrderedDict()
+        self._identity = {}
+        self._lock = threading.RLock()
+        self.cur_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _forget(self, key, ref):
+        ident = self._identity.get(key, None)
+        if ident is not None and ident[0] is ref:
+            del self._identity[key]
+
+    def get_content_key(self, tensor):
+        """
+        the content hash is only recomputed if the tensor is a new object or has been modified in place
+        """
+        key = id(tensor)
+        ident = self._identity.get(key, None)
+        if ident is not None:
+            ref, version, content_hash = ident
+            if ref() is tensor and tensor._version == version:
+                return content_hash
+        content_hash = tensor_content_hash(tensor)
+        ref = weakref.ref(tensor, lambda _ref, _key=key: self._forget(_key, _ref))
+        self._identity[key] = (ref, tensor._version, content_hash)
+        return content_hash
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        nbytes = get_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.cur_bytes -= self._entries.pop(key)[1]
+            while self._entries and (
+                self.cur_bytes + nbytes > self.max_bytes
+                or len(self._entries) >= self.max_items
+            ):
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self.cur_bytes -= evicted_nbytes
+                self.evictions += 1
+            self._entries[key] = (value, nbytes)
+            self.cur_bytes += nbytes
+
+    def get_or_compute(self, tensor, compute_fn, settings=()):
+        """
+        :param tensor: torch.Tensor, the input the value is computed from
+        :param compute_fn: callable without argument, compute the value on a miss
+        :param settings: hashable, settings that affect the value
+        :return: the cached or the newly computed value
+        """
+        with self._lock:
+            key = (self.get_content_key(tensor), settings)
+        value = self.get(key)
+        if value is None:
+            value = compute_fn()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._identity.clear()
+            self.cur_bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+            "items": len(self._entries),
+            "bytes": self.cur_bytes,
+        }
+
+    def report(self):
+        stats = self.stats()
+        print(
+            "{}: {} hits, {} misses (hit rate {:.2f}), {} evictions, {} items, {:.1f} MB".format(
+                self.name,
+                stats["hits"],
+                stats["misses"],
+                stats["hit_rate"],
+                stats["evictions"],
+                stats["items"],
+                stats["bytes"] / 1024 ** 2,
+            )
+        )
+        return stats
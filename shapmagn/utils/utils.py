@@ -6,17 +6,11 @@ from functools import partial
 import torch
 import random
 import warnings
-import requests
 from tqdm import tqdm
 import torch.backends.cudnn as cudnn
 import torch.nn.init as init
 import numpy as np
-from pykeops.numpy.cluster import (
-    grid_cluster,
-    cluster_ranges_centroids,
-    sort_clusters,
-    from_matrix,
-)
+from shapmagn.utils.profiler import profile
 
 
 def init_weights(m, init_type="normal", gain=0.02):
@@ -196,6 +190,7 @@ def download_from_url(url, output_path):
         url (str): File URL
         output_path (str): Output path to write the file to
     """
+    import requests
 
     def process_response(r):
         chunk_size = 16 * 1024
@@ -421,6 +416,7 @@ def memory_sort(points, eps=0.0):
     :param points: BxNxD or NxD  tenosr /array
     :return:
     """
+    from pykeops.numpy.cluster import grid_cluster, sort_clusters
 
     def _sort(points, eps):
         x_labels = grid_cluster(points, eps)
@@ -454,6 +450,8 @@ def memory_sort(points, eps=0.0):
 
 
 def memory_sort_helper(x, x_labels):
+    from pykeops.numpy.cluster import sort_clusters
+
     is_tensor = isinstance(x, torch.Tensor)
     has_batch = len(x.shape) == 3
     if is_tensor:
@@ -514,38 +512,25 @@ def index_points(points, idx):
     return new_points
 
 
-def timming(func, message=""):
-    start = torch.cuda.Event(enable_timing=True)
-    end = torch.cuda.Event(enable_timing=True)
-
-    def time_diff(*args, **kwargs):
-        try:
-            start.record()
-            res = func(*args, **kwargs)
-            end.record()
-            torch.cuda.synchronize()
-            print("{}, it takes {} ms".format(message, start.elapsed_time(end)))
-        except:
-            res = func(*args, **kwargs)
-        return res
-
-    return time_diff
-
-
 def timming(func, message="", return_t=False):
+    """
+    print the cuda time of func, the time is also recorded by the profiler (utils/profiler.py) if it is enabled
+    """
     start = torch.cuda.Event(enable_timing=True)
     end = torch.cuda.Event(enable_timing=True)
+    name = message or getattr(func, "__name__", "timming")
 
     def time_diff(*args, **kwargs):
-        try:
-            start.record()
-            res = func(*args, **kwargs)
-            end.record()
-            torch.cuda.synchronize()
-            t = start.elapsed_time(end)
-            print("{}, it takes {} ms".format(message, t))
-        except:
-            res = func(*args, **kwargs)
+        with profile(name):
+            try:
+                start.record()
+                res = func(*args, **kwargs)
+                end.record()
+                torch.cuda.synchronize()
+                t = start.elapsed_time(end)
+                print("{}, it takes {} ms".format(message, t))
+            except:
+                res = func(*args, **kwargs)
         if not return_t:
             return res
         else:
@@ -0,0 +1,143 @@
+"""
+voxel-hash neighbor index used by the truncated (block-sparse) kernel reductions
+
+points are hashed into voxels of size "cutoff", so two points closer than the cutoff always
+fall into voxels whose integer coordinates differ by at most one along each axis.
+the voxel pairs are then turned into the "ranges" format of the KeOps block-sparse reduction,
+see https://www.kernel-operations.io/keops/_auto_tutorials/a_LazyTensors/plot_lazytensors_c.html
+"""
+import torch
+
+
+def voxel_hash(points, voxel_size, origin=None):
+    """
+    :param points: NxD tensor
+    :param voxel_size: float
+    :param origin: optional D tensor, the lower corner of the voxel grid, default is the min of the points
+    :return: labels: N long tensor, the voxel id of each point,   voxel_coords: CxD long tensor, integer coordinate of each voxel
+    """
+    if origin is None:
+        origin = points.min(0)[0]
+    coords = ((points - origin) / voxel_size).floor().long()
+    voxel_coords, labels = torch.unique(coords, dim=0, return_inverse=True)
+    return labels, voxel_coords
+
+
+def neighbor_voxel_pairs(x_voxel_coords, y_voxel_coords, reach=1):
+    """
+    find all the (x voxel, y voxel) pairs whose integer coordinates differ by at most "reach" along each axis
+
+    :param x_voxel_coords: CxxD long tensor
+    :param y_voxel_coords: CyxD long tensor
+    :param reach: int
+    :return: pair_i: P long tensor, index of x voxels,  pair_j: P long tensor, index of y voxels
+    """
+    D, device = x_voxel_coords.shape[-1], x_voxel_coords.device
+    extent = (
+        torch.max(x_voxel_coords.max(0)[0], y_voxel_coords.max(0)[0]) + 2 * reach + 1
+    )
+    stride = torch.cumprod(
+        torch.cat([torch.ones(1, dtype=torch.long, device=device), extent[:-1]]), 0
+    )
+    y_keys = ((y_voxel_coords + reach) * stride).sum(-1)
+    y_keys_sorted, y_order = y_keys.sort()
+    offsets = torch.cartesian_prod(
+        *[torch.arange(-reach, reach + 1, device=device)] * D
+    ).view(-1, D)
+    pair_i_list, pair_j_list = [], []
+    for offset in offsets:
+        x_keys = ((x_voxel_coords + reach + offset) * stride).sum(-1)
+        pos = torch.searchsorted(y_keys_sorted, x_keys).clamp(max=len(y_keys) - 1)
+        found = y_keys_sorted[pos] == x_keys
+        pair_i_list.append(torch.nonzero(found, as_tuple=False).view(-1))
+        pair_j_list.append(y_order[pos[found]])
+    return torch.cat(pair_i_list), torch.cat(pair_j_list)
+
+
+def ranges_from_pairs(ranges_i, ranges_j, pair_i, pair_j):
+    """
+    sparse counterpart of pykeops.torch.cluster.from_matrix, the kept cluster pairs are given as index lists
+    instead of a dense CxxCy boolean mask
+
+    :param ranges_i: Cxx2 int tensor, [start,end) of each x cluster
+    :param ranges_j: Cyx2 int tensor, [start,end) of each y cluster
+    :param pair_i: P long tensor, index of x clusters
+    :param pair_j: P long tensor, index of y clusters
+    :return: ranges_ij, the 6-tuple consumed by the KeOps block-sparse reduction
+    """
+    n_i, n_j = ranges_i.shape[0], ranges_j.shape[0]
+    order_i = torch.argsort(pair_i * n_j + pair_j)
+    redranges_j = ranges_j[pair_j[order_i]]
+    slices_i = torch.bincount(pair_i, minlength=n_i).cumsum(0).int()
+    order_j = torch.argsort(pair_j * n_i + pair_i)
+    redranges_i = ranges_i[pair_i[order_j]]
+    slices_j = torch.bincount(pair_j, minlength=n_j).cumsum(0).int()
+    return ranges_i, slices_i, redranges_j, ranges_j, slices_j, redranges_i
+
+
+def _cluster_ranges(labels, n_cluster):
+    counts = torch.bincount(labels, minlength=n_cluster)
+    end = counts.cumsum(0)
+    return torch.stack([end - counts, end], 1).int()
+
+
+def build_truncated_ranges(x, y, cutoff, return_stats=False):
+    """
+    build the block-sparse ranges so that only the x,y pairs closer than the cutoff are guaranteed to be visited
+    the reduction has to be done on the sorted points, i.e. x[x_order], y[y_order]
+
+    :param x: NxD tensor
+    :param y: MxD tensor
+    :param cutoff: float, interactions farther than the cutoff can be dropped
+    :param return_stats: bool, return the ratio of the visited pairs over the dense N*M pairs
+    :return: x_order: N long tensor, y_order: M long tensor, ranges_ij, (optional) density
+    """
+    origin = torch.min(x.min(0)[0], y.min(0)[0]).detach()
+    x_labels, x_voxel_coords = voxel_hash(x.detach(), cutoff, origin)
+    y_labels, y_voxel_coords = voxel_hash(y.detach(), cutoff, origin)
+    x_ranges = _cluster_ranges(x_labels, x_voxel_coords.shape[0])
+    y_ranges = _cluster_ranges(y_labels, y_voxel_coords.shape[0])
+    pair_i, pair_j = neighbor_voxel_pairs(x_voxel_coords, y_voxel_coords, reach=1)
+    ranges_ij = ranges_from_pairs(x_ranges, y_ranges, pair_i, pair_j)
+    x_order, y_order = torch.argsort(x_labels), torch.argsort(y_labels)
+    if not return_stats:
+        return x_order, y_order, ranges_ij
+    x_size = (x_ranges[:, 1] - x_ranges[:, 0]).float()
+    y_size = (y_ranges[:, 1] - y_ranges[:, 0]).float()
+    density = (x_size[pair_i] * y_size[pair_j]).sum().item() / (
+        x.shape[0] * y.shape[0]
+    )
+    return x_order, y_order, ranges_ij, density
+
+
+def build_radius_neighbors(x, y, radius):
+    """
+    list all the x,y pairs closer than the radius, the candidate pairs are taken from the neighboring voxels
+
+    :param x: NxD tensor
+    :param y: MxD tensor
+    :param radius: float
+    :return: index_i: P long tensor, index_j: P long tensor, sorted by (i,j), i.e. the CSR order
+    """
+    x, y = x.detach(), y.detach()
+    origin = torch.min(x.min(0)[0], y.min(0)[0])
+    x_labels, x_voxel_coords = voxel_hash(x, radius, origin)
+    y_labels, y_voxel_coords = voxel_hash(y, radius, origin)
+    x_ranges = _cluster_ranges(x_labels, x_voxel_coords.shape[0]).long()
+    y_ranges = _cluster_ranges(y_labels, y_voxel_coords.shape[0]).long()
+    x_order, y_order = torch.argsort(x_labels), torch.argsort(y_labels)
+    pair_i, pair_j = neighbor_voxel_pairs(x_voxel_coords, y_voxel_coords, reach=1)
+    # expand each voxel pair into the point pairs of the two voxels
+    size_i = x_ranges[pair_i, 1] - x_ranges[pair_i, 0]
+    size_j = y_ranges[pair_j, 1] - y_ranges[pair_j, 0]
+    counts = size_i * size_j
+    pair_id = torch.repeat_interleave(torch.arange(len(counts), device=x.device), counts)
+    local = torch.arange(len(pair_id), device=x.device) - (counts.cumsum(0) - counts)[pair_id]
+    local_i = local // size_j[pair_id]
+    local_j = local % size_j[pair_id]
+    index_i = x_order[x_ranges[pair_i, 0][pair_id] + local_i]
+    index_j = y_order[y_ranges[pair_j, 0][pair_id] + local_j]
+    within = ((x[index_i] - y[index_j]) ** 2).sum(-1) <= radius ** 2
+    index_i, index_j = index_i[within], index_j[within]
+    order = torch.argsort(index_i * y.shape[0] + index_j)
+    return index_i[order], index_j[order]